@@ -0,0 +1,61 @@
+import argparse
+import json
+import time
+from application.database import db
+from application.models import Test
+from application.analytics import analyze_test, BOOTSTRAP_RESAMPLES, CONFIDENCE
+from main import app
+
+
+def print_stats(title, stats):
+    print(title)
+    for name, row in stats.items():
+        extra = ''.join(f"  {key}={row[key]}" for key in ('better', 'equal', 'worse') if key in row)
+        print(f"  {name:30} n={row['n']:<8} mean={row['mean']}  "
+              f"[{row['ci_low']}, {row['ci_high']}]{extra}")
+
+
+def analyze_test_results(test_id: int, resamples: int, confidence: float, seed: int, output_path: str = ""):
+    with app.app_context():
+        test = db.session.query(Test.test_type).filter_by(id=test_id).first()
+        if not test:
+            raise SystemExit(f"Test {test_id} not found")
+
+        start = time.perf_counter()
+        summary = analyze_test(test_id, test.test_type, resamples, confidence, seed)
+        elapsed = time.perf_counter() - start
+
+    print(f"{test.test_type} test {test_id}: {summary['ratings']} rated audios, "
+          f"{confidence:.0%} intervals from {resamples} resamples over raters ({elapsed:.2f}s)")
+    print_stats('Per system:', summary['systems'])
+    if summary.get('reference'):
+        print_stats('Reference:', {'reference': summary['reference']})
+    for group in ('attributes', 'reasons'):
+        for name, stats in summary.get(group, {}).items():
+            print_stats(f"{name}:", stats)
+    if 'confusion_matrix' in summary:
+        matrix = summary['confusion_matrix']
+        print('Confusion matrix (rows: true label, columns: chosen):')
+        print(' ' * 20 + ''.join(f"{label:>12}" for label in matrix['chosen']))
+        for label, row in zip(matrix['true'], matrix['counts']):
+            print(f"{label:>20}" + ''.join(f"{count:>12}" for count in row))
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summary statistics of the ratings of a test')
+    parser.add_argument('test_id', type=int, help='ID of the test to analyze')
+    parser.add_argument('--resamples', type=int, default=BOOTSTRAP_RESAMPLES,
+                      help='Bootstrap resamples for the confidence intervals')
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE, help='Confidence level')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the resampling')
+    parser.add_argument('--output', default='', help='Also write the summary as JSON to this file')
+
+    args = parser.parse_args()
+
+    analyze_test_results(args.test_id, args.resamples, args.confidence, args.seed, args.output)
+
+# Example usage:
+# python analyze_results.py 12 --resamples 2000 --output mushra_12_summary.json
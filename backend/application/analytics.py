@@ -0,0 +1,199 @@
+import warnings
+import numpy as np
+from application.database import db
+from application.models import RatingScore, TestType
+from application.export import HFR_GRANULAR_REASONS, MUSHRA_GRANULAR_ATTRIBUTES
+
+# rating_score rows fetched per round trip while loading a test
+ANALYTICS_BATCH_SIZE = 50000
+
+BOOTSTRAP_RESAMPLES = 1000
+CONFIDENCE = 0.95
+# Resamples whose rater weights are drawn at once (a chunk x raters matrix)
+BOOTSTRAP_CHUNK_SIZE = 500
+
+
+class ScoreArrays:
+    """
+    The rating_score rows of one test and role as NumPy arrays: raters, system and
+    label codes (indexes into systems / labels), scores and any extra columns.
+    """
+
+    def __init__(self, raters, systems, system_codes, labels, label_codes, scores, extra):
+        self.raters = raters
+        self.systems = systems
+        self.system_codes = system_codes
+        self.labels = labels
+        self.label_codes = label_codes
+        self.scores = scores
+        self.extra = extra
+
+    def __len__(self):
+        return len(self.scores)
+
+
+def encode(values):
+    """Distinct values (None read as "") and the code of every element."""
+    array = np.asarray(values, dtype=object)
+    array[np.equal(array, None)] = ''
+    names, codes = np.unique(array.astype(str), return_inverse=True)
+    return names.tolist(), codes
+
+
+def load_scores(test_id, role='test', extra=None):
+    """
+    Bulk-load the scores of a test. extra maps names to SQL expressions over
+    rating_score (e.g. a JSON attribute) that are loaded as float columns.
+    """
+    extra = extra or {}
+    columns = [RatingScore.rater_id, RatingScore.system, RatingScore.label, RatingScore.score] + list(extra.values())
+    result = db.session.execute(
+        db.select(*columns).where(RatingScore.test_id == test_id, RatingScore.role == role)
+        .execution_options(yield_per=ANALYTICS_BATCH_SIZE)
+    )
+    data = [[] for _ in columns]
+    for partition in result.partitions():
+        for values, column in zip(zip(*partition), data):
+            column.extend(values)
+
+    systems, system_codes = encode(data[1])
+    labels, label_codes = encode(data[2])
+    return ScoreArrays(
+        raters=np.asarray(data[0], dtype=np.int64),
+        systems=systems,
+        system_codes=system_codes,
+        labels=labels,
+        label_codes=label_codes,
+        scores=np.asarray(data[3], dtype=float),  # None becomes NaN
+        extra={name: np.asarray(values, dtype=float) for name, values in zip(extra, data[4:])}
+    )
+
+
+def bootstrap_means(values, groups, n_groups, raters, resamples=BOOTSTRAP_RESAMPLES,
+                    confidence=CONFIDENCE, seed=0, chunk_size=BOOTSTRAP_CHUNK_SIZE):
+    """
+    Mean of values per group with a percentile bootstrap confidence interval.
+    Raters are resampled rather than single ratings, since the ratings of one
+    rater are not independent. Ratings are first reduced to per (group, rater)
+    sums and counts, so each resample is a matrix product over raters and the
+    cost no longer depends on the number of ratings. Resamples are drawn
+    chunk_size at a time, which bounds memory whatever the number of resamples.
+    Returns counts, means, lower and upper bounds, one entry per group.
+    """
+    valid = ~np.isnan(values)
+    values, groups, raters = values[valid], groups[valid], raters[valid]
+    _, rater_index = np.unique(raters, return_inverse=True)
+    n_raters = int(rater_index.max()) + 1 if len(rater_index) else 0
+
+    cells = groups * n_raters + rater_index
+    sums = np.bincount(cells, weights=values, minlength=n_groups * n_raters).reshape(n_groups, n_raters)
+    counts = np.bincount(cells, minlength=n_groups * n_raters).reshape(n_groups, n_raters).astype(float)
+    n = counts.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums.sum(axis=1) / n
+        if n_raters == 0 or resamples <= 0:
+            nan = np.full(n_groups, np.nan)
+            return n.astype(int), means, nan, nan
+        rng = np.random.default_rng(seed)
+        boot = np.empty((n_groups, resamples))
+        for start in range(0, resamples, chunk_size):
+            size = min(chunk_size, resamples - start)
+            # Row r holds how often each rater is drawn in resample start + r
+            weights = rng.multinomial(n_raters, np.full(n_raters, 1 / n_raters), size=size).astype(float)
+            boot[:, start:start + size] = (sums @ weights.T) / (counts @ weights.T)
+
+    tail = (1 - confidence) / 2 * 100
+    bounds = np.full((2, n_groups), np.nan)
+    defined = n > 0
+    if defined.any():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # With very few raters a resample can miss a group
+            bounds[:, defined] = np.nanpercentile(boot[defined], [tail, 100 - tail], axis=1)
+    return n.astype(int), means, bounds[0], bounds[1]
+
+
+def _number(value):
+    return None if value is None or np.isnan(value) else round(float(value), 4)
+
+
+def group_stats(names, values, groups, raters, **bootstrap):
+    n, means, lower, upper = bootstrap_means(values, groups, len(names), raters, **bootstrap)
+    return {name: {'n': int(n[i]), 'mean': _number(means[i]),
+                   'ci_low': _number(lower[i]), 'ci_high': _number(upper[i])}
+            for i, name in enumerate(names) if n[i]}
+
+
+def mushra_summary(test_id, granular=False, **bootstrap):
+    """Mean score per system (and per attribute for MUSHRA granular), plus the reference."""
+    extra = {attribute: RatingScore.attributes[attribute].as_float()
+             for attribute in MUSHRA_GRANULAR_ATTRIBUTES} if granular else None
+    data = load_scores(test_id, extra=extra)
+    reference = load_scores(test_id, role='reference')
+    summary = {
+        'ratings': len(data),
+        'systems': group_stats(data.systems, data.scores, data.system_codes, data.raters, **bootstrap),
+        'reference': group_stats(['reference'], reference.scores, np.zeros(len(reference), dtype=np.int64),
+                                 reference.raters, **bootstrap).get('reference')
+    }
+    if granular:
+        summary['attributes'] = {
+            attribute: group_stats(data.systems, values, data.system_codes, data.raters, **bootstrap)
+            for attribute, values in data.extra.items()
+        }
+    return summary
+
+
+def cmos_summary(test_id, **bootstrap):
+    """CMOS per system (score against the reference, -3 to 3) and the share of better/equal/worse votes."""
+    data = load_scores(test_id)
+    systems = group_stats(data.systems, data.scores, data.system_codes, data.raters, **bootstrap)
+    valid = ~np.isnan(data.scores)
+    codes, scores = data.system_codes[valid], data.scores[valid]
+    size = len(data.systems)
+    n = np.bincount(codes, minlength=size)
+    for name, outcome in (('better', scores > 0), ('equal', scores == 0), ('worse', scores < 0)):
+        share = np.bincount(codes, weights=outcome, minlength=size) / np.maximum(n, 1)
+        for i, system in enumerate(data.systems):
+            if system in systems:
+                systems[system][name] = _number(share[i])
+    return {'ratings': len(data), 'systems': systems}
+
+
+def hfr_summary(test_id, granular=False, **bootstrap):
+    """
+    Confusion matrix of the true label (the item's system/label) against the rater's
+    choice, mean score per true label and, for HFR granular, how often each reason is given.
+    """
+    extra = {reason: RatingScore.attributes[reason].as_boolean()
+             for reason in HFR_GRANULAR_REASONS} if granular else None
+    data = load_scores(test_id, extra=extra)
+    matrix = np.bincount(data.system_codes * len(data.labels) + data.label_codes,
+                         minlength=len(data.systems) * len(data.labels)).reshape(len(data.systems), len(data.labels))
+    summary = {
+        'ratings': len(data),
+        'confusion_matrix': {'true': data.systems, 'chosen': data.labels, 'counts': matrix.tolist()},
+        'systems': group_stats(data.systems, data.scores, data.system_codes, data.raters, **bootstrap)
+    }
+    if granular:
+        summary['reasons'] = {}
+        for reason, values in data.extra.items():
+            given = np.nan_to_num(values)  # A reason that was not ticked counts as not given
+            summary['reasons'][reason] = group_stats(data.systems, given, data.system_codes,
+                                                     data.raters, **bootstrap)
+    return summary
+
+
+def analyze_test(test_id, test_type, resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE, seed=0):
+    """Summary statistics of a test, by test type, computed from rating_score."""
+    bootstrap = {'resamples': resamples, 'confidence': confidence, 'seed': seed}
+    if test_type in (TestType.MUSHRA.value, TestType.MUSHRA_GRANULAR.value):
+        summary = mushra_summary(test_id, granular=test_type == TestType.MUSHRA_GRANULAR.value, **bootstrap)
+    elif test_type == TestType.CMOS.value:
+        summary = cmos_summary(test_id, **bootstrap)
+    elif test_type in (TestType.HFR.value, TestType.MVH_GRANULAR.value):
+        summary = hfr_summary(test_id, granular=test_type == TestType.MVH_GRANULAR.value, **bootstrap)
+    else:
+        raise ValueError(f"No analytics for test type {test_type}")
+    return {'test_id': test_id, 'test_type': test_type, 'confidence': confidence,
+            'resamples': resamples, **summary}
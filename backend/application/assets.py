@@ -0,0 +1,256 @@
+import hashlib
+import http.client
+import ipaddress
+import os
+import re
+import socket
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request as urlrequest
+from urllib.error import URLError
+from urllib.request import HTTPHandler, HTTPRedirectHandler, HTTPSHandler, ProxyHandler, build_opener
+from urllib.parse import urlparse
+
+# Item fields that hold an audio URL, at the top level of an item or in its "sample",
+# and in every entry of "test_audios"
+AUDIO_FIELDS = ('audio_path', 'reference_audio', 'hidden_reference_audio')
+
+AUDIO_TYPES = {
+    '.wav': 'audio/wav',
+    '.mp3': 'audio/mpeg',
+    '.flac': 'audio/flac',
+    '.ogg': 'audio/ogg',
+    '.opus': 'audio/ogg',
+    '.m4a': 'audio/mp4',
+    '.webm': 'audio/webm',
+}
+
+# <sha256 of the content>.<extension>, the only names the store serves
+ASSET_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,5}$')
+
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_WORKERS = 8
+
+
+class SourceNotAllowed(ValueError):
+    """A source that may not be fetched on behalf of an API client."""
+
+
+def _public_address(host, port):
+    """
+    Resolve host and return the address to connect to, refusing hosts that resolve to a
+    private, loopback, link-local or reserved address.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise URLError(e)
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise SourceNotAllowed('host is not a public address')
+    return infos[0][4][:2]
+
+
+def _check_public(url):
+    """Refuse URLs whose host resolves to a non-public address (checked again on connect)."""
+    host = urlparse(url).hostname
+    if not host:
+        raise SourceNotAllowed('URL without a host')
+    _public_address(host, None)
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    """Connects to the address that was checked, so DNS cannot change it in between."""
+
+    def connect(self):
+        self.sock = socket.create_connection(_public_address(self.host, self.port), self.timeout)
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        sock = socket.create_connection(_public_address(self.host, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class _PublicHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+class _PublicRedirectHandler(HTTPRedirectHandler):
+    """Follows redirects only to public http(s) URLs."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urlparse(newurl).scheme not in ('http', 'https'):
+            raise SourceNotAllowed('redirect to a non-http URL')
+        _check_public(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# No proxies: the connection must go to the checked address
+_public_opener = build_opener(ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler, _PublicRedirectHandler)
+
+
+def _check_source(source):
+    if urlparse(source).scheme not in ('http', 'https'):
+        raise SourceNotAllowed('only http(s) URLs can be fetched')
+    _check_public(source)
+
+
+def _extension(source):
+    extension = os.path.splitext(urlparse(source).path)[1].lower()
+    return extension if extension in AUDIO_TYPES else '.bin'
+
+
+class AssetStore:
+    """
+    Content-addressed store of audio files. A file is stored once under the SHA-256
+    of its content, at <directory>/<first two hex digits>/<sha256>.<extension>, so the
+    same clip referenced by several tests (or several URLs) takes the space of one,
+    and its URL never changes meaning. Which source URL gave which file is remembered
+    in <directory>/sources, so loading a test twice downloads nothing the second time.
+
+    Sources are public http(s) URLs unless allow_local is given: only trusted callers
+    (load_config.py) may store local files or fetch from private hosts.
+    """
+
+    def __init__(self, directory, base_url='/api/static/audio'):
+        self.directory = directory
+        self.base_url = base_url.rstrip('/')
+        os.makedirs(os.path.join(directory, 'sources'), exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def url(self, name):
+        return f"{self.base_url}/{name}"
+
+    def name_of(self, url):
+        """Asset name of one of our URLs, None for anything else."""
+        if not isinstance(url, str) or not url.startswith(self.base_url + '/'):
+            return None
+        name = url[len(self.base_url) + 1:]
+        return name if ASSET_NAME.match(name) else None
+
+    @staticmethod
+    def mimetype(name):
+        return AUDIO_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+
+    def _source_record(self, source):
+        return os.path.join(self.directory, 'sources', hashlib.sha256(source.encode()).hexdigest())
+
+    def _open(self, source, base_dir, allow_local):
+        if not allow_local:
+            _check_source(source)
+            return _public_opener.open(source, timeout=DOWNLOAD_TIMEOUT)
+        if urlparse(source).scheme in ('http', 'https'):
+            return urlrequest.urlopen(source, timeout=DOWNLOAD_TIMEOUT)
+        path = source[len('file://'):] if source.startswith('file://') else source
+        return open(os.path.join(base_dir or '', path), 'rb')
+
+    def put(self, source, base_dir=None, allow_local=False):
+        """
+        Store the audio at source (a URL, or with allow_local a path relative to base_dir).
+        Returns its name.
+        """
+        if not allow_local:
+            _check_source(source)
+        record = self._source_record(source)
+        try:
+            with open(record) as f:
+                name = f.read().strip()
+            if os.path.exists(self.path(name)):
+                return name
+        except OSError:
+            pass
+
+        digest = hashlib.sha256()
+        incoming = tempfile.NamedTemporaryFile(dir=self.directory, prefix='.incoming-', delete=False)
+        try:
+            with incoming, self._open(source, base_dir, allow_local) as stream:
+                for chunk in iter(lambda: stream.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    incoming.write(chunk)
+            name = f"{digest.hexdigest()}{_extension(source)}"
+            target = self.path(name)
+            if os.path.exists(target):
+                os.remove(incoming.name)  # Already stored, from another source or test
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(incoming.name, target)
+        except BaseException:
+            if os.path.exists(incoming.name):
+                os.remove(incoming.name)
+            raise
+
+        with open(f"{record}.{os.getpid()}.tmp", 'w') as f:
+            f.write(name)
+        os.replace(f"{record}.{os.getpid()}.tmp", record)
+        return name
+
+
+def audio_references(item):
+    """(container, key) of every audio URL of a test item."""
+    if not isinstance(item, dict):
+        return
+    containers = [item]
+    if isinstance(item.get('sample'), dict):
+        containers.append(item['sample'])
+    containers += [audio for audio in item.get('test_audios') or [] if isinstance(audio, dict)]
+    for container in containers:
+        for key in AUDIO_FIELDS:
+            if isinstance(container.get(key), str) and container[key].strip():
+                yield container, key
+
+
+def is_source(value, base_dir=None, allow_local=False):
+    """
+    Whether value is something to fetch: an http(s) URL, and with allow_local also a
+    file URL or an existing local file.
+    """
+    scheme = urlparse(value).scheme
+    if scheme in ('http', 'https'):
+        return True
+    if not allow_local:
+        return False
+    return scheme == 'file' or os.path.isfile(os.path.join(base_dir or '', value))
+
+
+def localize_items(items, store, base_dir=None, workers=DOWNLOAD_WORKERS, allow_local=False):
+    """
+    Store every audio file the items reference and point the items at the stored copies,
+    in place. The original value is kept next to each one as <field>_source (e.g.
+    audio_path_source), which the clients report as the url of a rating, so results stay
+    joinable to the clips they were made from. Each distinct source is fetched once, workers at a time. Values that are
+    not sources (placeholders such as "skip", and local paths without allow_local) are
+    left as they are. Only pass allow_local for configurations from a trusted operator.
+    Returns the problems found, empty if every file was stored.
+    """
+    references = [(container, key) for item in items for container, key in audio_references(item)
+                  if store.name_of(container[key]) is None and is_source(container[key], base_dir, allow_local)]
+    sources = sorted({container[key] for container, key in references})
+
+    def put(source):
+        try:
+            return source, store.put(source, base_dir, allow_local), None
+        except (OSError, URLError, ValueError) as e:
+            return source, None, f"{source}: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sources)))) as pool:
+        results = list(pool.map(put, sources))
+
+    names = {source: name for source, name, error in results if name is not None}
+    for container, key in references:
+        if container[key] in names:
+            container.setdefault(f"{key}_source", container[key])
+            container[key] = store.url(names[container[key]])
+    return [error for _, _, error in results if error is not None]
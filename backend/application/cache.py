@@ -0,0 +1,179 @@
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """
+    In-process LRU cache with a TTL per entry. Holds at most max_entries
+    entries; a timeout of 0 keeps an entry until it is evicted.
+    """
+
+    def __init__(self, max_entries=10000, default_timeout=600):
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry or None, value)
+        self._lock = Lock()
+
+    def _expiry(self, timeout):
+        timeout = self.default_timeout if timeout is None else timeout
+        return time.monotonic() + timeout if timeout else None
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._entries[key] = (self._expiry(timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        """Set key only if it holds no live value. Returns whether it was set."""
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+class SharedCache:
+    """
+    Cache tier on a Redis-protocol server, shared by every worker and host.
+    Any client object with Redis' get/set/delete signatures works, which makes
+    it easy to run against a local stand-in.
+    """
+
+    def __init__(self, client, key_prefix='', default_timeout=600):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _timeout(self, timeout):
+        timeout = self.default_timeout if timeout is None else timeout
+        return timeout or None
+
+    def get(self, key):
+        raw = self.client.get(self.key_prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value, timeout=None):
+        return bool(self.client.set(self.key_prefix + key, pickle.dumps(value), ex=self._timeout(timeout)))
+
+    def add(self, key, value, timeout=None):
+        return bool(self.client.set(self.key_prefix + key, pickle.dumps(value),
+                                    ex=self._timeout(timeout), nx=True))
+
+    def delete(self, key):
+        return bool(self.client.delete(self.key_prefix + key))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
+
+
+class TieredCache:
+    """
+    A LocalCache in front of an optional SharedCache. Reads try the local tier
+    first; values found in the shared tier are copied into the local one for at
+    most local_timeout seconds so workers never serve a stale value for long.
+    A failing shared tier is logged and skipped rather than failing the request.
+    """
+
+    def __init__(self, local, shared=None, local_timeout=30):
+        self.local = local
+        self.shared = shared
+        self.local_timeout = local_timeout
+
+    def _local_timeout(self, timeout):
+        if self.shared is None:
+            return timeout
+        timeout = self.local.default_timeout if timeout is None else timeout
+        return min(timeout, self.local_timeout) if timeout else self.local_timeout
+
+    def _shared(self, operation, *args, **kwargs):
+        try:
+            return getattr(self.shared, operation)(*args, **kwargs)
+        except Exception as e:
+            self.shared.errors += 1
+            logger.warning('Shared cache %s failed: %s', operation, e)
+            return None
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+        value = self._shared('get', key)
+        if value is not None:
+            self.local.set(key, value, self._local_timeout(None))
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.local.set(key, value, self._local_timeout(timeout))
+        if self.shared is not None:
+            self._shared('set', key, value, timeout)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.shared is not None:
+            added = self._shared('add', key, value, timeout)
+            if added is not None:
+                if added:
+                    self.local.set(key, value, self._local_timeout(timeout))
+                return added
+        return self.local.add(key, value, self._local_timeout(timeout))
+
+    def delete(self, key):
+        deleted = self.local.delete(key)
+        if self.shared is not None:
+            deleted = bool(self._shared('delete', key)) or deleted
+        return deleted
+
+    def stats(self):
+        return {
+            'local': self.local.stats(),
+            'shared': self.shared.stats() if self.shared is not None else None
+        }
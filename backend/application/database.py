@@ -3,4 +3,15 @@ from flask_sqlalchemy import SQLAlchemy
 
 engine = None
 Base = declarative_base()
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+
+def upsert_into(model):
+    """
+    INSERT statement for model that supports on_conflict_do_nothing() and
+    on_conflict_do_update(), on PostgreSQL as well as on SQLite.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model)
@@ -0,0 +1,208 @@
+import csv
+import gzip
+import io
+import json
+from importlib.util import find_spec
+from itertools import islice
+from application.database import db
+from application.models import Rating, TestType
+from application.scores import rated_audios, to_float
+
+# Ratings are read through a server-side cursor in batches of this many rows,
+# so memory stays flat no matter how many ratings a test has.
+EXPORT_BATCH_SIZE = 1000
+
+# Flattened rows are written out (and a Parquet row group is cut) every this many rows
+EXPORT_ROW_BATCH = 20000
+
+
+def query_ratings(test_id=None, after_id=None, since=None, limit=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Streaming query over ratings in ascending id order.
+    - test_id: only ratings of this test
+    - after_id: keyset cursor, only ratings with a larger id
+    - since: only ratings submitted at or after this datetime
+    - limit: stop after this many ratings
+    """
+    query = db.session.query(
+        Rating.id, Rating.rater_id, Rating.test_id, Rating.results_json,
+        Rating.time_of_submission, Rating.time_taken_to_submit, Rating.page_no_progress
+    )
+    if test_id is not None:
+        query = query.filter(Rating.test_id == test_id)
+    if after_id is not None:
+        query = query.filter(Rating.id > after_id)
+    if since is not None:
+        query = query.filter(Rating.time_of_submission >= since)
+    query = query.order_by(Rating.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.execution_options(stream_results=True, yield_per=batch_size)
+
+
+def iter_ratings(test_id=None, after_id=None, since=None, limit=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield ratings as plain dicts, see query_ratings for the filters."""
+    for row in query_ratings(test_id, after_id, since, limit, batch_size):
+        yield {
+            'id': row.id,
+            'rater_id': row.rater_id,
+            'test_id': row.test_id,
+            'results_json': row.results_json,
+            'time_of_submission': row.time_of_submission.isoformat() if row.time_of_submission else None,
+            'time_taken_to_submit': row.time_taken_to_submit,
+            'page_no_progress': row.page_no_progress
+        }
+
+
+def iter_ndjson(ratings):
+    """One JSON document per line."""
+    for rating in ratings:
+        yield json.dumps(rating) + '\n'
+
+
+def iter_json_array(ratings):
+    """A single JSON array, produced piece by piece."""
+    separator = '['
+    for rating in ratings:
+        yield separator + json.dumps(rating)
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+# =======================
+# Columnar export
+# =======================
+
+# Reasons offered by HFRGranular.vue when a sample is judged machine-generated
+HFR_GRANULAR_REASONS = (
+    'voice_quality', 'unnatural_pitch', 'flat', 'inappropriate_emotion', 'mispronunciations',
+    'skipped_repeated_words', 'unnatural_pauses', 'digital_artifacts', 'too_perfect',
+)
+
+# Per-audio attribute sliders of MushraGranular.vue ("overall" is exported as score)
+MUSHRA_GRANULAR_ATTRIBUTES = (
+    'liveliness', 'voiceQuality', 'rhythm', 'mildMispronunciations', 'severeMispronunciations',
+    'suddenFluctuations', 'digitalArtifacts', 'unnaturalSpeed', 'wordSkips',
+)
+
+# One row per rated audio: the reference (MUSHRA/CMOS) and every test audio
+COMMON_COLUMNS = [
+    ('rating_id', 'int'), ('rater_id', 'int'), ('test_id', 'int'), ('page_no', 'str'),
+    ('time_of_submission', 'timestamp'), ('time_taken_to_submit', 'float'),
+    ('role', 'str'), ('url', 'str'), ('system', 'str'), ('score', 'float'), ('label', 'str'),
+]
+
+EXTRA_COLUMNS = {
+    TestType.HFR.value: [],
+    TestType.MVH_GRANULAR.value: [('comments', 'str')] + [(f"reason_{reason}", 'bool')
+                                                         for reason in HFR_GRANULAR_REASONS],
+    TestType.MUSHRA.value: [],
+    TestType.MUSHRA_GRANULAR.value: [(attribute, 'float') for attribute in MUSHRA_GRANULAR_ATTRIBUTES],
+    TestType.CMOS.value: [],
+}
+
+EXPORT_FORMATS = {
+    # format: (mimetype, file extension)
+    'csv': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def export_columns(test_type):
+    return COMMON_COLUMNS + EXTRA_COLUMNS.get(test_type, [])
+
+
+def parquet_available():
+    return find_spec('pyarrow') is not None
+
+
+def flatten_rating(row, test_type):
+    """Yield one tuple per rated audio of a rating, in export_columns(test_type) order."""
+    results = row.results_json if isinstance(row.results_json, dict) else {}
+    base = (row.id, row.rater_id, row.test_id, row.page_no_progress,
+            row.time_of_submission, row.time_taken_to_submit)
+
+    for role, audio in rated_audios(results):
+        attributes = audio.get('attributes') if isinstance(audio.get('attributes'), dict) else {}
+        values = base + (role, audio.get('url'), audio.get('system'),
+                         to_float(audio.get('score')), audio.get('label'))
+        if test_type == TestType.MVH_GRANULAR.value:
+            values += (results.get('comments'),) + tuple(bool(attributes.get(reason))
+                                                         for reason in HFR_GRANULAR_REASONS)
+        elif test_type == TestType.MUSHRA_GRANULAR.value:
+            values += tuple(to_float(attributes.get(attribute)) for attribute in MUSHRA_GRANULAR_ATTRIBUTES)
+        yield values
+
+
+class StreamSink(io.RawIOBase):
+    """Write-only file object whose contents are handed out chunk by chunk."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_csv_export(rows, columns, batch_size=EXPORT_ROW_BATCH):
+    sink = StreamSink()
+    with gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=5) as compressed:
+        text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow([name for name, _ in columns])
+        for batch in batched(rows, batch_size):
+            writer.writerows(batch)
+            text.flush()
+            yield sink.drain()
+        text.flush()
+        text.detach()
+    yield sink.drain()
+
+
+def iter_parquet_export(rows, columns, batch_size=EXPORT_ROW_BATCH):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(),
+                   'bool': pa.bool_(), 'timestamp': pa.timestamp('us')}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in columns])
+    sink = StreamSink()
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for batch in batched(rows, batch_size):
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_export(test_id, test_type, export_format='csv'):
+    """Compressed CSV or Parquet bytes for every rating of a test, flattened by test type."""
+    columns = export_columns(test_type)
+    rows = (values for row in query_ratings(test_id=test_id)
+            for values in flatten_rating(row, test_type))
+    if export_format == 'parquet':
+        return iter_parquet_export(rows, columns)
+    return iter_csv_export(rows, columns)
@@ -0,0 +1,314 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, or_, select
+from application.database import db, upsert_into
+from application.items import store_test_items
+from application.models import Assignment, Consent, Rater, Rating, RatingScore, Session, Study, Test, TestItem
+from application.progress import rebuild_progress
+from application.scores import insert_scores
+
+# An incremental backup is a chain: a full dump (the base, see scripts/stream_backup.py)
+# followed by a journal of the rows inserted since, appended by every run of export().
+# Each run reads the rows above the previous run's high-water mark (the largest id seen
+# per table) and writes them as gzipped NDJSON segments, cut at SEGMENT_MAX_BYTES, then
+# records the segments and the new marks in the chain's manifest. A run therefore costs
+# what was rated since the last one, whatever the size of the database.
+#
+# Ids are allocated before commit, so a transaction can commit a smaller id than one
+# already exported; skipped ids are kept as gaps and looked up again by later runs
+# until GAP_TTL has passed (a rolled back transaction leaves a permanent gap).
+#
+# Only inserts are journaled: rows changed or deleted after they were exported keep
+# their exported state until the next full dump starts a new chain.
+
+# Journaled tables, parents first so a replay never breaks a foreign key
+JOURNAL_MODELS = (Rater, Test, Study, Session, Assignment, Consent, Rating)
+
+# Column dating the rows of a table, used by point-in-time restores
+TIME_COLUMNS = {'assignment': 'time_of_creation', 'consent': 'time_of_submission', 'rating': 'time_of_submission'}
+
+MANIFEST = 'manifest.json'
+CURRENT = 'CURRENT'
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+JOURNAL_BATCH_SIZE = 1000
+GAP_TTL = timedelta(hours=6)
+# Ids of a single jump above which a gap is not tracked (e.g. a sequence reset)
+MAX_GAP = 10000
+# Rows below the marks taken by start_chain() that are exported again, for the
+# transactions still in flight while the base dump was taken; replaying them is a no-op
+START_OVERLAP = 1000
+
+
+def _tables():
+    return {model.__tablename__: model for model in JOURNAL_MODELS}
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _write_json(path, document):
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(document, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+def read_manifest(chain):
+    with open(os.path.join(chain, MANIFEST)) as f:
+        return json.load(f)
+
+
+def current_chain(directory):
+    """Directory of the chain runs are appended to, None before the first start_chain()."""
+    try:
+        with open(os.path.join(directory, CURRENT)) as f:
+            return os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def activate_chain(directory, base):
+    """Make the chain of base the one runs append to."""
+    if not os.path.exists(os.path.join(directory, base, MANIFEST)):
+        raise FileNotFoundError(f"No chain {base} in {directory}")
+    with open(os.path.join(directory, f"{CURRENT}.tmp"), 'w') as f:
+        f.write(base)
+    os.replace(os.path.join(directory, f"{CURRENT}.tmp"), os.path.join(directory, CURRENT))
+
+
+def start_chain(directory, base, now=None, activate=True):
+    """
+    Start a new chain on top of the full dump named base. Call it right before the dump
+    is taken: rows inserted meanwhile end up in both, which a restore tolerates. Without
+    activate the chain is only prepared, and runs keep appending to the current chain
+    until activate_chain() is called once the dump is safely stored; the new chain's
+    first run then picks up everything since its marks, so no row falls between chains.
+    """
+    now = now or datetime.utcnow()
+    chain = os.path.join(directory, base)
+    os.makedirs(chain, exist_ok=True)
+    marks = {table: max((db.session.query(db.func.max(model.id)).scalar() or 0) - START_OVERLAP, 0)
+             for table, model in _tables().items()}
+    _write_json(os.path.join(chain, MANIFEST), {
+        'version': 1,
+        'base': base,
+        'started': now.isoformat(),
+        'base_marks': marks,
+        'marks': marks,
+        'gaps': {table: {} for table in marks},
+        'runs': 0,
+        'segments': [],
+    })
+    if activate:
+        activate_chain(directory, base)
+    return chain
+
+
+class SegmentWriter:
+    """Writes records to numbered gzip segments, starting a new one past max_bytes."""
+
+    def __init__(self, chain, first_number, run, captured, max_bytes):
+        self.chain, self.number, self.run, self.captured = chain, first_number, run, captured
+        self.max_bytes = max_bytes
+        self.segments = []
+        self._file = self._gzip = None
+
+    def _open(self):
+        name = f"{self.number:06d}.ndjson.gz"
+        self._file = open(os.path.join(self.chain, name), 'wb')
+        self._gzip = gzip.GzipFile(filename='', mode='wb', fileobj=self._file, mtime=0)
+        self.segments.append({'name': name, 'run': self.run, 'captured': self.captured, 'rows': {}, 'ids': {}})
+        self.number += 1
+
+    def write(self, table, row):
+        if self._gzip is None:
+            self._open()
+        self._gzip.write(json.dumps({'table': table, 'row': row}, separators=(',', ':')).encode() + b'\n')
+        segment = self.segments[-1]
+        segment['rows'][table] = segment['rows'].get(table, 0) + 1
+        first, _ = segment['ids'].get(table, (row['id'], row['id']))
+        segment['ids'][table] = (first, row['id'])
+        if self._file.tell() >= self.max_bytes:
+            self.close()
+
+    def close(self):
+        if self._gzip is None:
+            return
+        self._gzip.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._gzip = self._file = None
+        segment = self.segments[-1]
+        digest, size = hashlib.sha256(), 0
+        with open(os.path.join(self.chain, segment['name']), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        segment.update(sha256=digest.hexdigest(), bytes=size)
+
+
+def _snapshot():
+    """Read every table in one snapshot, so no row is exported without its parents."""
+    db.session.rollback()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+
+def export(chain, now=None, max_segment_bytes=SEGMENT_MAX_BYTES, batch_size=JOURNAL_BATCH_SIZE):
+    """Append the rows inserted since the last run to the chain. Returns the new segments."""
+    now = now or datetime.utcnow()
+    manifest = read_manifest(chain)
+    run = manifest['runs'] + 1
+    writer = SegmentWriter(chain, len(manifest['segments']) + 1, run, now.isoformat(), max_segment_bytes)
+    _snapshot()
+    try:
+        for table, model in _tables().items():
+            columns = model.__table__.columns
+            mark = manifest['marks'][table]
+            gaps = manifest['gaps'][table]
+            condition = columns.id > mark
+            if gaps:
+                condition = or_(condition, columns.id.in_([int(gap) for gap in gaps]))
+            query = select(model.__table__).where(condition).order_by(columns.id) \
+                .execution_options(yield_per=batch_size)
+            expected = mark + 1
+            for row in db.session.execute(query):
+                row = {key: _encode(value) for key, value in row._mapping.items()}
+                writer.write(table, row)
+                if row['id'] <= mark:
+                    del gaps[str(row['id'])]
+                    continue
+                if row['id'] - expected <= MAX_GAP:
+                    gaps.update((str(gap), now.isoformat()) for gap in range(expected, row['id']))
+                expected = row['id'] + 1
+            manifest['marks'][table] = expected - 1
+            manifest['gaps'][table] = {gap: seen for gap, seen in gaps.items()
+                                       if now - datetime.fromisoformat(seen) < GAP_TTL}
+    finally:
+        writer.close()
+        db.session.rollback()
+
+    manifest['runs'] = run
+    manifest['last_run'] = now.isoformat()
+    manifest['segments'] += writer.segments
+    _write_json(os.path.join(chain, MANIFEST), manifest)
+    return writer.segments
+
+
+def verify_segments(chain, segments):
+    """Names of the segments whose file is missing or does not match its checksum."""
+    damaged = []
+    for segment in segments:
+        digest = hashlib.sha256()
+        try:
+            with open(os.path.join(chain, segment['name']), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            damaged.append(segment['name'])
+            continue
+        if digest.hexdigest() != segment['sha256']:
+            damaged.append(segment['name'])
+    return damaged
+
+
+def segments_until(manifest, until=None):
+    """
+    Segments to replay for a restore to the state at until (naive UTC), all of them
+    without until. A run captures what was committed before it started, so those are
+    the runs up to the first one that started after until; rows of that run dated after
+    until are skipped by replay().
+    """
+    if until is None:
+        return manifest['segments']
+    last_run = next((segment['run'] for segment in manifest['segments']
+                     if datetime.fromisoformat(segment['captured']) > until), None)
+    return [segment for segment in manifest['segments'] if last_run is None or segment['run'] <= last_run]
+
+
+def _decode(model, row):
+    for column in model.__table__.columns:
+        if isinstance(column.type, DateTime) and isinstance(row.get(column.name), str):
+            row[column.name] = datetime.fromisoformat(row[column.name])
+    return row
+
+
+def _flush(model, rows):
+    """Insert the rows that are not in the database yet. Returns how many were inserted."""
+    if not rows:
+        return 0
+    return db.session.execute(upsert_into(model).values(rows).on_conflict_do_nothing()).rowcount
+
+
+def _reset_sequences():
+    """After rows were inserted with their ids, make new rows continue above them."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in JOURNAL_MODELS:
+        table = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"(SELECT COALESCE(MAX(id), 0) + 1 FROM \"{table}\"), false)"
+        ))
+
+
+def replay(chain, until=None, batch_size=JOURNAL_BATCH_SIZE, log=print):
+    """
+    Insert the journaled rows into the database, which must hold the chain's base dump.
+    Rows already present are skipped, so a replay can be repeated or resumed. Derived
+    tables (rating_score, test_item, progress) are then brought up to date.
+    Returns the number of rows inserted per table, rows already present not included.
+    """
+    manifest = read_manifest(chain)
+    segments = segments_until(manifest, until)
+    damaged = verify_segments(chain, segments)
+    if damaged:
+        raise ValueError(f"Missing or damaged segments: {', '.join(damaged)}")
+
+    tables = _tables()
+    counts = {table: 0 for table in tables}
+    for segment in segments:
+        table, rows = None, []
+        with gzip.open(os.path.join(chain, segment['name']), 'rt') as f:
+            for line in f:
+                record = json.loads(line)
+                row = record['row']
+                column = TIME_COLUMNS.get(record['table'])
+                if until is not None and column and row.get(column) \
+                        and datetime.fromisoformat(row[column]) > until:
+                    continue
+                if record['table'] != table or len(rows) >= batch_size:
+                    counts[table] = counts.get(table, 0) + _flush(tables.get(table), rows)
+                    table, rows = record['table'], []
+                rows.append(_decode(tables[table], row))
+        counts[table] = counts.get(table, 0) + _flush(tables.get(table), rows)
+        db.session.commit()
+        log(f"{segment['name']}: replayed")
+    counts.pop(None, None)
+
+    # rating_score and test_item are written by the API with the rows; rebuild them here
+    after = manifest['base_marks']
+    scored = db.session.query(RatingScore.id).filter(RatingScore.rating_id == Rating.id).exists()
+    after_id = after['rating']
+    while True:
+        batch = db.session.query(Rating.id, Rating.rater_id, Rating.test_id, Rating.results_json) \
+            .filter(Rating.id > after_id, ~scored).order_by(Rating.id).limit(batch_size).all()
+        if not batch:
+            break
+        insert_scores(batch)
+        after_id = batch[-1].id
+    normalized = db.session.query(TestItem.test_id).filter(TestItem.test_id == Test.id).exists()
+    if db.session.query(TestItem.test_id).first() is not None:
+        for test_id, json_entry in db.session.query(Test.id, Test.json_entry) \
+                .filter(Test.id > after['test'], ~normalized):
+            store_test_items(test_id, json_entry or [])
+    rebuild_progress()
+    _reset_sequences()
+    db.session.commit()
+    return counts
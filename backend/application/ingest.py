@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy.exc import DataError, IntegrityError
+from application.database import db, upsert_into
+from application.models import Rating
+from application.scores import insert_scores
+from application.progress import record_progress
+
+logger = logging.getLogger(__name__)
+
+# Ratings per multi-row INSERT when the journal is written to the database
+INGEST_BATCH_SIZE = 500
+
+SEGMENT_SUFFIX = '.ndjson'
+REJECTED_FILE = 'rejected.ndjson'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RatingJournal:
+    """
+    Durable, append-only journal of accepted ratings: one JSON document per line,
+    fsynced before the submission is acknowledged. The journal is split into
+    segments named ratings-<pid>-<ns>.ndjson; the open one belongs to the writing
+    process, closed ones wait to be written to the database and are deleted once
+    they are. Segments left behind by a process that died are claimed on replay.
+    """
+
+    def __init__(self, directory, fsync=True):
+        self.directory = directory
+        self.fsync = fsync
+        self.prefix = f"ratings-{os.getpid()}-"
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        # Segment name -> (bytes read, {(rater_id, test_id): pages}), see pending_pages
+        self._index = {}
+        self._index_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._path = os.path.join(self.directory, f"{self.prefix}{time.time_ns()}{SEGMENT_SUFFIX}")
+                self._file = open(self._path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """Close the open segment, so that everything appended so far is pending."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._path = None
+
+    def _claim(self, name):
+        """Name of a segment once owned by this process, or None if it is not ours to take."""
+        if name.startswith(self.prefix):
+            return name
+        try:
+            pid = int(name.split('-')[1])
+        except (IndexError, ValueError):
+            return None
+        if process_alive(pid):
+            return None
+        claimed = self.prefix + name.split('-', 2)[2]
+        try:
+            os.rename(os.path.join(self.directory, name), os.path.join(self.directory, claimed))
+        except FileNotFoundError:
+            return None  # Another process claimed it first
+        logger.info('Replaying rating journal segment %s', name)
+        return claimed
+
+    def pending_segments(self):
+        """Closed segments of this process and of dead ones, oldest first."""
+        with self._lock:
+            # Listed under the lock, so a segment opened afterwards is never picked up half written
+            active = os.path.basename(self._path) if self._path else None
+            names = sorted((name for name in os.listdir(self.directory)
+                            if name.startswith('ratings-') and name.endswith(SEGMENT_SUFFIX)),
+                           key=lambda name: name.rsplit('-', 1)[-1])
+        segments = []
+        for name in names:
+            if name == active:
+                continue
+            claimed = self._claim(name)
+            if claimed is not None:
+                segments.append(os.path.join(self.directory, claimed))
+        return segments
+
+    @staticmethod
+    def read(path):
+        with open(path, encoding='utf-8') as segment:
+            for line_no, line in enumerate(segment, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Only the last line of a segment can be torn, by a crash mid-write;
+                    # it was never acknowledged
+                    logger.warning('Skipping unreadable line %d of %s', line_no, path)
+
+    def _index_segment(self, name):
+        """Index the lines appended to a segment since it was last read. False if it is gone."""
+        offset, pages = self._index.get(name, (0, {}))
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as segment:
+                segment.seek(offset)
+                data = segment.read()
+        except FileNotFoundError:
+            return False  # Written to the database and deleted, or claimed under a new name
+        complete = data.rfind(b'\n') + 1  # A last line without newline is still being written
+        for line in data[:complete].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn by a crash, never acknowledged
+            if isinstance(record, dict) and record.get('page_no_progress') is not None:
+                key = (str(record.get('rater_id')), str(record.get('test_id')))
+                pages.setdefault(key, set()).add(str(record['page_no_progress']))
+        self._index[name] = (offset + complete, pages)
+        return True
+
+    def pending_pages(self, rater_id, test_id):
+        """
+        Pages of the rater's journaled ratings of a test, from the segments of every process,
+        open ones included. They may or may not be in the database already: read the journal
+        before the database, so that a rating written and deleted meanwhile is found there.
+        Segments are indexed in memory and only what was appended since the previous call is
+        read, so a backlog is parsed once rather than on every request.
+        """
+        with self._index_lock:
+            seen = set()
+            while True:
+                # A segment claimed (renamed) while we read is picked up under its new name
+                names = {name for name in os.listdir(self.directory)
+                         if name.startswith('ratings-') and name.endswith(SEGMENT_SUFFIX)} - seen
+                if not names:
+                    break
+                for name in names:
+                    seen.add(name)
+                    if not self._index_segment(name):
+                        self._index.pop(name, None)
+            for name in set(self._index) - seen:
+                del self._index[name]
+            key = (str(rater_id), str(test_id))
+            return set().union(*(pages.get(key, ()) for _, pages in self._index.values()))
+
+    def reject(self, record, reason):
+        with self._lock, open(os.path.join(self.directory, REJECTED_FILE), 'a', encoding='utf-8') as rejected:
+            rejected.write(json.dumps({'reason': reason, 'rating': record}) + '\n')
+
+
+def rating_row(record):
+    row = dict(record)
+    row['time_of_submission'] = datetime.fromisoformat(row['time_of_submission'])
+    return row
+
+
+class RatingIngestor:
+    """
+    Write-behind ingestion of ratings. submit() journals a rating and returns
+    immediately; a background thread writes the journal to the database every
+    flush_interval seconds with one multi-row INSERT per batch_size ratings.
+    Every rating carries a submission_key, so replaying a segment that was
+    written but not yet deleted when the process stopped inserts nothing twice.
+    """
+
+    def __init__(self, app, journal, flush_interval=1.0, batch_size=INGEST_BATCH_SIZE):
+        self.app = app
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.submitted = 0
+        self.written = 0
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='rating-ingestor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def submit(self, rating):
+        """Journal a rating (the keyword arguments of a Rating). Returns its submission key."""
+        record = dict(rating)
+        record['submission_key'] = record.get('submission_key') or uuid.uuid4().hex
+        record['time_of_submission'] = (record.get('time_of_submission') or datetime.utcnow()).isoformat()
+        self.journal.append(record)
+        self.submitted += 1
+        return record['submission_key']
+
+    def _run(self):
+        # The first pass replays whatever a previous run left behind
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Rating ingestion failed, will retry: %s', e)
+            if self._stop.wait(self.flush_interval):
+                return
+
+    def _insert(self, rows):
+        inserted = db.session.execute(
+            upsert_into(Rating).values(rows).on_conflict_do_nothing(index_elements=['submission_key'])
+            .returning(Rating.id, Rating.rater_id, Rating.test_id, Rating.results_json, Rating.page_no_progress)
+        ).all()
+        insert_scores(inserted)
+        record_progress(inserted)
+        return len(inserted)
+
+    def _write(self, records):
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            try:
+                inserted = self._insert([rating_row(record) for record in batch])
+                db.session.commit()
+            except (IntegrityError, DataError) as e:
+                # One bad rating (e.g. an unknown test) must not block the rest: retry one by one
+                db.session.rollback()
+                logger.warning('Batch insert failed, retrying row by row: %s', e)
+                inserted = 0
+                for record in batch:
+                    try:
+                        inserted += self._insert([rating_row(record)])
+                        db.session.commit()
+                    except (IntegrityError, DataError) as row_error:
+                        db.session.rollback()
+                        self.journal.reject(record, str(row_error))
+            # Ratings already written by an earlier, interrupted flush are not counted again
+            self.written += inserted
+
+    def pending_pages(self, rater_id, test_id):
+        return self.journal.pending_pages(rater_id, test_id)
+
+    def flush(self):
+        """Write every journaled rating to the database. Returns how many were written."""
+        with self._flush_lock, self.app.app_context():
+            self.journal.rotate()
+            written = 0
+            for segment in self.journal.pending_segments():
+                records = list(self.journal.read(segment))
+                self._write(records)
+                os.remove(segment)
+                written += len(records)
+            return written
+
+    def stats(self):
+        return {'submitted': self.submitted, 'written': self.written}
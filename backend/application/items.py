@@ -0,0 +1,92 @@
+from flask import current_app
+from application.cache import LocalCache
+from application.database import db, upsert_into
+from application.models import Rating, TestItem
+from application.samples import SeededPermutation
+
+# Rows per INSERT when a test's items are written to test_item
+ITEM_INSERT_BATCH = 1000
+
+# test_id -> whether its items are in test_item; a test loaded later is picked up after a minute
+_normalized_tests = LocalCache(max_entries=1024, default_timeout=60)
+
+
+def item_rows(test_id, json_entry):
+    return [{
+        'test_id': test_id,
+        'item_id': str(entry.get('id', position)) if isinstance(entry, dict) else str(position),
+        'position': position,
+        'payload': entry
+    } for position, entry in enumerate(json_entry)]
+
+
+def store_test_items(test_id, json_entry, batch_size=ITEM_INSERT_BATCH):
+    """Write the items of a test to test_item, in the caller's transaction."""
+    rows = item_rows(test_id, json_entry)
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(upsert_into(TestItem).values(rows[start:start + batch_size]).on_conflict_do_nothing())
+    _normalized_tests.set(test_id, bool(rows))
+
+
+def uses_normalized_items(test_id):
+    """Whether requests for this test are served from test_item rather than from json_entry."""
+    if not current_app.config.get('NORMALIZED_ITEMS'):
+        return False
+    normalized = _normalized_tests.get(test_id)
+    if normalized is None:
+        normalized = db.session.query(
+            db.session.query(TestItem.position).filter(TestItem.test_id == test_id).exists()
+        ).scalar()
+        _normalized_tests.set(test_id, normalized)
+    return normalized
+
+
+def _rated_by(rater_id, pending=()):
+    """
+    The rater submitted a rating for the test_item row: EXISTS clause, or the item is one
+    of pending (item ids of ratings that may not be in the database yet).
+    """
+    rated = db.session.query(Rating.id).filter(
+        Rating.rater_id == rater_id,
+        Rating.test_id == TestItem.test_id,
+        Rating.page_no_progress == TestItem.item_id
+    ).exists()
+    return db.or_(rated, TestItem.item_id.in_(sorted(pending))) if pending else rated
+
+
+def item_total(test_id):
+    return db.session.query(db.func.count(TestItem.position)).filter(TestItem.test_id == test_id).scalar()
+
+
+def completed_count(test_id, rater_id, pending=()):
+    return db.session.query(db.func.count(TestItem.position)) \
+        .filter(TestItem.test_id == test_id, _rated_by(rater_id, pending)).scalar()
+
+
+def remaining_count(test_id, rater_id, pending=()):
+    return db.session.query(db.func.count(TestItem.position)) \
+        .filter(TestItem.test_id == test_id, ~_rated_by(rater_id, pending)).scalar()
+
+
+def remaining_window(test_id, rater_id, seed, start, limit, total=None, pending=()):
+    """
+    Same result as SampleIndex.window, computed by the database: positions of the seed
+    order are looked up a chunk at a time, with an anti-join against the rater's ratings
+    dropping the completed items. Returns the payloads and the position to continue
+    from, or None at the end. Items in pending count as completed.
+    """
+    total = item_total(test_id) if total is None else total
+    permutation = SeededPermutation(total, seed) if total else None
+    items, position = [], start
+    while position < total and len(items) < limit:
+        chunk = [permutation[p] for p in range(position, min(position + max(2 * (limit - len(items)), 32), total))]
+        remaining = dict(db.session.query(TestItem.position, TestItem.payload).filter(
+            TestItem.test_id == test_id, TestItem.position.in_(chunk), ~_rated_by(rater_id, pending)
+        ).all())
+        for index in chunk:
+            position += 1
+            if index in remaining:
+                items.append(remaining[index])
+                if len(items) == limit:
+                    break
+    return items, position if position < total else None
@@ -0,0 +1,374 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from bisect import bisect_left
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from application.ingest import process_alive
+
+logger = logging.getLogger(__name__)
+slow_request_logger = logging.getLogger('application.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+# Slowest statements listed for each slow request, and how much of each is kept
+SLOW_REQUEST_QUERIES = 10
+STATEMENT_MAX_LENGTH = 500
+
+SNAPSHOT_FILE = re.compile(r'^metrics-(\d+)\.json$')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Metric:
+    """A metric family: one value per combination of label values."""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _export(self, value):
+        return value
+
+    def family(self):
+        with self._lock:
+            samples = [[dict(zip(self.labelnames, key)), self._export(value)]
+                       for key, value in self._values.items()]
+        return {'type': self.type, 'help': self.documentation, 'samples': samples}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, plus their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)  # First bucket whose upper bound is >= value
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _export(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def family(self):
+        family = super().family()
+        family['buckets'] = list(self.buckets)
+        return family
+
+
+class MetricsRegistry:
+    """
+    The metrics of one process. Collectors are callables returning more families
+    ({name: {'type', 'help', 'samples'}}), computed when the metrics are read, for
+    values that are already counted elsewhere such as cache statistics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def families(self):
+        families = {metric.name: metric.family() for metric in self._metrics}
+        for collect in self._collectors:
+            try:
+                families.update(collect())
+            except Exception as e:
+                logger.warning('Metrics collector %s failed: %s', getattr(collect, '__name__', collect), e)
+        return families
+
+
+def _add(current, value):
+    if isinstance(current, list):  # Histogram: bucket counts, sum, count
+        return [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1], current[2] + value[2]]
+    return current + value
+
+
+def merge_families(snapshots):
+    """Sum the families of several processes, sample by sample."""
+    merged = {}
+    for families in snapshots:
+        for name, family in families.items():
+            target = merged.setdefault(name, {**family, 'samples': {}})
+            for labels, value in family['samples']:
+                key = tuple(sorted(labels.items()))
+                current = target['samples'].get(key)
+                target['samples'][key] = value if current is None else _add(current, value)
+    for family in merged.values():
+        family['samples'] = [[dict(key), value] for key, value in family['samples'].items()]
+    return merged
+
+
+def add_hit_ratios(families, prefix):
+    """Add <prefix>_hit_ratio from <prefix>_hits_total and <prefix>_misses_total, per label set."""
+    hits = families.get(f'{prefix}_hits_total', {'samples': []})['samples']
+    misses = {tuple(sorted(labels.items())): value
+              for labels, value in families.get(f'{prefix}_misses_total', {'samples': []})['samples']}
+    samples = []
+    for labels, hit in hits:
+        total = hit + misses.get(tuple(sorted(labels.items())), 0)
+        if total:
+            samples.append([labels, hit / total])
+    families[f'{prefix}_hit_ratio'] = {'type': 'gauge', 'help': 'Share of lookups served from the cache',
+                                       'samples': samples}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels.items()) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(families):
+    """Families in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, family in sorted(families.items()):
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in family['samples']:
+            if family['type'] == 'histogram':
+                counts, total, count = value
+                cumulative = 0
+                for bound, n in zip(family['buckets'], counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_labels(labels, le=_number(float(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(float(total))}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def counter_family(documentation, samples, kind='counter'):
+    """A family for a collector, from [(labels, value), ...]."""
+    return {'type': kind, 'help': documentation, 'samples': [[labels, value] for labels, value in samples]}
+
+
+class RequestMetrics:
+    """
+    Request and database instrumentation of a Flask app: latency per endpoint,
+    requests in flight, SQL statements and time per endpoint (from SQLAlchemy
+    cursor events) and a log of slow requests with their slowest statements.
+
+    Every worker process counts its own requests. When directory is set, each one
+    also writes a snapshot there every write_interval seconds and exposition()
+    adds up the snapshots of all live workers, so any worker can answer a scrape.
+    """
+
+    def __init__(self, app, slow_request_seconds=1.0, directory=None, write_interval=5.0):
+        self.slow_request_seconds = slow_request_seconds
+        self.directory = directory
+        self.write_interval = write_interval
+        self.registry = registry = MetricsRegistry()
+        self.latency = registry.histogram('saffron_request_duration_seconds', 'Time spent handling a request',
+                                          ('endpoint', 'method', 'status'))
+        self.in_flight = registry.gauge('saffron_requests_in_flight', 'Requests being handled')
+        self.queries = registry.counter('saffron_db_queries_total', 'SQL statements executed', ('endpoint',))
+        self.query_seconds = registry.counter('saffron_db_query_seconds_total',
+                                              'Time spent executing SQL statements', ('endpoint',))
+        self.request_queries = registry.histogram('saffron_request_db_queries', 'SQL statements per request',
+                                                  ('endpoint',), buckets=QUERY_COUNT_BUCKETS)
+        self.slow_requests = registry.counter('saffron_slow_requests_total',
+                                              f'Requests slower than {slow_request_seconds}s', ('endpoint',))
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._stop = threading.Event()
+            threading.Thread(target=self._write_snapshots, name='metrics-writer', daemon=True).start()
+            atexit.register(self._remove_snapshot)
+
+    @staticmethod
+    def _endpoint():
+        if not has_request_context():
+            return 'background'
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    def _before_request(self):
+        g._metrics = {'start': time.perf_counter(), 'status': 500, 'queries': []}
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        if '_metrics' in g:
+            g._metrics['status'] = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        state = g.pop('_metrics', None)
+        if state is None:
+            return
+        self.in_flight.dec()
+        elapsed = time.perf_counter() - state['start']
+        endpoint = self._endpoint()
+        self.latency.observe(elapsed, endpoint=endpoint, method=request.method, status=state['status'])
+        self.request_queries.observe(len(state['queries']), endpoint=endpoint)
+        if elapsed >= self.slow_request_seconds:
+            self.slow_requests.inc(endpoint=endpoint)
+            self._log_slow_request(elapsed, state)
+
+    def _log_slow_request(self, elapsed, state):
+        queries = state['queries']
+        slowest = sorted(queries, key=lambda query: query[0], reverse=True)[:SLOW_REQUEST_QUERIES]
+        lines = [f"Slow request {request.method} {request.full_path.rstrip('?')} took {elapsed:.3f}s "
+                 f"(status {state['status']}, {len(queries)} queries, "
+                 f"{sum(seconds for seconds, _ in queries):.3f}s in SQL)"]
+        for seconds, statement in slowest:
+            lines.append(f"  {seconds:.3f}s {_WHITESPACE.sub(' ', statement)[:STATEMENT_MAX_LENGTH]}")
+        slow_request_logger.warning('\n'.join(lines))
+
+    def instrument_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_metrics_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        endpoint = self._endpoint()
+        self.queries.inc(endpoint=endpoint)
+        self.query_seconds.inc(elapsed, endpoint=endpoint)
+        if has_request_context() and '_metrics' in g:
+            g._metrics['queries'].append((elapsed, statement))
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.directory, f"metrics-{pid or os.getpid()}.json")
+
+    def write_snapshot(self):
+        path = self._snapshot_path()
+        with open(path + '.tmp', 'w') as snapshot:
+            json.dump(self.registry.families(), snapshot)
+        os.replace(path + '.tmp', path)
+
+    def _write_snapshots(self):
+        while not self._stop.wait(self.write_interval):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                logger.warning('Could not write metrics snapshot: %s', e)
+
+    def _remove_snapshot(self):
+        self._stop.set()
+        try:
+            os.remove(self._snapshot_path())
+        except OSError:
+            pass
+
+    def _other_snapshots(self):
+        snapshots = []
+        for name in os.listdir(self.directory):
+            match = SNAPSHOT_FILE.match(name)
+            if match is None or int(match.group(1)) == os.getpid():
+                continue
+            path = os.path.join(self.directory, name)
+            if not process_alive(int(match.group(1))):
+                try:
+                    os.remove(path)  # A worker that was restarted; its counters start over
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as snapshot:
+                    snapshots.append(json.load(snapshot))
+            except (OSError, ValueError):
+                pass
+        return snapshots
+
+    def exposition(self):
+        snapshots = [self.registry.families()]
+        if self.directory:
+            snapshots += self._other_snapshots()
+        families = merge_families(snapshots)
+        add_hit_ratios(families, 'saffron_cache')
+        return render(families)
+
+
+def setup_logging(app, path, level=logging.WARNING, max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    Log the app and the application package to a rotating file through a queue:
+    request threads only enqueue records, a listener thread formats and writes them.
+    """
+    records = queue.SimpleQueue()
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(process)d] %(message)s'))
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    handler = QueueHandler(records)
+    handler.setLevel(level)
+    for target in (app.logger, logging.getLogger('application')):
+        target.setLevel(level)
+        target.addHandler(handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,14 +1,27 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from enum import Enum
+from sqlalchemy.dialects.postgresql import JSONB
 from application.database import db
 
+# JSON everywhere, stored as JSONB on PostgreSQL so it can be indexed and queried
+JSONVariant = db.JSON().with_variant(JSONB, 'postgresql')
+
+
+class TestType(Enum):
+    HFR = "hfr"
+    MUSHRA_GRANULAR = "mushra-granular"
+    MUSHRA = "mushra"
+    MVH_GRANULAR = "hfr-granular"
+    CMOS = "cmos"
+
 
 class Rater(db.Model):
     __tablename__ = 'rater'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     age = db.Column(db.Integer, nullable=False)
     gender = db.Column(db.String(10), nullable=False)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     email = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)  # Ensure you hash passwords
 
@@ -24,6 +37,7 @@ class Test(db.Model):
     test_type = db.Column(db.String(512), nullable=False)  # Increased length for PostgreSQL
     description = db.Column(db.Text, nullable=True)
     json_entry = db.Column(db.JSON, nullable=False)  # JSON column for PostgreSQL
+    item_count = db.Column(db.Integer, nullable=True)  # len(json_entry), kept so it can be counted in SQL
 
     ratings = db.relationship('Rating', backref='test', lazy=True)
 
@@ -31,6 +45,21 @@ class Test(db.Model):
         return f"<Test {self.test_type}>"
 
 
+class TestItem(db.Model):
+    """One item of Test.json_entry, for the normalized layout (NORMALIZED_ITEMS)."""
+    __tablename__ = 'test_item'
+    __table_args__ = (
+        db.Index('ix_test_item_test_id_position', 'test_id', 'position', unique=True),
+    )
+    test_id = db.Column(db.Integer, db.ForeignKey('test.id'), primary_key=True)
+    item_id = db.Column(db.String(50), primary_key=True)  # The item's id, as stored in Rating.page_no_progress
+    position = db.Column(db.Integer, nullable=False)  # Index of the item in Test.json_entry
+    payload = db.Column(JSONVariant, nullable=False)
+
+    def __repr__(self):
+        return f"<TestItem Test ID={self.test_id}, Item ID={self.item_id}>"
+
+
 class Study(db.Model):
     __tablename__ = 'study'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -59,22 +88,93 @@ class Session(db.Model):
 
 class Rating(db.Model):
     __tablename__ = 'rating'
+    __table_args__ = (
+        # Covers the "pages done by this rater" lookup without touching the heap
+        db.Index('ix_rating_rater_id_test_id', 'rater_id', 'test_id',
+                 postgresql_include=['page_no_progress']),
+        db.Index('ix_rating_test_id_id', 'test_id', 'id'),
+        db.UniqueConstraint('submission_key', name='uq_rating_submission_key'),
+        # Containment queries (results_json @> '{...}')
+        db.Index('ix_rating_results_json', 'results_json', postgresql_using='gin',
+                 postgresql_ops={'results_json': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     rater_id = db.Column(db.Integer, db.ForeignKey('rater.id'), nullable=False)
     test_id = db.Column(db.Integer, db.ForeignKey('test.id'), nullable=False)
-    results_json = db.Column(db.JSON, nullable=False)  # JSON column for PostgreSQL
+    results_json = db.Column(JSONVariant, nullable=False)  # JSONB on PostgreSQL
     time_of_submission = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     time_taken_to_submit = db.Column(db.Float, nullable=False)  # Assuming seconds
     page_no_progress = db.Column(db.String(50), nullable=True)  # Page or progress
+    submission_key = db.Column(db.String(64), nullable=True)  # Makes replayed submissions idempotent
 
     def __repr__(self):
         return f"<Rating Rater ID={self.rater_id}, Test ID={self.test_id}>"
 
+class RatingScore(db.Model):
+    """One rated audio of a rating, extracted from results_json so it can be aggregated in SQL."""
+    __tablename__ = 'rating_score'
+    __table_args__ = (
+        db.Index('ix_rating_score_test_id_system', 'test_id', 'system', postgresql_include=['score']),
+        db.Index('ix_rating_score_test_id_label', 'test_id', 'label'),
+        db.Index('ix_rating_score_rating_id', 'rating_id'),
+        db.Index('ix_rating_score_attributes', 'attributes', postgresql_using='gin',
+                 postgresql_ops={'attributes': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    rating_id = db.Column(db.Integer, db.ForeignKey('rating.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('test.id'), nullable=False)
+    rater_id = db.Column(db.Integer, db.ForeignKey('rater.id'), nullable=False)
+    test_type = db.Column(db.String(512), nullable=True)
+    role = db.Column(db.String(16), nullable=False)  # "reference" or "test"
+    url = db.Column(db.Text, nullable=True)
+    system = db.Column(db.String(512), nullable=True)
+    score = db.Column(db.Float, nullable=True)
+    label = db.Column(db.String(512), nullable=True)
+    attributes = db.Column(JSONVariant, nullable=True)  # Granular reasons / attribute sliders
+
+    def __repr__(self):
+        return f"<RatingScore Rating ID={self.rating_id}, System={self.system}>"
+
+class Progress(db.Model):
+    """A rater's progress on a test, kept up to date in the transaction of every new rating."""
+    __tablename__ = 'progress'
+    __table_args__ = (
+        db.UniqueConstraint('rater_id', 'test_id', name='uq_progress_rater_id_test_id'),
+        db.Index('ix_progress_test_id', 'test_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    rater_id = db.Column(db.Integer, db.ForeignKey('rater.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('test.id'), nullable=False)
+    completed = db.Column(db.Integer, nullable=False, default=0)  # Distinct pages rated
+    last_page = db.Column(db.String(50), nullable=True)  # page_no_progress of the latest rating
+    time_of_last_rating = db.Column(db.DateTime, nullable=True)
+    time_of_completion = db.Column(db.DateTime, nullable=True)  # When completed reached Test.item_count
+
+    def __repr__(self):
+        return f"<Progress Rater ID={self.rater_id}, Test ID={self.test_id}, Completed={self.completed}>"
+
 class Consent(db.Model):
+    __table_args__ = (
+        db.Index('ix_consent_rater_id_test_id', 'rater_id', 'test_id'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     rater_id = db.Column(db.Integer, db.ForeignKey('rater.id'), nullable=False)
     test_id = db.Column(db.Integer, db.ForeignKey('test.id'), nullable=False)
     time_of_submission = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     def __repr__(self):
-        return f"<Consent Rater ID={self.rater_id}>, Test ID={self.test_id}>"
\ No newline at end of file
+        return f"<Consent Rater ID={self.rater_id}>, Test ID={self.test_id}>"
+
+class Assignment(db.Model):
+    __tablename__ = 'assignment'
+    __table_args__ = (
+        db.UniqueConstraint('rater_id', 'test_id', name='uq_assignment_rater_id_test_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    rater_id = db.Column(db.Integer, db.ForeignKey('rater.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('test.id'), nullable=False)
+    seed = db.Column(db.Integer, nullable=False)  # Seeds the order the rater sees the samples in
+    time_of_creation = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Assignment Rater ID={self.rater_id}, Test ID={self.test_id}>"
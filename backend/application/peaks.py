@@ -0,0 +1,140 @@
+import logging
+import os
+import struct
+import wave
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from application.assets import AUDIO_TYPES, audio_references
+
+logger = logging.getLogger(__name__)
+
+# Points per clip. Clips are short utterances drawn in a waveform a few hundred
+# pixels wide, so a fixed count is plenty and keeps every file at about 2 kB.
+PEAKS_POINTS = 1024
+
+PEAKS_EXTENSION = '.peaks'
+PEAKS_MAGIC = b'WFPK'
+PEAKS_VERSION = 1
+
+# magic, version, bits per value, sample rate, samples per point, points, duration in seconds;
+# followed by the maxima and then the minima of each point as signed 8-bit values (x / 127)
+PEAKS_HEADER = struct.Struct('<4sHHIIIf')
+
+PEAKS_WORKERS = 4
+
+_PCM_TYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+class PeaksUnavailable(Exception):
+    """The audio cannot be decoded here (an unsupported format, or soundfile is not installed)."""
+
+
+def _read_wav(path):
+    with wave.open(path, 'rb') as audio:
+        channels, width, rate = audio.getnchannels(), audio.getsampwidth(), audio.getframerate()
+        raw = audio.readframes(audio.getnframes())
+    if width == 3:
+        # 24-bit: widen every sample to 32 bits, the extra byte lowest
+        data = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        samples = np.zeros((len(data), 4), dtype=np.uint8)
+        samples[:, 1:] = data
+        samples = samples.view('<i4').ravel().astype(np.float32) / 2 ** 31
+    elif width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    else:
+        dtype = np.dtype(_PCM_TYPES[width]).newbyteorder('<')
+        samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) / 2 ** (8 * width - 1)
+    return samples.reshape(-1, channels), rate
+
+
+def read_audio(path):
+    """Samples of an audio file as float32 in [-1, 1], shaped (frames, channels), and the sample rate."""
+    if path.endswith('.wav'):
+        try:
+            return _read_wav(path)
+        except (wave.Error, EOFError, KeyError):
+            pass  # Float or compressed WAV, leave it to soundfile
+    try:
+        import soundfile
+    except ImportError:
+        raise PeaksUnavailable(f"{os.path.basename(path)}: decoding needs soundfile")
+    try:
+        return soundfile.read(path, dtype='float32', always_2d=True)
+    except RuntimeError as e:
+        raise PeaksUnavailable(f"{os.path.basename(path)}: {e}")
+
+
+def compute_peaks(samples, points=PEAKS_POINTS):
+    """Maxima and minima of the channels' mean over points equal slices of the clip."""
+    mono = samples.mean(axis=1) if samples.ndim == 2 else samples
+    points = min(points, len(mono))
+    if points == 0:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32), 0
+    starts = np.linspace(0, len(mono), points + 1).astype(np.int64)[:-1]
+    return np.maximum.reduceat(mono, starts), np.minimum.reduceat(mono, starts), len(mono) // points
+
+
+def encode_peaks(maxima, minima, sample_rate, samples_per_point, duration):
+    header = PEAKS_HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, 8, sample_rate, samples_per_point,
+                               len(maxima), duration)
+    values = np.concatenate([maxima, minima])
+    return header + np.round(np.clip(values, -1, 1) * 127).astype(np.int8).tobytes()
+
+
+def decode_peaks(data):
+    """(maxima, minima, duration) of an encoded peaks file, the values in [-1, 1]."""
+    magic, version, bits, _, _, points, duration = PEAKS_HEADER.unpack_from(data)
+    if magic != PEAKS_MAGIC or version != PEAKS_VERSION or bits != 8:
+        raise ValueError('Not a peaks file of a supported version')
+    values = np.frombuffer(data, dtype=np.int8, offset=PEAKS_HEADER.size).astype(np.float32) / 127
+    return values[:points], values[points:2 * points], duration
+
+
+def peaks_name(asset_name):
+    return os.path.splitext(asset_name)[0] + PEAKS_EXTENSION
+
+
+def store_peaks(store, asset_name):
+    """Compute the peaks of a stored clip, unless they already are. Returns the peaks' asset name."""
+    name = peaks_name(asset_name)
+    path = store.path(name)
+    if not os.path.exists(path):
+        samples, rate = read_audio(store.path(asset_name))
+        maxima, minima, samples_per_point = compute_peaks(samples)
+        data = encode_peaks(maxima, minima, rate, samples_per_point, len(samples) / rate if rate else 0.0)
+        with open(f"{path}.{os.getpid()}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return name
+
+
+def add_peaks(items, store, workers=PEAKS_WORKERS):
+    """
+    Compute the peaks of every stored clip the items reference, decoding each clip once,
+    and add their URL next to the clip's (audio_path_peaks, reference_audio_peaks, ...).
+    Clips that cannot be decoded get no peaks; the client then draws them from the audio.
+    Returns the problems found.
+    """
+    references = [(container, key, store.name_of(container[key])) for item in items
+                  for container, key in audio_references(item)]
+    references = [(container, key, name) for container, key, name in references
+                  if name is not None and os.path.splitext(name)[1] in AUDIO_TYPES]
+    names = sorted({name for _, _, name in references})
+
+    def peaks(name):
+        try:
+            return name, store_peaks(store, name), None
+        except (PeaksUnavailable, OSError, ValueError) as e:
+            return name, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names)))) as pool:
+        results = list(pool.map(peaks, names))
+
+    stored = {name: peaks for name, peaks, _ in results if peaks is not None}
+    for container, key, name in references:
+        if name in stored:
+            container[f"{key}_peaks"] = store.url(stored[name])
+    problems = [problem for _, _, problem in results if problem is not None]
+    for problem in problems:
+        logger.warning('No waveform peaks for %s', problem)
+    return problems
@@ -0,0 +1,114 @@
+from datetime import datetime
+from application.database import db, upsert_into
+from application.models import Progress, Rating, Test
+from application.samples import get_sample_index
+
+# Rebuilds the progress rows of one test from the ratings themselves (see rebuild_progress);
+# :pages are the test's item ids, other page values are not counted
+REBUILD_PROGRESS_SQL = """
+    INSERT INTO progress (rater_id, test_id, completed, last_page, time_of_last_rating, time_of_completion)
+    SELECT r.rater_id, r.test_id, COUNT(DISTINCT CASE WHEN r.page_no_progress IN :pages THEN r.page_no_progress END),
+           (SELECT r2.page_no_progress FROM rating r2
+            WHERE r2.rater_id = r.rater_id AND r2.test_id = r.test_id
+            ORDER BY r2.id DESC LIMIT 1),
+           MAX(r.time_of_submission),
+           CASE WHEN COUNT(DISTINCT CASE WHEN r.page_no_progress IN :pages THEN r.page_no_progress END)
+                     >= MAX(t.item_count) THEN MAX(r.time_of_submission) END
+    FROM rating r
+    JOIN test t ON t.id = r.test_id
+    WHERE r.test_id = :test_id
+    GROUP BY r.rater_id, r.test_id
+"""
+
+def item_pages(test_id, pages):
+    """The subset of pages (page_no_progress values) that are items of the test, as strings."""
+    index = get_sample_index(test_id)
+    if index is None:
+        return set()
+    return {str(page) for page in index.completed(int(page) for page in pages if str(page).isdigit())}
+
+
+def record_progress(ratings, now=None):
+    """
+    Count freshly inserted ratings (anything with id, rater_id, test_id and page_no_progress)
+    into the progress of their raters, in the caller's transaction. Only pages that are
+    items of the test and that the rater had not rated before are added. The check runs
+    while the progress row is locked, so of two concurrent ratings of the same page the
+    second one sees the first and the page is counted once.
+    """
+    now = now or datetime.utcnow()
+    groups = {}
+    for rating in ratings:
+        groups.setdefault((rating.rater_id, rating.test_id), []).append(rating)
+
+    # Rows are locked in a fixed order so that batches sharing raters cannot deadlock
+    for (rater_id, test_id), group in sorted(groups.items(), key=lambda entry: entry[0]):
+        db.session.execute(upsert_into(Progress).values(
+            rater_id=rater_id, test_id=test_id, completed=0
+        ).on_conflict_do_nothing(index_elements=['rater_id', 'test_id']))
+        # Waits for the transactions holding the row; the statements below then see
+        # (READ COMMITTED) the ratings they committed
+        db.session.query(Progress.id).filter(
+            Progress.rater_id == rater_id, Progress.test_id == test_id
+        ).with_for_update().one()
+
+        pages = item_pages(test_id, [rating.page_no_progress for rating in group
+                                     if rating.page_no_progress is not None])
+        if pages:
+            rated_before = db.session.query(Rating.page_no_progress).filter(
+                Rating.rater_id == rater_id, Rating.test_id == test_id,
+                Rating.page_no_progress.in_(sorted(pages)), Rating.id.notin_([rating.id for rating in group])
+            ).distinct().all()
+            pages -= {page for page, in rated_before}
+        last_page = max(group, key=lambda rating: rating.id).page_no_progress
+
+        completed = Progress.completed + len(pages)
+        item_count = db.select(Test.item_count).where(Test.id == test_id).scalar_subquery()
+        db.session.query(Progress).filter(
+            Progress.rater_id == rater_id, Progress.test_id == test_id
+        ).update({
+            'completed': completed,
+            'last_page': None if last_page is None else str(last_page),
+            'time_of_last_rating': now,
+            'time_of_completion': db.case(
+                (Progress.time_of_completion.isnot(None), Progress.time_of_completion),
+                (item_count <= completed, now),
+                else_=None
+            )
+        }, synchronize_session=False)
+
+
+def rebuild_progress(test_id=None):
+    """Recompute progress from Rating, for one test or all of them. Returns the number of rows."""
+    delete = db.session.query(Progress)
+    if test_id is not None:
+        delete = delete.filter(Progress.test_id == test_id)
+    delete.delete(synchronize_session=False)
+    test_ids = [test_id] if test_id is not None else [row.id for row in db.session.query(Test.id)]
+    statement = db.text(REBUILD_PROGRESS_SQL).bindparams(db.bindparam('pages', expanding=True))
+    rows = 0
+    for test_id in test_ids:
+        index = get_sample_index(test_id)
+        pages = sorted({str(page) for page in index.ids}) if index is not None else []
+        rows += db.session.execute(statement, {'test_id': test_id, 'pages': pages}).rowcount
+    return rows
+
+
+def rater_progress(rater_id, test_id, pending=()):
+    """
+    (completed pages, total pages) of a rater on a test; None if the test does not exist.
+    pending are pages of ratings that may not be in the database yet: those that are not
+    are counted too, in the same statement so that a rating written meanwhile counts once.
+    """
+    completed = db.func.coalesce(Progress.completed, 0)
+    if pending:
+        written = db.select(db.func.count(db.distinct(Rating.page_no_progress))).where(
+            Rating.rater_id == rater_id, Rating.test_id == test_id,
+            Rating.page_no_progress.in_(sorted(pending))
+        ).scalar_subquery()
+        completed = completed + len(pending) - written
+    return db.session.query(
+        completed, Test.item_count
+    ).select_from(Test).outerjoin(
+        Progress, db.and_(Progress.test_id == Test.id, Progress.rater_id == rater_id)
+    ).filter(Test.id == test_id).first()
@@ -0,0 +1,156 @@
+from sqlalchemy import event
+from application.cache import LocalCache
+from application.database import db
+from application.models import Test
+
+# Number of tests whose sample index is kept per process
+SAMPLE_INDEX_CACHE_SIZE = 64
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix(value):
+    """splitmix64 finalizer: a cheap, well-distributed 64-bit hash."""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class SeededPermutation:
+    """
+    A pseudo-random bijection of range(size) keyed by a seed. Position k maps to
+    its index without materializing the shuffled list: a Feistel network
+    permutes the enclosing power-of-two domain, and values that fall outside
+    range(size) are permuted again until they land inside (cycle walking, a
+    handful of steps on average since the domain is less than 4 * size).
+
+    On the tiny domains of small tests a Feistel network only reaches a subset
+    of the orders, however many rounds it has, so up to SHUFFLE_MAX_SIZE the
+    order is a seeded Fisher-Yates shuffle instead, which is uniform.
+    scripts/check_permutation_distribution.py measures both.
+    """
+    ROUNDS = 12
+    SHUFFLE_MAX_SIZE = 256
+
+    def __init__(self, size, seed):
+        self.size = size
+        bits = max((size - 1).bit_length(), 2)
+        self.half = (bits + 1) // 2
+        self.mask = (1 << self.half) - 1
+        self.keys = [_mix((seed << 8) | round_no) for round_no in range(self.ROUNDS)]
+        self.table = self._shuffle(size, seed) if size <= self.SHUFFLE_MAX_SIZE else None
+
+    @staticmethod
+    def _shuffle(size, seed):
+        table = list(range(size))
+        state = _mix(seed ^ 0x5EED5EED5EED5EED)
+        for i in range(size - 1, 0, -1):
+            state = _mix(state)
+            j = state % (i + 1)  # 64-bit draws: the modulo bias is negligible
+            table[i], table[j] = table[j], table[i]
+        return table
+
+    def _encrypt(self, value):
+        left, right = value >> self.half, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (_mix(right ^ key) & self.mask)
+        return (left << self.half) | right
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        if self.table is not None:
+            return self.table[position]
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class SampleIndex:
+    """
+    The samples of one test, parsed once: ids in test order, an id -> entry
+    lookup and the total count. Built from Test.json_entry and cached per
+    process, so serving a page only costs a lookup of the completed ids.
+    """
+    __slots__ = ('ids', 'id_set', 'entries', 'total')
+
+    def __init__(self, json_entry):
+        self.ids = [entry['id'] for entry in json_entry]
+        self.id_set = frozenset(self.ids)
+        self.entries = {entry['id']: entry for entry in json_entry}
+        self.total = len(self.ids)
+
+    def completed(self, page_ids):
+        """The subset of page_ids that are samples of this test."""
+        return self.id_set.intersection(page_ids)
+
+    def remaining_count(self, page_ids):
+        return self.total - len(self.completed(page_ids))
+
+    def order(self, seed):
+        """All sample ids in the order given by a rater's seed."""
+        permutation = SeededPermutation(self.total, seed)
+        return [self.ids[permutation[position]] for position in range(self.total)]
+
+    def sequence(self, page_ids, seed):
+        """
+        Completed samples in test order, followed by the remaining ones in seed order.
+        Returns the entries and the position of the first remaining one.
+        """
+        completed = self.completed(page_ids)
+        done = [sample_id for sample_id in self.ids if sample_id in completed]
+        remaining = [sample_id for sample_id in self.order(seed) if sample_id not in completed]
+        return [self.entries[sample_id] for sample_id in done + remaining], len(done)
+
+    def window(self, page_ids, seed, start, limit):
+        """
+        Up to limit remaining samples, walking the seed order from position start.
+        Returns the entries and the position to continue from, or None at the end.
+        """
+        completed = self.completed(page_ids)
+        permutation = SeededPermutation(self.total, seed)
+        items = []
+        position = start
+        while position < self.total and len(items) < limit:
+            sample_id = self.ids[permutation[position]]
+            position += 1
+            if sample_id not in completed:
+                items.append(self.entries[sample_id])
+        return items, position if position < self.total else None
+
+
+_indexes = LocalCache(max_entries=SAMPLE_INDEX_CACHE_SIZE, default_timeout=0)
+
+
+def cache_sample_index(test_id, json_entry):
+    index = SampleIndex(json_entry)
+    _indexes.set(test_id, index)
+    return index
+
+
+def get_sample_index(test_id):
+    """The SampleIndex of a test, or None if the test does not exist."""
+    index = _indexes.get(test_id)
+    if index is not None:
+        return index
+
+    json_entry = db.session.query(Test.json_entry).filter_by(id=test_id).scalar()
+    if json_entry is None:
+        return None
+    return cache_sample_index(test_id, json_entry)
+
+
+def invalidate_sample_index(test_id):
+    _indexes.delete(test_id)
+
+
+def sample_index_stats():
+    return _indexes.stats()
+
+
+@event.listens_for(Test, 'after_update')
+@event.listens_for(Test, 'after_delete')
+def _drop_stale_index(mapper, connection, test):
+    invalidate_sample_index(test.id)
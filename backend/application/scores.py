@@ -0,0 +1,55 @@
+from sqlalchemy import insert
+from application.database import db
+from application.models import Test, RatingScore
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def rated_audios(results_json):
+    """(role, audio) for the reference (MUSHRA/CMOS) and every test audio of a rating."""
+    results = results_json if isinstance(results_json, dict) else {}
+    if isinstance(results.get('reference'), dict):
+        yield 'reference', results['reference']
+    for audio in results.get('audios') or []:
+        if isinstance(audio, dict):
+            yield 'test', audio
+
+
+def score_rows(rating, test_type):
+    """RatingScore rows of a rating (anything with id, rater_id, test_id and results_json)."""
+    return [{
+        'rating_id': rating.id,
+        'test_id': rating.test_id,
+        'rater_id': rating.rater_id,
+        'test_type': test_type,
+        'role': role,
+        'url': audio.get('url'),
+        'system': audio.get('system'),
+        'score': to_float(audio.get('score')),
+        'label': audio.get('label'),
+        'attributes': audio.get('attributes') if isinstance(audio.get('attributes'), dict) else None
+    } for role, audio in rated_audios(rating.results_json)]
+
+
+def insert_scores(ratings):
+    """Extract the scores of freshly inserted ratings, in the caller's transaction."""
+    ratings = list(ratings)
+    if not ratings:
+        return 0
+    test_types = dict(db.session.query(Test.id, Test.test_type)
+                      .filter(Test.id.in_({rating.test_id for rating in ratings})))
+    rows = [row for rating in ratings for row in score_rows(rating, test_types.get(rating.test_id))]
+    if rows:
+        db.session.execute(insert(RatingScore), rows)
+    return len(rows)
+
+
+def replace_scores(rating):
+    """Re-extract the scores of a rating whose results_json changed."""
+    db.session.query(RatingScore).filter(RatingScore.rating_id == rating.id).delete(synchronize_session=False)
+    insert_scores([rating])
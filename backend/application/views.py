@@ -1,35 +1,104 @@
-from flask import jsonify, request
+from flask import jsonify, request, Response, stream_with_context, abort, g, send_file
 from werkzeug.security import generate_password_hash
 from flask import current_app as app
-from application.models import db, Rater, Test, Rating, Study, Session, Consent
+from application.database import upsert_into
+from application.models import db, Rater, Test, Rating, Study, Session, Consent, Assignment, Progress
+from application.samples import get_sample_index, cache_sample_index, sample_index_stats
+from application.cache import LocalCache, SharedCache, TieredCache
+from application.ingest import RatingJournal, RatingIngestor
+from application.metrics import RequestMetrics, counter_family, setup_logging
+from application.assets import AssetStore, ASSET_NAME, localize_items
+from application.peaks import add_peaks
+from application.scores import insert_scores, replace_scores
+from application.progress import record_progress, rater_progress
+from application.analytics import analyze_test, BOOTSTRAP_RESAMPLES, CONFIDENCE
+from application.items import (store_test_items, uses_normalized_items, item_total,
+                               completed_count, remaining_count, remaining_window)
+from application.export import (iter_ratings, iter_ndjson, iter_json_array, iter_export,
+                                EXPORT_FORMATS, parquet_available)
 from datetime import datetime, timedelta
 import jwt
+import secrets
+import time
 from functools import wraps
-import random
-import logging
-from logging.handlers import RotatingFileHandler
-from flask_caching import Cache
-
-random.seed(42)
-
-cache_config = {
-    'CACHE_TYPE': 'filesystem',  # More persistent than SimpleCache
-    'CACHE_DIR': '/tmp/flask-cache',  # Cache directory
-    'CACHE_DEFAULT_TIMEOUT': 6000,  # 10 minutes default
-    'CACHE_THRESHOLD': 1000,  # Maximum number of items
-    'CACHE_KEY_PREFIX': 'tts_saffron_'  # Prefix to avoid collisions
-}
-cache = Cache(config=cache_config)
-cache.init_app(app)
+import atexit
+import os
+
+# Largest page of samples served by the paged test endpoints
+MAX_PAGE_SIZE = 100
+
+# Most page results accepted by one batch rating submission
+MAX_RATING_BATCH = 200
+
+# Raters, tests, studies and sessions are never edited by the API, so lookups
+# of them are cached for this long
+LOOKUP_CACHE_TIMEOUT = 300
+
+# In-process LRU, backed by a shared Redis-protocol tier when CACHE_REDIS_URL is set
+cache = TieredCache(
+    LocalCache(max_entries=app.config['CACHE_LOCAL_MAX_ENTRIES'], default_timeout=6000),
+    SharedCache.from_url(app.config['CACHE_REDIS_URL'], key_prefix='tts_saffron_', default_timeout=6000)
+    if app.config['CACHE_REDIS_URL'] else None
+)
+
+# Claims of tokens whose signature was already checked, keyed by the token itself
+verified_tokens = LocalCache(max_entries=10000, default_timeout=300)
+
+# Write-behind rating ingestion: ratings are journaled and acknowledged at once,
+# then written to the database in batches by a background thread
+rating_ingestor = None
+if app.config['RATING_INGEST'] == 'journal':
+    rating_ingestor = RatingIngestor(app._get_current_object(),
+                                     RatingJournal(app.config['RATING_JOURNAL_DIR']),
+                                     flush_interval=app.config['RATING_FLUSH_INTERVAL'])
+    rating_ingestor.start()
+    atexit.register(rating_ingestor.stop)
+
+# Content-addressed copies of test audio, served under /api/static/audio
+asset_store = None
+if app.config['AUDIO_ASSET_DIR']:
+    asset_store = AssetStore(app.config['AUDIO_ASSET_DIR'], app.config['AUDIO_ASSET_URL'])
+
+# Stored audio is named after its content, so it can be cached for good
+ASSET_MAX_AGE = 365 * 24 * 3600
 
 def get_screening_timer_key(rater_id, study_id):
     return f"screening_timer_{rater_id}_{study_id}"
 
-# Set up logging
+# Set up logging: records are handed to a queue and written by a listener thread
 if not app.debug:
-    handler = RotatingFileHandler('error.log', maxBytes=10000, backupCount=1)
-    handler.setLevel(logging.ERROR)
-    app.logger.addHandler(handler)
+    setup_logging(app, app.config['LOG_FILE'], level=app.config['LOG_LEVEL'],
+                  max_bytes=app.config['LOG_MAX_BYTES'], backup_count=app.config['LOG_BACKUP_COUNT'])
+
+# Latency, in-flight requests and SQL statements per endpoint, served by /api/metrics
+metrics = RequestMetrics(app, slow_request_seconds=app.config['SLOW_REQUEST_SECONDS'],
+                         directory=app.config['METRICS_DIR'])
+metrics.instrument_engine(db.engine)
+
+
+def cache_metrics():
+    caches = {'lookups_local': cache.local, 'lookups_shared': cache.shared, 'verified_tokens': verified_tokens}
+    stats = {name: tier.stats() for name, tier in caches.items() if tier is not None}
+    stats['sample_indexes'] = sample_index_stats()
+    families = {
+        'saffron_cache_hits_total': counter_family(
+            'Lookups served from the cache', [({'cache': name}, s['hits']) for name, s in stats.items()]),
+        'saffron_cache_misses_total': counter_family(
+            'Lookups not found in the cache', [({'cache': name}, s['misses']) for name, s in stats.items()]),
+        'saffron_cache_entries': counter_family(
+            'Entries held by in-process caches',
+            [({'cache': name}, s['entries']) for name, s in stats.items() if 'entries' in s], kind='gauge')
+    }
+    if rating_ingestor is not None:
+        ingest = rating_ingestor.stats()
+        families['saffron_rating_ingest_submitted_total'] = counter_family(
+            'Ratings written to the journal', [({}, ingest['submitted'])])
+        families['saffron_rating_ingest_written_total'] = counter_family(
+            'Journaled ratings written to the database', [({}, ingest['written'])])
+    return families
+
+
+metrics.registry.add_collector(cache_metrics)
 
 
 @app.errorhandler(Exception)
@@ -38,23 +107,45 @@ def unhandled_exception(e):
     return jsonify({'message': 'Internal Server Error'}), 500
 
 
+def decode_token(token):
+    """Claims of a token, verifying its signature only the first time it is seen."""
+    claims = verified_tokens.get(token)
+    if claims is None:
+        claims = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+        verified_tokens.set(token, claims)
+    elif claims['exp'] <= time.time():
+        verified_tokens.delete(token)
+        raise jwt.ExpiredSignatureError('Signature has expired')
+    return claims
+
 def token_required(f):
+    """
+    Decode the bearer token once and keep its claims in g.claims for the rest of the request.
+    The username is passed to the view as its first argument.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         try:
-            token = token.split()[1]
-            data = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-            current_user = data['username']
+            g.claims = decode_token(token.split()[1])
+            current_user = g.claims['username']
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired!'}), 401
-        except jwt.InvalidTokenError:
+        except (jwt.InvalidTokenError, IndexError, KeyError):
             return jsonify({'message': 'Invalid token!'}), 401
         return f(current_user, *args, **kwargs)
     return decorated
 
+def current_rater_id():
+    """Rater id of the authenticated user, from the token or, for older tokens, by name."""
+    rater_id = g.claims.get('rater_id')
+    if rater_id is None:
+        rater = find_rater_by_name(g.claims['username'])
+        rater_id = rater['id'] if rater else None
+    return rater_id
+
 def get_remaining_time(rater_id, study_id):
     timer_key = get_screening_timer_key(rater_id, study_id)
     try:
@@ -63,17 +154,184 @@ def get_remaining_time(rater_id, study_id):
             return 480  # 8 minutes default
         
         elapsed = (datetime.utcnow() - start_time).total_seconds()
-        remaining = max(480 - int(elapsed), 0)
-        
-        # Refresh cache if still active
-        if remaining > 0:
-            cache.set(timer_key, start_time, timeout=6000)
-            
-        return remaining
+        return max(480 - int(elapsed), 0)
     except Exception as e:
         app.logger.error(f"Cache error in get_remaining_time: {e}")
         return 480  # Fallback to default
 
+def cached_lookup(key, load):
+    """Value of load(), a dict or None, cached under key when found."""
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        if value is not None:
+            cache.set(key, value, timeout=LOOKUP_CACHE_TIMEOUT)
+    return value
+
+def row_dict(row):
+    return dict(row._mapping) if row is not None else None
+
+def find_rater_by_name(name):
+    return cached_lookup(f"rater_name_{name}", lambda: row_dict(
+        db.session.query(Rater.id, Rater.email).filter_by(name=name).first()))
+
+def find_rater_by_email(email):
+    return cached_lookup(f"rater_email_{email}", lambda: row_dict(
+        db.session.query(Rater.id, Rater.name).filter_by(email=email).first()))
+
+def find_test(test_id):
+    return cached_lookup(f"test_{test_id}", lambda: row_dict(
+        db.session.query(Test.id, Test.test_type, Test.description).filter_by(id=test_id).first()))
+
+def find_study(study_id):
+    """The study and its test, in one read."""
+    return cached_lookup(f"study_{study_id}", lambda: row_dict(
+        db.session.query(
+            Study.id, Study.completion_url, Test.id.label('test_id'), Test.test_type, Test.description
+        ).join(Test, Test.id == Study.test_id).filter(Study.study_id == study_id).first()))
+
+def find_session(session_id):
+    return cached_lookup(f"session_{session_id}", lambda: row_dict(
+        db.session.query(Session.prolific_pid, Session.study_id).filter_by(session_id=session_id).first()))
+
+def store_rating(**fields):
+    """
+    Insert a rating, or journal it when write-behind ingestion is on.
+    Returns the response for the client.
+    """
+    if rating_ingestor is not None:
+        rating_ingestor.submit(fields)
+        return jsonify({'message': 'Rating accepted'}), 202
+    rating = Rating(**fields)
+    db.session.add(rating)
+    db.session.flush()
+    insert_scores([rating])
+    record_progress([rating])
+    db.session.commit()
+    return jsonify({'message': 'Rating created successfully'}), 201
+
+def store_rating_batch(items, make_fields):
+    """
+    Validate a batch of page results together and store the valid ones with a single INSERT.
+    make_fields(item) turns a valid item into Rating keyword arguments. Items carrying an
+    idempotency_key that was already stored (by an earlier attempt of the same batch, or
+    earlier in this one) are reported as duplicates instead of being inserted again.
+    Returns one status per item, in order.
+    """
+    statuses, pending, keys = [], [], set()
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('results_json'), dict) \
+                or not isinstance(item.get('time_taken_to_submit'), (int, float)):
+            statuses.append({'index': position, 'status': 'invalid',
+                             'message': 'Expected results_json and time_taken_to_submit'})
+            continue
+        key = str(item.get('idempotency_key') or secrets.token_hex(16))[:64]
+        status = {'index': position, 'status': 'duplicate', 'idempotency_key': key}
+        statuses.append(status)
+        if key not in keys:
+            keys.add(key)
+            pending.append((status, dict(make_fields(item), submission_key=key)))
+
+    if rating_ingestor is not None:
+        # Journaled ratings are deduplicated on their key when they are written
+        for status, fields in pending:
+            rating_ingestor.submit(fields)
+            status['status'] = 'accepted'
+    elif pending:
+        now = datetime.utcnow()
+        inserted = db.session.execute(
+            upsert_into(Rating).values([dict(fields, time_of_submission=now) for _, fields in pending])
+            .on_conflict_do_nothing(index_elements=['submission_key'])
+            .returning(Rating.id, Rating.rater_id, Rating.test_id, Rating.results_json,
+                       Rating.page_no_progress, Rating.submission_key)
+        ).all()
+        insert_scores(inserted)
+        record_progress(inserted)
+        db.session.commit()
+        created = {row.submission_key for row in inserted}
+        for status, fields in pending:
+            if fields['submission_key'] in created:
+                status['status'] = 'created'
+    return statuses
+
+def batch_response(statuses):
+    counts = {}
+    for status in statuses:
+        counts[status['status']] = counts.get(status['status'], 0) + 1
+    code = 400 if statuses and counts.get('invalid') == len(statuses) else 200
+    return jsonify({'results': statuses, 'counts': counts}), code
+
+def journaled_pages(rater_id, test_id):
+    """
+    Pages of the rater's ratings accepted by write-behind ingestion (202) that may not be
+    in the database yet. Call it before reading the rater's ratings or progress.
+    """
+    if rating_ingestor is None:
+        return set()
+    return rating_ingestor.pending_pages(rater_id, test_id)
+
+def completed_page_ids(rater_id, test_id):
+    pages = Rating.query.filter_by(rater_id=rater_id, test_id=test_id) \
+                        .with_entities(Rating.page_no_progress).all()
+    return {int(page.page_no_progress) for page in pages if page.page_no_progress}
+
+def get_assignment_seed(rater_id, test_id, commit=True):
+    """The rater's shuffle seed for a test, drawn and stored on first use."""
+    seed = db.session.query(Assignment.seed).filter_by(rater_id=rater_id, test_id=test_id).scalar()
+    if seed is None:
+        seed = db.session.execute(
+            upsert_into(Assignment).values(
+                rater_id=rater_id,
+                test_id=test_id,
+                seed=secrets.randbits(31),
+                time_of_creation=datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=['rater_id', 'test_id']).returning(Assignment.seed)
+        ).scalar()
+        if seed is None:
+            # A concurrent request stored a seed first
+            seed = db.session.query(Assignment.seed).filter_by(rater_id=rater_id, test_id=test_id).scalar()
+        if commit:
+            db.session.commit()
+    return seed
+
+def serve_samples(rater_id, test_id, limit=None, start=0, seed=None, page_ids=None):
+    """
+    The rater's samples of a test: completed ones first, then the remaining ones in the
+    rater's seed order. With a limit only the next page of remaining samples is
+    returned (items, next, total), starting at position start of the seed order.
+    """
+    if seed is None:
+        seed = get_assignment_seed(rater_id, test_id)
+    pending = journaled_pages(rater_id, test_id)
+    if limit is not None and uses_normalized_items(test_id):
+        total = item_total(test_id)
+        items, next_start = remaining_window(test_id, rater_id, seed, max(start, 0),
+                                             min(max(limit, 1), MAX_PAGE_SIZE), total, pending)
+        return {
+            'items': items,
+            'next': next_start,
+            'page_no': completed_count(test_id, rater_id, pending),
+            'total': total
+        }
+
+    index = get_sample_index(test_id)
+    if page_ids is None:
+        page_ids = completed_page_ids(rater_id, test_id)
+    if pending:
+        page_ids = page_ids | {int(page) for page in pending if page.isdigit()}
+
+    if limit is None:
+        json_entry, page_no = index.sequence(page_ids, seed)
+        return {'json_entry': json_entry, 'page_no': page_no}
+
+    items, next_start = index.window(page_ids, seed, max(start, 0), min(max(limit, 1), MAX_PAGE_SIZE))
+    return {
+        'items': items,
+        'next': next_start,
+        'page_no': len(index.completed(page_ids)),
+        'total': index.total
+    }
+
 @app.route('/api/')
 def index():
     return "API is running"
@@ -83,13 +341,21 @@ def index():
 # =====================
 
 
-def generate_token(username):
+def generate_token(username, rater_id=None, consents=None):
+    """
+    Signed token for a rater. rater_id and consents (ids of the tests the rater
+    consented to) are optional claims that spare authenticated calls a lookup.
+    """
     payload = {
         'username': username,
         # 'language': language,
         # 'speakers': speakers,
         'exp': datetime.utcnow() + timedelta(hours=24)
     }
+    if rater_id is not None:
+        payload['rater_id'] = rater_id
+    if consents is not None:
+        payload['consents'] = sorted(consents)
     return jwt.encode(payload, app.config['JWT_SECRET_KEY'], algorithm='HS256')
 
 
@@ -100,7 +366,7 @@ def login():
     password = data.get('password')
     user = Rater.query.filter_by(name=username).first()
     if user and user.password == password:
-        auth_token = generate_token(username)
+        auth_token = generate_token(username, user.id)
         return jsonify({'token': auth_token}), 200
     else:
         return jsonify({'message': 'Invalid username or password'}), 401
@@ -130,7 +396,6 @@ def signup():
 
     # Create a new Rater instance (new user)
     new_user = Rater(
-        id=db.session.query(db.func.max(Rater.id)).scalar() + 1 if db.session.query(db.func.max(Rater.id)).scalar() is not None else 1,
         name=name.strip(),
         age=age,
         gender=gender.strip(),
@@ -148,7 +413,7 @@ def signup():
                         'error': e}), 500
 
     # Generate an authentication token for the new user
-    auth_token = generate_token(name)
+    auth_token = generate_token(new_user.name, new_user.id)
 
     # Return the token in the response
     return jsonify({'token': auth_token}), 201  # 201 status code for successful resource creation
@@ -159,32 +424,34 @@ def signup():
 @app.route('/api/test/<int:test_id>', methods=['GET'])
 @token_required
 def get_test(current_user, test_id):
-    token = request.headers.get('Authorization').split()[1]
-    required = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-    rater_id = Rater.query.filter_by(name=required["username"]).first_or_404().id
-    test = Test.query.filter_by(id=test_id).first_or_404()
-
-    # Get the page numbers that the rater has already done and shuffle the remaining samples
-    page_nos_done = Rating.query.filter_by(rater_id=rater_id, test_id=test_id).with_entities(Rating.page_no_progress).all()
-    page_nos_done = [page_no[0] for page_no in page_nos_done]
-    page_nos_done = list(map(int, page_nos_done))
-    samples = [sample for sample in test.json_entry if sample['id'] not in page_nos_done]
-    random.shuffle(samples)
-    samples_done = [sample for sample in test.json_entry if sample['id'] in page_nos_done]
-    samples_done.extend(samples)
-    required = samples_done
+    rater_id = current_rater_id() or abort(404)
+    test = find_test(test_id) or abort(404)
 
-    try:
-        page_no = len(page_nos_done)
-    except:
-        page_no = 0
+    return jsonify({
+        'test_id': test['id'],
+        'test_type': test['test_type'],
+        'description': test['description'],
+        **serve_samples(rater_id, test['id'], request.args.get('limit', type=int))
+    })
 
+
+@app.route('/api/test/<int:test_id>/items', methods=['GET'])
+@token_required
+def get_test_items(current_user, test_id):
+    """
+    Next page of samples for the rater, for clients that fetch ahead lazily.
+    Query Parameters:
+    - start: position to continue from, the "next" value of the previous page
+    - limit: number of samples, defaults to 10
+    """
+    rater_id = current_rater_id() or abort(404)
+    if find_test(test_id) is None:
+        return jsonify({'message': 'Test not found'}), 404
     return jsonify({
-        'test_id': test.id,
-        'test_type': test.test_type,
-        'description': test.description,
-        'json_entry': required,
-        'page_no': page_no
+        'test_id': test_id,
+        **serve_samples(rater_id, test_id,
+                        request.args.get('limit', 10, type=int),
+                        request.args.get('start', 0, type=int))
     })
 
 
@@ -192,42 +459,92 @@ def get_test(current_user, test_id):
 @token_required
 def create_rating(current_user):
     try:
-        token = request.headers.get('Authorization').split()[1]
-        required = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-        rater = Rater.query.filter_by(name=required["username"]).first_or_404()
+        rater = find_rater_by_name(current_user) or abort(404)
         data = request.get_json()
 
         if 'results_json' not in data or not isinstance(data['results_json'], dict):
             return jsonify({'message': 'Invalid results_json format'}), 400
+        if find_test(data['test_id']) is None:
+            return jsonify({'message': 'Test not found'}), 404
 
         data['results_json']['test_id'] = data['test_id']
-        data['results_json']['rater_email'] = rater.email
+        data['results_json']['rater_email'] = rater['email']
         data['results_json']['time'] = datetime.now().isoformat()
         data['results_json']['time_taken'] = data['time_taken_to_submit'] / 1000
         data['results_json']['data_id'] = data.get('pageNo_progress')
 
-        rating = Rating(
-            id=db.session.query(db.func.max(Rating.id)).scalar() + 1 if db.session.query(db.func.max(Rating.id)).scalar() is not None else 1,
-            rater_id=rater.id,
+        return store_rating(
+            rater_id=rater['id'],
             test_id=data['test_id'],
             results_json=data['results_json'],
             time_taken_to_submit=data['time_taken_to_submit'],
             page_no_progress=data.get('pageNo_progress')
         )
-        db.session.add(rating)
-        db.session.commit()
-        return jsonify({'message': 'Rating created successfully'}), 201
     except Exception as e:
         app.logger.error('Error creating rating: %s', e)
         return jsonify({'message': 'Internal Server Error'}), 500
 
 
+@app.route('/api/ratings/batch', methods=['POST'])
+@token_required
+def create_rating_batch(current_user):
+    """
+    Submit several pages of one test at once, e.g. a backlog kept while offline.
+    Request Body:
+    {
+        "test_id": 123,
+        "ratings": [
+            {"pageNo_progress": 4, "results_json": {...}, "time_taken_to_submit": 5300,
+             "idempotency_key": "client-generated, unique per page result"},
+            ...
+        ]
+    }
+    Every item gets a status: created, duplicate (its idempotency_key was already stored),
+    accepted (journaled by write-behind ingestion) or invalid.
+    """
+    data = request.get_json()
+    test_id = data.get('test_id')
+    ratings = data.get('ratings')
+    if not test_id or not isinstance(ratings, list) or not ratings:
+        return jsonify({'message': 'Missing required fields'}), 400
+    if len(ratings) > MAX_RATING_BATCH:
+        return jsonify({'message': f'At most {MAX_RATING_BATCH} ratings per batch'}), 400
+    rater = find_rater_by_name(current_user)
+    if rater is None or find_test(test_id) is None:
+        return jsonify({'message': 'Rater or Test not found'}), 404
+
+    submitted_at = datetime.now().isoformat()
+
+    def make_fields(item):
+        results_json = dict(item['results_json'],
+                            test_id=test_id,
+                            rater_email=rater['email'],
+                            time=submitted_at,
+                            time_taken=item['time_taken_to_submit'] / 1000,
+                            data_id=item.get('pageNo_progress'))
+        return {
+            'rater_id': rater['id'],
+            'test_id': test_id,
+            'results_json': results_json,
+            'time_taken_to_submit': item['time_taken_to_submit'],
+            'page_no_progress': item.get('pageNo_progress')
+        }
+
+    try:
+        return batch_response(store_rating_batch(ratings, make_fields))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('Error creating rating batch: %s', e)
+        return jsonify({'message': 'Internal Server Error'}), 500
+
+
 @app.route('/api/ratings/<int:rating_id>', methods=['PUT'])
 def update_rating(rating_id):
     data = request.get_json()
     rating = Rating.query.get_or_404(rating_id)
     if 'results_json' in data:
         rating.results_json = data['results_json']
+        replace_scores(rating)
     if 'time_taken_to_submit' in data:
         rating.time_taken_to_submit = data['time_taken_to_submit']
     if 'page_no_progress' in data:
@@ -270,7 +587,6 @@ def create_study():
         return jsonify({'message': 'Study already exists'}), 400
 
     new_study = Study(
-        id = db.session.query(db.func.max(Study.id)).scalar() + 1 if db.session.query(db.func.max(Study.id)).scalar() is not None else 1,
         study_id=study_id,
         test_id=test_id,
         completion_url=completion_url
@@ -350,90 +666,70 @@ def get_test_for_prolific_user():
     if not session_id:
         return jsonify({'message': 'Missing required parameter: SESSION_ID'}), 400
     
-    # Step 1: Check if a rater exists for the Prolific ID, create one if not
-    rater = Rater.query.filter_by(email=prolific_pid).first()
+    # Step 1: The study and its test
+    study = find_study(study_id)
+    if not study:
+        return jsonify({'message': 'Study not found'}), 404
+
+    # Step 2: The rater for the Prolific ID, with their consent and shuffle seed for the test, in one read
+    def find_rater():
+        consent_given = db.session.query(Consent.id).filter(
+            Consent.rater_id == Rater.id, Consent.test_id == study['test_id']
+        ).exists()
+        return db.session.query(Rater.id, Rater.name, Assignment.seed, consent_given.label('consent')) \
+            .outerjoin(Assignment, db.and_(Assignment.rater_id == Rater.id,
+                                           Assignment.test_id == study['test_id'])) \
+            .filter(Rater.email == prolific_pid).first()
+
+    rater = find_rater()
+    page_ids = None
     if not rater:
-        # Generate a random password
+        # New participant. Concurrent arrivals with the same Prolific ID are resolved by the
+        # unique email instead of failing, and everything is committed once below.
         random_password = generate_password_hash(
             f"{prolific_pid}_{study_id}",
             # method='pbkdf2:sha256'
         )
-        rater = Rater(
-            id=db.session.query(db.func.max(Rater.id)).scalar() + 1 if db.session.query(db.func.max(Rater.id)).scalar() is not None else 1,
-            name=f"Prolific_{prolific_pid}",
-            age=0,  # Default age as it's not collected
-            gender="Unknown",  # Default gender
-            email=prolific_pid,  # Using Prolific PID as email
-            password=random_password
-        )
-
-        db.session.add(rater)
-        db.session.commit()
-
-    
-    # Step 2: Get the test ID associated with the study
-    study = Study.query.filter_by(study_id=study_id).first()
-    if not study:
-        return jsonify({'message': 'Study not found'}), 404
-
-    test = Test.query.get(study.test_id)
-    if not test:
-        return jsonify({'message': 'Test not found'}), 404
-
-    # Step 3: Check if a session exists for the Prolific user, create one if not
-    session = Session.query.filter_by(session_id=session_id).first()
-    if not session:
-        session = Session(
+        created = db.session.execute(
+            upsert_into(Rater).values(
+                name=f"Prolific_{prolific_pid}",
+                age=0,  # Default age as it's not collected
+                gender="Unknown",  # Default gender
+                email=prolific_pid,  # Using Prolific PID as email
+                password=random_password
+            ).on_conflict_do_nothing(index_elements=['email']).returning(Rater.id)
+        ).scalar()
+        rater = find_rater()
+        if created is not None:
+            page_ids = set()  # A brand new rater has no ratings yet
+    seed = rater.seed if rater.seed is not None else get_assignment_seed(rater.id, study['test_id'], commit=False)
+
+    # Step 3: Record the session
+    db.session.execute(
+        upsert_into(Session).values(
             session_id=session_id,
-            study_id=study.id,
+            study_id=study['id'],
             prolific_pid=prolific_pid
-        )
-        
-        db.session.add(session)
-        db.session.commit()
-
-
-
-    # Step 4: Query the Rating table to get page numbers already completed
-    ratings = Rating.query.filter_by(
-        rater_id=rater.id, test_id=test.id
-    ).with_entities(Rating.page_no_progress).all()
-    completed_pages = {int(rating.page_no_progress)
-                       for rating in ratings if rating.page_no_progress}
-
-    # Get all pages in the test
-    all_pages = [entry['id'] for entry in test.json_entry]
-
-    # Filter out completed pages and shuffle the remaining ones
-    remaining_pages = [page for page in all_pages if page not in completed_pages]
-    random.shuffle(remaining_pages)
-
-    # Create a dictionary for quick lookup of entries by ID
-    entry_dict = {entry['id']: entry for entry in test.json_entry}
+        ).on_conflict_do_nothing(index_elements=['session_id'])
+    )
+    db.session.commit()
 
-    # Combine completed pages (preserving their order) with shuffled remaining pages
-    full_test_sequence = [entry_dict[page_id] for page_id in completed_pages] + \
-                         [entry_dict[page_id] for page_id in remaining_pages]
+    # Step 4: Completed pages first (in test order), followed by the remaining ones in the rater's order
+    samples = serve_samples(rater.id, study['test_id'], request.args.get('limit', type=int),
+                            seed=seed, page_ids=page_ids)
 
-    auth_token = generate_token(rater.name)
+    consent_status = bool(rater.consent)
+    auth_token = generate_token(rater.name, rater.id, [study['test_id']] if consent_status else [])
 
-    # Step 5: Check if the user has given consent for the test
-    consent = Consent.query.filter_by(rater_id=rater.id, test_id=test.id).first()
-    if consent:
-        consent_status = True
-    else:
-        consent_status = False
+    remaining_time = get_remaining_time(rater.id, study['id'])
 
-    remaining_time = get_remaining_time(rater.id, study.id)
-
-    # Step 6: Serve the test
+    # Step 5: Serve the test
     return jsonify({
-        'test_id': test.id,
-        'test_type': test.test_type,
-        'description': test.description,
-        'json_entry': full_test_sequence,
-        'page_no': len(completed_pages),
-        'completion_url': study.completion_url,
+        'test_id': study['test_id'],
+        'test_type': study['test_type'],
+        'description': study['description'],
+        **samples,
+        'completion_url': study['completion_url'],
         'token': auth_token,
         'consent': consent_status,
         'rejection_url': "https://app.prolific.com/submissions/complete?cc=C8S11MVG",
@@ -442,21 +738,29 @@ def get_test_for_prolific_user():
 
 # add a new point to give consent
 @app.route('/api/prolific/consent/<int:test_id>', methods=['GET'])
-def give_consent(test_id):
-    token = request.headers.get('Authorization').split()[1]
-    required = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-    rater = Rater.query.filter_by(name=required["username"]).first_or_404()
-    test = Test.query.filter_by(id=test_id).first_or_404()
-    if rater is None or test is None:
+@token_required
+def give_consent(current_user, test_id):
+    """
+    Record the rater's consent for a test. The response carries a refreshed token
+    whose consents claim includes the test.
+    """
+    rater_id = current_rater_id()
+    test = find_test(test_id)
+    if rater_id is None or test is None:
         return jsonify({'message': 'Rater or Test not found'}), 404
-    consent = Consent(
-        rater_id=rater.id,
-        test_id=test_id
-    )
-    db.session.add(consent)
-    db.session.commit()
 
-    return jsonify({'message': 'Consent given successfully'}), 201
+    consents = set(g.claims.get('consents', []))
+    if test_id not in consents:
+        consent = Consent(
+            rater_id=rater_id,
+            test_id=test_id
+        )
+        db.session.add(consent)
+        db.session.commit()
+        consents.add(test_id)
+
+    return jsonify({'message': 'Consent given successfully',
+                    'token': generate_token(current_user, rater_id, consents)}), 201
 
 @app.route('/api/prolific/rating', methods=['POST'])
 def save_rating():
@@ -479,44 +783,99 @@ def save_rating():
     if not session_id or not test_id or not results_json or not time_taken_to_submit:
         return jsonify({'message': 'Missing required fields'}), 400
 
-    session = Session.query.filter_by(session_id=session_id).first()
+    session = find_session(session_id)
     if not session:
         return jsonify({'message': 'Session not found'}), 404
 
-    rater = Rater.query.filter_by(email=session.prolific_pid).first()
+    rater = find_rater_by_email(session['prolific_pid'])
 
     # Append additional fields to results_json
     if not isinstance(results_json, dict):
         return jsonify({'message': 'Invalid results_json format'}), 400
+    if find_test(test_id) is None:
+        return jsonify({'message': 'Test not found'}), 404
 
     results_json.update({
         'session_id': session_id,
-        'prolific_id': session.prolific_pid,
-        'study_id': session.study_id,
+        'prolific_id': session['prolific_pid'],
+        'study_id': session['study_id'],
         'test_id': test_id,
         'time': datetime.now().isoformat(),  # Current timestamp
         'time_taken': time_taken_to_submit / 1000,  # Convert to seconds
         'data_id': data.get('pageNo_progress')  # Optional field
     })
 
-    new_rating = Rating(
-        id = db.session.query(db.func.max(Rating.id)).scalar() + 1 if db.session.query(db.func.max(Rating.id)).scalar() is not None else 1,
-        rater_id=rater.id,  # Prolific users are anonymous, no Rater ID
-        test_id=test_id,
-        results_json=results_json,
-        time_taken_to_submit=time_taken_to_submit,
-        page_no_progress=data.get('pageNo_progress')
-    )
-
     try:
-        db.session.add(new_rating)
-        db.session.commit()
-        return jsonify({'message': 'Rating created successfully'}), 201
+        return store_rating(
+            rater_id=rater['id'],  # Prolific users are anonymous, no Rater ID
+            test_id=test_id,
+            results_json=results_json,
+            time_taken_to_submit=time_taken_to_submit,
+            page_no_progress=data.get('pageNo_progress')
+        )
     except Exception as e:
         db.session.rollback()
         app.logger.error('Error saving rating: %s', e)
         return jsonify({'message': 'Error saving rating'}), 500
 
+@app.route('/api/prolific/rating/batch', methods=['POST'])
+def save_rating_batch():
+    """
+    Save several pages of a Prolific session at once, see create_rating_batch for the statuses.
+    Request Body:
+    {
+        "session_id": "session_id",
+        "test_id": 123,
+        "ratings": [
+            {"pageNo_progress": 4, "results_json": {...}, "time_taken_to_submit": 300,
+             "idempotency_key": "client-generated, unique per page result"},
+            ...
+        ]
+    }
+    """
+    data = request.get_json()
+    session_id = data.get('session_id')
+    test_id = data.get('test_id')
+    ratings = data.get('ratings')
+
+    if not session_id or not test_id or not isinstance(ratings, list) or not ratings:
+        return jsonify({'message': 'Missing required fields'}), 400
+    if len(ratings) > MAX_RATING_BATCH:
+        return jsonify({'message': f'At most {MAX_RATING_BATCH} ratings per batch'}), 400
+
+    session = find_session(session_id)
+    if not session:
+        return jsonify({'message': 'Session not found'}), 404
+    rater = find_rater_by_email(session['prolific_pid'])
+    if rater is None or find_test(test_id) is None:
+        return jsonify({'message': 'Rater or Test not found'}), 404
+
+    submitted_at = datetime.now().isoformat()
+
+    def make_fields(item):
+        results_json = dict(item['results_json'],
+                            session_id=session_id,
+                            prolific_id=session['prolific_pid'],
+                            study_id=session['study_id'],
+                            test_id=test_id,
+                            time=submitted_at,
+                            time_taken=item['time_taken_to_submit'] / 1000,
+                            data_id=item.get('pageNo_progress'))
+        return {
+            'rater_id': rater['id'],
+            'test_id': test_id,
+            'results_json': results_json,
+            'time_taken_to_submit': item['time_taken_to_submit'],
+            'page_no_progress': item.get('pageNo_progress')
+        }
+
+    try:
+        return batch_response(store_rating_batch(ratings, make_fields))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('Error saving rating batch: %s', e)
+        return jsonify({'message': 'Error saving ratings'}), 500
+
 # =======================
 # CRUD Basic 
 # =======================
@@ -531,11 +890,21 @@ def create_test():
         "json_entry": [
             {"id": 1, "question": "What is 2+2?", "options": ["3", "4", "5"], "answer": "4"},
             {"id": 2, "question": "What is the capital of France?", "options": ["Paris", "London", "Berlin"], "answer": "Paris"}
-        ]
+        ],
+        "localize_audio": true
     }
+    With AUDIO_ASSET_DIR set, the audio the items reference is copied into the asset store,
+    its waveform peaks are computed, and the items point at both, unless localize_audio is false.
+    Only public http(s) URLs are fetched, and only with the admin token, since the server
+    downloads them; local files can be stored with load_config.py. Without AUDIO_ASSET_DIR
+    (or with localize_audio false) nothing is fetched and no token is needed, as before.
     """
     try:
         data = request.get_json()
+        localize = asset_store is not None and data.get('localize_audio', True)
+        auth = (request.headers.get('Authorization') or '').split()
+        if localize and (len(auth) != 2 or auth[1] != "tts_ai4b"):
+            return jsonify({'message': 'Unauthorized: fetching test audio requires the admin token'}), 401
 
         # Extract the required fields
         test_type = data.get('test_type')
@@ -549,17 +918,29 @@ def create_test():
         if not isinstance(json_entry, list):
             return jsonify({'message': 'Invalid json_entry format. Expected a list of JSON objects.'}), 400
 
+        if localize:
+            problems = localize_items(json_entry, asset_store)
+            if problems:
+                for problem in problems:
+                    app.logger.warning('Could not store test audio: %s', problem)
+                return jsonify({'message': f"Could not store the audio of {len(problems)} source(s) of the test"}), 400
+            add_peaks(json_entry, asset_store)  # Clips that cannot be decoded are logged and drawn by the client
+
         # Create a new Test instance
         new_test = Test(
-            id=db.session.query(db.func.max(Test.id)).scalar() + 1 if db.session.query(db.func.max(Test.id)).scalar() is not None else 1,
             test_type=test_type,
             description=description,
-            json_entry=json_entry
+            json_entry=json_entry,
+            item_count=len(json_entry)
         )
 
         # Add the test to the database
         db.session.add(new_test)
+        if app.config['NORMALIZED_ITEMS']:
+            db.session.flush()
+            store_test_items(new_test.id, json_entry)
         db.session.commit()
+        cache_sample_index(new_test.id, json_entry)
 
         return jsonify({'message': 'Test created successfully', 'test_id': new_test.id}), 201
 
@@ -569,6 +950,53 @@ def create_test():
         return jsonify({'message': 'Error creating test'}), 500
 
 
+@app.route('/api/static/audio/<name>', methods=['GET'])
+def serve_audio_asset(name):
+    """
+    A stored audio file. Supports Range requests (seeking, partial downloads) and
+    conditional requests on its strong ETag, the content hash; marked immutable.
+    """
+    if asset_store is None or not ASSET_NAME.match(name):
+        abort(404)
+    path = asset_store.path(name)
+    if not os.path.isfile(path):
+        abort(404)
+    response = send_file(path, mimetype=asset_store.mimetype(name), conditional=True,
+                         etag=name.split('.')[0], max_age=ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def export_ratings(test_id=None):
+    """
+    Stream ratings instead of building the whole result set in memory.
+    Query Parameters (all optional):
+    - format: "json" (a JSON array, the default) or "ndjson" (one rating per line)
+    - after_id: keyset pagination, only ratings with a larger id; pass the last id of a page to get the next one
+    - limit: maximum number of ratings to return
+    - since: ISO 8601 timestamp, only ratings submitted at or after it
+    """
+    export_format = request.args.get('format', 'json')
+    if export_format not in ('json', 'ndjson'):
+        return jsonify({'message': 'Invalid format. Expected json or ndjson.'}), 400
+
+    since = request.args.get('since')
+    if since:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return jsonify({'message': 'Invalid since timestamp'}), 400
+
+    ratings = iter_ratings(test_id=test_id,
+                           after_id=request.args.get('after_id', type=int),
+                           since=since or None,
+                           limit=request.args.get('limit', type=int))
+    if export_format == 'ndjson':
+        return Response(stream_with_context(iter_ndjson(ratings)), mimetype='application/x-ndjson')
+    return Response(stream_with_context(iter_json_array(ratings)), mimetype='application/json')
+
+
 @app.route('/api/results', methods=['GET'])
 def get_database():
     """
@@ -578,18 +1006,7 @@ def get_database():
     token = request.headers.get('Authorization').split()[1]
     if token != "tts_ai4b":
         return jsonify({'message': 'Unauthorized'}), 401
-    ratings = Rating.query.all()
-    results = []
-    for rating in ratings:
-        results.append({
-            'id': rating.id,
-            'rater_id': rating.rater_id,
-            'test_id': rating.test_id,
-            'results_json': rating.results_json,
-            'time_taken_to_submit': rating.time_taken_to_submit,
-            'page_no_progress': rating.page_no_progress
-        })
-    return jsonify(results)
+    return export_ratings()
 
 @app.route('/api/results/<int:test_id>', methods=['GET'])
 def get_database_test(test_id):
@@ -597,85 +1014,197 @@ def get_database_test(test_id):
     token = request.headers.get('Authorization').split()[1]
     if token != "tts_ai4b":
         return jsonify({'message': 'Unauthorized'}), 401
-    rating = Rating.query.filter_by(test_id=test_id).all()
-    results = []
-    for rate in rating:
-        results.append({
-            'id': rate.id,
-            'rater_id': rate.rater_id,
-            'test_id': rate.test_id,
-            'results_json': rate.results_json,
-            'time_taken_to_submit': rate.time_taken_to_submit,
-            'page_no_progress': rate.page_no_progress
-        })
-    return jsonify(results)
+    return export_ratings(test_id)
 
 
-@app.route('/api/verify_test/<int:test_id>', methods=['GET'])
-def verify_test(test_id):
+@app.route('/api/results/<int:test_id>/export', methods=['GET'])
+def export_test_results(test_id):
+    """
+    Ratings of one test flattened to one row per rated audio, with typed columns for its test type.
+    Query Parameters:
+    - format: "csv" (gzip-compressed, the default) or "parquet"
+    """
     token = request.headers.get('Authorization').split()[1]
-    required = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-    
-    rater = Rater.query.filter_by(name=required["username"]).first_or_404()
-    if not rater:
-        return jsonify({'message': 'Rater not found'}), 404
-    
-    test = Test.query.filter_by(id=test_id).first_or_404()
+    if token != "tts_ai4b":
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'message': 'Invalid format. Expected csv or parquet.'}), 400
+    if export_format == 'parquet' and not parquet_available():
+        return jsonify({'message': 'Parquet export requires pyarrow to be installed'}), 400
+
+    test = find_test(test_id)
     if not test:
         return jsonify({'message': 'Test not found'}), 404
 
-    ratings = Rating.query.filter_by(
-                rater_id=rater.id, test_id=test.id
-            ).with_entities(Rating.page_no_progress).all()
-    completed_pages = {int(rating.page_no_progress)
-                       for rating in ratings if rating.page_no_progress}
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(stream_with_context(iter_export(test_id, test['test_type'], export_format)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=ratings_{test_id}.{extension}'})
+
+
+@app.route('/api/results/<int:test_id>/analytics', methods=['GET'])
+def get_test_analytics(test_id):
+    """
+    Summary statistics of a test by test type, with bootstrap confidence intervals over raters:
+    mean score per system (MUSHRA, plus attributes for MUSHRA granular), CMOS and preference shares
+    per system, confusion matrix and reason frequencies (HFR, HFR granular).
+    Query Parameters (all optional):
+    - resamples: bootstrap resamples, defaults to 1000 (at most 10000)
+    - confidence: confidence level, defaults to 0.95
+    - seed: seed of the resampling, for reproducible intervals
+    """
+    token = request.headers.get('Authorization').split()[1]
+    if token != "tts_ai4b":
+        return jsonify({'message': 'Unauthorized'}), 401
 
-    # Get all pages in the test
-    all_pages = [entry['id'] for entry in test.json_entry]
+    test = find_test(test_id)
+    if not test:
+        return jsonify({'message': 'Test not found'}), 404
+
+    resamples = min(max(request.args.get('resamples', BOOTSTRAP_RESAMPLES, type=int), 0), 10000)
+    confidence = request.args.get('confidence', CONFIDENCE, type=float)
+    if not 0 < confidence < 1:
+        return jsonify({'message': 'confidence must be between 0 and 1'}), 400
+    try:
+        return jsonify(analyze_test(test_id, test['test_type'], resamples, confidence,
+                                    request.args.get('seed', 0, type=int)))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/verify_test/<int:test_id>', methods=['GET'])
+@token_required
+def verify_test(current_user, test_id):
+    rater_id = current_rater_id()
+    if not rater_id:
+        return jsonify({'message': 'Rater not found'}), 404
+    
+    pending = journaled_pages(rater_id, test_id)
+    progress = rater_progress(rater_id, test_id, pending)
+    if progress is None:
+        return jsonify({'message': 'Test not found'}), 404
+    completed, total = progress
+    if total is not None and completed < total:
+        return jsonify({'message': 'Test not completed'}), 404
 
-    # Filter out completed pages and shuffle the remaining ones
-    remaining_pages = [page for page in all_pages if page not in completed_pages]
+    # Confirm against the test's items, once per rater: the counter alone is not proof
+    # of completion (e.g. after items were replaced), and the item count may be missing
+    if uses_normalized_items(test_id):
+        remaining = remaining_count(test_id, rater_id, pending)
+    else:
+        index = get_sample_index(test_id)
+        if index is None:
+            return jsonify({'message': 'Test not found'}), 404
+        page_ids = completed_page_ids(rater_id, test_id) | {int(page) for page in pending if page.isdigit()}
+        remaining = index.remaining_count(page_ids)
 
-    if len(remaining_pages) == 0:
+    if remaining == 0:
         return jsonify({'message': 'Test completed'}), 200
     else:
         return jsonify({'message': 'Test not completed'}), 404
     
 @app.route('/api/tracking', methods=['GET'])
-def get_tracking():
-    token = request.headers.get('Authorization').split()[1]
-    required = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-
-    if not token or required["username"] != "admin":
+@token_required
+def get_tracking(current_user):
+    """
+    Progress of every (rater, test) pair that has at least one rating, read from the progress table.
+    Query Parameters (all optional):
+    - page, per_page: pagination, defaults to page 1 of 20 rows
+    - test_id, test_type: restrict to one test or one test type; with test_id the response
+      also carries the test's totals (raters, raters who completed it, pages)
+    - q: case-insensitive search over email, test id, test type and description
+    """
+    if current_user != "admin":
         return jsonify({'message': 'Unauthorized'}), 401
     try:
-        raters = Rater.query.all()
-        tracking_data = []
-        for rater in raters:
-            if rater.gender.lower() == "unknown":
-                continue
-            # Get all ratings for the rater grouped by test.
-            ratings = Rating.query.filter_by(rater_id=rater.id).all()
-            test_groups = {}
-            for rating in ratings:
-                test_id = rating.test_id
-                test_groups.setdefault(test_id, 0)
-                test_groups[test_id] += 1
-
-            for test_id, completed in test_groups.items():
-                test = Test.query.get(test_id)
-                total = len(test.json_entry) if test and test.json_entry else 0
-                tracking_data.append({
-                    'email': rater.email,
-                    'test_id': test.id,
-                    'test_type': test.test_type,
-                    'test_desc': test.description,
-                    'completed_pages': completed,
-                    'total_pages': total
-                })
-
-        tracking_data.sort(key=lambda x: x['test_id'], reverse=True)
-        return jsonify(tracking_data)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 500)
+        test_id = request.args.get('test_id', type=int)
+        test_type = request.args.get('test_type')
+        search = request.args.get('q', '').strip()
+
+        total_pages = db.func.coalesce(Test.item_count, db.func.json_array_length(Test.json_entry), 0)
+        query = db.session.query(
+            Rater.email, Test.id, Test.test_type, Test.description,
+            Progress.completed, total_pages, Progress.last_page, Progress.time_of_completion,
+            db.func.count().over()
+        ).join(Progress, Progress.rater_id == Rater.id) \
+         .join(Test, Test.id == Progress.test_id) \
+         .filter(db.func.lower(Rater.gender) != 'unknown')
+        if test_id is not None:
+            query = query.filter(Progress.test_id == test_id)
+        if test_type:
+            query = query.filter(Test.test_type == test_type)
+        if search:
+            pattern = f"%{search}%"
+            # Substring match on the test id too, as the tracking page's own filter did
+            query = query.filter(db.or_(Rater.email.ilike(pattern), db.cast(Test.id, db.String).ilike(pattern),
+                                        Test.test_type.ilike(pattern), Test.description.ilike(pattern)))
+
+        rows = query.order_by(Test.id.desc(), Rater.email) \
+                    .limit(per_page).offset((page - 1) * per_page).all()
+        if rows:
+            total = rows[0][-1]
+        else:
+            total = query.order_by(None).count() if page > 1 else 0
+
+        tracking_data = [{
+            'email': email,
+            'test_id': test_id,
+            'test_type': test_type,
+            'test_desc': description,
+            'completed_pages': completed,
+            'total_pages': total_pages,
+            'last_page': last_page,
+            'completed_at': completed_at.isoformat() if completed_at else None
+        } for email, test_id, test_type, description, completed, total_pages, last_page, completed_at, _ in rows]
+
+        response = {
+            'items': tracking_data,
+            'total': total,
+            'page': page,
+            'per_page': per_page
+        }
+        if test_id is not None:
+            raters, completed_raters = db.session.query(
+                db.func.count(Progress.id), db.func.count(Progress.time_of_completion)
+            ).filter(Progress.test_id == test_id).one()
+            response['test_totals'] = {
+                'raters': raters,
+                'completed_raters': completed_raters,
+                'total_pages': db.session.query(total_pages).filter(Test.id == test_id).scalar()
+            }
+        return jsonify(response)
     except Exception as e:
         app.logger.error(f"Error in tracking endpoint: {e}")
-        return jsonify({'error': 'Failed to fetch tracking data.'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to fetch tracking data.'}), 500
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Request, database and cache metrics in the Prometheus text format.
+    With METRICS_DIR set, the counters of every worker process are added up.
+    """
+    token = request.headers.get('Authorization').split()[1]
+    if token != "tts_ai4b":
+        return jsonify({'message': 'Unauthorized'}), 401
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """
+    Hit and miss counters of the lookup, verified token and sample index caches.
+    """
+    token = request.headers.get('Authorization').split()[1]
+    if token != "tts_ai4b":
+        return jsonify({'message': 'Unauthorized'}), 401
+    return jsonify({
+        'lookups': cache.stats(),
+        'verified_tokens': verified_tokens.stats(),
+        'rating_ingest': rating_ingestor.stats() if rating_ingestor is not None else None,
+        'sample_indexes': sample_index_stats()
+    })
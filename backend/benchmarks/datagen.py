@@ -0,0 +1,161 @@
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from application.database import db
+from application.models import (Assignment, Consent, Progress, Rater, Rating, RatingScore, Session,
+                                Study, Test, TestItem, TestType)
+from application.export import HFR_GRANULAR_REASONS, MUSHRA_GRANULAR_ATTRIBUTES
+from application.items import store_test_items
+from application.progress import rebuild_progress
+from application.scores import score_rows
+
+# Rows per multi-row INSERT while generating ratings
+GENERATE_BATCH_SIZE = 5000
+
+SYSTEMS = ('system_a', 'system_b', 'system_c', 'anchor')
+
+
+def description(tag):
+    return f"benchmark:{tag}"
+
+
+def rater_email(tag, n):
+    return f"bench-{tag}-{n}"
+
+
+def make_items(test_type, count):
+    """count test items in the shape of config/examples for the test type."""
+    items = []
+    for n in range(1, count + 1):
+        if test_type in (TestType.HFR, TestType.MVH_GRANULAR):
+            items.append({'id': n, 'audio_path': f"https://bench.invalid/{test_type.value}/{n}.wav",
+                          'label': 'Human' if n % 2 else 'Machine'})
+        else:
+            systems = SYSTEMS[:2] if test_type == TestType.CMOS else SYSTEMS
+            items.append({'id': n, 'reference_audio': f"https://bench.invalid/{test_type.value}/{n}_ref.wav",
+                          'test_audios': [{'audio_path': f"https://bench.invalid/{test_type.value}/{n}_{system}.wav",
+                                           'audio_id': f"{n}_{system}", 'class': system}
+                                          for system in systems]})
+    return items
+
+
+def make_results(test_type, item, rng):
+    """A results_json as the frontend submits it for one item (see application.scores.rated_audios)."""
+    if test_type in (TestType.HFR, TestType.MVH_GRANULAR):
+        audio = {'url': item['audio_path'], 'system': item['label'],
+                 'label': rng.choice(('Human', 'Machine')), 'score': rng.randint(1, 5)}
+        if test_type == TestType.MVH_GRANULAR:
+            audio['attributes'] = {reason: rng.random() < 0.2 for reason in HFR_GRANULAR_REASONS}
+        return {'audios': [audio]}
+
+    if test_type == TestType.CMOS:
+        low, high = -3, 3
+    else:
+        low, high = 0, 100
+    audios = []
+    for audio in item['test_audios']:
+        rated = {'url': audio['audio_path'], 'system': audio['class'], 'score': rng.randint(low, high)}
+        if test_type == TestType.MUSHRA_GRANULAR:
+            rated['attributes'] = {attribute: rng.randint(0, 100) for attribute in MUSHRA_GRANULAR_ATTRIBUTES}
+        audios.append(rated)
+    results = {'audios': audios}
+    if test_type != TestType.CMOS:
+        results['reference'] = {'url': item['reference_audio'], 'system': 'reference', 'score': rng.randint(90, 100)}
+    return results
+
+
+def _insert_ratings(rows, test_type):
+    inserted = db.session.execute(
+        insert(Rating).returning(Rating.id, Rating.rater_id, Rating.test_id, Rating.results_json), rows
+    ).all()
+    scores = [row for rating in inserted for row in score_rows(rating, test_type.value)]
+    if scores:
+        db.session.execute(insert(RatingScore), scores)
+
+
+def generate(tag, raters=100, items=50, ratings_per_test=1000, test_types=None, normalized=False, seed=0,
+             log=print):
+    """
+    Insert a synthetic dataset: raters, one test (with a Prolific study) per test type and
+    up to ratings_per_test ratings of each, spread over the raters so that no rater rates a
+    page twice. Everything is tagged so remove() can delete it again.
+    Returns {test type value: {'test_id', 'study_id', 'items'}}.
+    """
+    rng = random.Random(seed)
+    test_types = test_types or list(TestType)
+    started = datetime.utcnow() - timedelta(days=7)
+
+    emails = [rater_email(tag, n) for n in range(raters)]
+    # Raters with gender "Unknown" (Prolific participants) are left out of /api/tracking
+    db.session.execute(insert(Rater), [{'name': email, 'age': rng.randint(18, 70),
+                                        'gender': rng.choice(('Male', 'Female', 'Other')),
+                                        'email': email, 'password': '-'} for email in emails])
+    rater_ids = [rater_id for rater_id, in db.session.query(Rater.id)
+                 .filter(Rater.email.like(f"bench-{tag}-%")).order_by(Rater.id)]
+
+    dataset = {}
+    for test_type in test_types:
+        test_items = make_items(test_type, items)
+        test = Test(test_type=test_type.value, description=description(tag), json_entry=test_items,
+                    item_count=len(test_items))
+        db.session.add(test)
+        db.session.flush()
+        if normalized:
+            store_test_items(test.id, test_items)
+        study_id = f"bench-{tag}-{test_type.value}"
+        db.session.add(Study(study_id=study_id, test_id=test.id, completion_url='https://bench.invalid/complete'))
+
+        # Raters work through the test in their own order, one after the other
+        count = min(ratings_per_test, raters * items)
+        rows = []
+        for n in range(count):
+            rater_id = rater_ids[n // items]
+            item = test_items[(n + n // items) % items]
+            rows.append({
+                'rater_id': rater_id,
+                'test_id': test.id,
+                'results_json': make_results(test_type, item, rng),
+                'time_taken_to_submit': rng.randint(2000, 30000),
+                'page_no_progress': str(item['id']),
+                'time_of_submission': started + timedelta(seconds=n),
+            })
+            if len(rows) == GENERATE_BATCH_SIZE:
+                _insert_ratings(rows, test_type)
+                rows = []
+        if rows:
+            _insert_ratings(rows, test_type)
+        rebuild_progress(test.id)
+        db.session.commit()
+        dataset[test_type.value] = {'test_id': test.id, 'study_id': study_id, 'items': len(test_items)}
+        log(f"{test_type.value}: test {test.id}, {len(test_items)} items, {count} ratings")
+    return dataset
+
+
+def find_dataset(tag):
+    """The dataset generate() created for tag, in the same shape."""
+    rows = db.session.query(Test.test_type, Test.id, Study.study_id, Test.item_count) \
+        .join(Study, Study.test_id == Test.id).filter(Test.description == description(tag))
+    return {test_type: {'test_id': test_id, 'study_id': study_id, 'items': items}
+            for test_type, test_id, study_id, items in rows}
+
+
+def remove(tag):
+    """Delete everything generate() and the benchmark journeys created for tag."""
+    test_ids = db.select(Test.id).where(Test.description == description(tag))
+    study_ids = db.select(Study.id).where(Study.test_id.in_(test_ids))
+    raters = db.session.query(Rater).filter(Rater.email.like(f"bench-{tag}-%"))
+    tests = db.session.query(Test).filter(Test.description == description(tag))
+    for model, condition in (
+        (RatingScore, RatingScore.test_id.in_(test_ids)),
+        (Progress, Progress.test_id.in_(test_ids)),
+        (Rating, Rating.test_id.in_(test_ids)),
+        (Consent, Consent.test_id.in_(test_ids)),
+        (Assignment, Assignment.test_id.in_(test_ids)),
+        (Session, Session.study_id.in_(study_ids)),
+        (Study, Study.id.in_(study_ids)),
+        (TestItem, TestItem.test_id.in_(test_ids)),
+    ):
+        db.session.query(model).filter(condition).delete(synchronize_session=False)
+    removed = tests.delete(synchronize_session=False), raters.delete(synchronize_session=False)
+    db.session.commit()
+    return removed
@@ -0,0 +1,103 @@
+import json
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class Recorder:
+    """Latency of every request of a phase, by step, from any number of threads."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(list)
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def record(self, step, seconds, error=None):
+        with self._lock:
+            if error is None:
+                self.latencies[step].append(seconds)
+            else:
+                self.errors[step].append(error)
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        steps = {}
+        for step in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(step, []))
+            errors = self.errors.get(step, [])
+            steps[step] = {'requests': len(values), 'errors': len(errors)}
+            if values:
+                steps[step].update({
+                    'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                    'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                    'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+                    'max_ms': round(values[-1] * 1000, 2),
+                    'mean_ms': round(sum(values) / len(values) * 1000, 2),
+                    'per_second': round(len(values) / wall, 1),
+                })
+            if errors:
+                steps[step]['first_error'] = errors[0]
+        requests = sum(len(values) for values in self.latencies.values())
+        return {'wall_s': round(wall, 3), 'requests': requests,
+                'requests_per_second': round(requests / wall, 1), 'steps': steps}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.strip() + ('-dirty' if dirty.strip() else '')
+
+
+def result_document(parameters, phases, **extra):
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'parameters': parameters,
+        **extra,
+        'phases': phases,
+    }
+
+
+def print_phase(name, summary):
+    print(f"\n{name}: {summary['requests']} requests in {summary['wall_s']}s "
+          f"({summary['requests_per_second']}/s)")
+    print(f"  {'step':32} {'n':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for step, stats in summary['steps'].items():
+        print(f"  {step:32} {stats['requests']:>7} {stats['errors']:>5} {stats.get('p50_ms', '-'):>9} "
+              f"{stats.get('p95_ms', '-'):>9} {stats.get('p99_ms', '-'):>9} {stats.get('per_second', '-'):>8}")
+
+
+def compare(baseline_path, current, tolerance=0.2, metric='p95_ms'):
+    """
+    Print the change of metric per step against a previous result file. Returns the steps
+    that got slower by more than tolerance (a fraction), or that fail where they did not.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nAgainst {baseline_path} (commit {baseline.get('commit')}), {metric}:")
+    regressions = []
+    for phase, summary in current['phases'].items():
+        previous_steps = baseline.get('phases', {}).get(phase, {}).get('steps', {})
+        for step, stats in summary['steps'].items():
+            previous = previous_steps.get(step)
+            if previous is None or metric not in previous or metric not in stats:
+                continue
+            change = stats[metric] / previous[metric] - 1 if previous[metric] else 0.0
+            slower = change > tolerance or (stats['errors'] and not previous['errors'])
+            print(f"  {phase + ' ' + step:44} {previous[metric]:>9} -> {stats[metric]:>9} "
+                  f"({change:+.0%}){'  REGRESSION' if slower else ''}")
+            if slower:
+                regressions.append(f"{phase} {step}")
+    return regressions
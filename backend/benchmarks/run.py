@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request as urlrequest
+from urllib.error import HTTPError, URLError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.report import Recorder, compare, print_phase, result_document
+
+# Benchmark suite for the API. Generates a tagged synthetic dataset, runs Prolific
+# participant journeys (study -> consent -> N ratings -> verify_test) concurrently,
+# then the admin endpoints, and reports p50/p95/p99 latency and throughput per step.
+#
+# Targets:
+#   --sqlite PATH    in-process app (Flask test client) on a fresh SQLite file, no server needed
+#   (default)        in-process app on the configured DATABASE_URI, e.g. a local Postgres
+#   --base-url URL   a running server over HTTP; the dataset is written to DATABASE_URI,
+#                    which must be the server's database
+#
+# Results can be written with --output and compared with a previous file with --baseline.
+
+ADMIN_TOKEN = 'tts_ai4b'
+OK = (200, 201, 202)
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, token=None, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        data = json.dumps(body).encode() if body is not None else None
+        req = urlrequest.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urlrequest.urlopen(req, timeout=300) as resp:
+                return resp.status, resp.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+
+class LocalClient:
+    """The app's test client, one per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, token=None, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        headers = {'Authorization': f"Bearer {token}"} if token else {}
+        response = client.open(path, method=method, headers=headers, json=body)
+        return response.status_code, response.get_data()
+
+
+def timed(recorder, step, client, method, path, token=None, body=None, expect=OK):
+    started = time.perf_counter()
+    try:
+        status, content = client.request(method, path, token, body)
+    except (URLError, OSError) as e:
+        recorder.record(step, time.perf_counter() - started, error=str(e))
+        return None, None
+    elapsed = time.perf_counter() - started
+    if status not in expect:
+        recorder.record(step, elapsed, error=f"HTTP {status}: {content[:200].decode(errors='replace')}")
+        return status, None
+    recorder.record(step, elapsed)
+    return status, content
+
+
+def journey(client, recorder, tag, test_type, test, pages, rng):
+    """One new Prolific participant: open the study, consent, rate pages, check completion."""
+    from benchmarks.datagen import make_results
+
+    pid = f"bench-{tag}-j{uuid.uuid4().hex[:16]}"
+    session_id = uuid.uuid4().hex
+    _, content = timed(recorder, 'prolific_study', client, 'GET',
+                       f"/api/prolific/study?PROLIFIC_PID={pid}&STUDY_ID={test['study_id']}"
+                       f"&SESSION_ID={session_id}&limit={pages}")
+    if content is None:
+        return
+    served = json.loads(content)
+    _, content = timed(recorder, 'consent', client, 'GET', f"/api/prolific/consent/{test['test_id']}",
+                       token=served['token'])
+    token = json.loads(content)['token'] if content is not None else served['token']
+
+    for item in (served.get('items') or served.get('json_entry') or [])[:pages]:
+        timed(recorder, 'prolific_rating', client, 'POST', '/api/prolific/rating', body={
+            'session_id': session_id,
+            'test_id': test['test_id'],
+            'results_json': make_results(test_type, item, rng),
+            'time_taken_to_submit': rng.randint(2000, 30000),
+            'pageNo_progress': item['id'],
+        })
+    # 404 is the "not completed yet" answer
+    timed(recorder, 'verify_test', client, 'GET', f"/api/verify_test/{test['test_id']}", token=token,
+          expect=(200, 404))
+
+
+def run_journeys(client, dataset, tag, participants, pages, concurrency, seed):
+    from application.models import TestType
+
+    recorder = Recorder()
+    tests = list(dataset.items())
+
+    def participant(n):
+        test_type, test = tests[n % len(tests)]
+        journey(client, recorder, tag, TestType(test_type), test, pages, random.Random(seed + n))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(participant, range(participants)))
+    summary = recorder.summary()
+    summary['journeys'] = participants
+    summary['journeys_per_second'] = round(participants / summary['wall_s'], 2)
+    return summary
+
+
+def run_admin(client, dataset, admin_jwt, rounds, concurrency):
+    recorder = Recorder()
+    calls = [('cache_stats', '/api/cache/stats', ADMIN_TOKEN), ('metrics', '/api/metrics', ADMIN_TOKEN),
+             ('tracking_search', '/api/tracking?q=bench&per_page=100', admin_jwt)]
+    for test in dataset.values():
+        test_id = test['test_id']
+        calls += [
+            ('tracking', f"/api/tracking?test_id={test_id}&per_page=100", admin_jwt),
+            ('results_ndjson', f"/api/results/{test_id}?format=ndjson&limit=5000", ADMIN_TOKEN),
+            ('results_export_csv', f"/api/results/{test_id}/export?format=csv", ADMIN_TOKEN),
+            ('results_analytics', f"/api/results/{test_id}/analytics?resamples=200", ADMIN_TOKEN),
+        ]
+
+    def call(args):
+        step, path, token = args
+        timed(recorder, step, client, 'GET', path, token=token)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, calls * rounds))
+    return recorder.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark participant journeys and admin endpoints')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--sqlite', help='Run in-process on a fresh SQLite database at this path')
+    target.add_argument('--base-url', help='Run against a server, e.g. http://localhost:4020')
+    parser.add_argument('--tag', default=f"run{os.getpid()}", help='Names the generated dataset')
+    parser.add_argument('--reuse', action='store_true', help='Use the dataset already generated for --tag')
+    parser.add_argument('--keep', action='store_true', help='Keep the dataset afterwards (for --reuse)')
+    parser.add_argument('--raters', type=int, default=200, help='Generated raters')
+    parser.add_argument('--items', type=int, default=100, help='Items per generated test')
+    parser.add_argument('--ratings', type=int, default=10000,
+                        help='Generated ratings per test type, at most raters x items')
+    parser.add_argument('--normalized', action='store_true', help='Also store the items in test_item')
+    parser.add_argument('--participants', type=int, default=100, help='Participant journeys to run')
+    parser.add_argument('--pages', type=int, default=10, help='Pages rated per journey')
+    parser.add_argument('--concurrency', type=int, default=16, help='Journeys (and admin calls) in parallel')
+    parser.add_argument('--admin-rounds', type=int, default=3, help='Times every admin call is repeated')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare p95 latencies with this earlier result file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown against the baseline reported as a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    if args.sqlite:
+        if os.path.exists(args.sqlite) and not args.reuse:
+            os.remove(args.sqlite)
+        os.environ['DATABASE_URI'] = f"sqlite:///{os.path.abspath(args.sqlite)}?timeout=30"
+        os.environ.setdefault('JWT_SECRET_KEY', 'benchmark')
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    if args.base_url:
+        import jwt
+        from datetime import datetime, timedelta
+        from load_config import create_loader_app
+        app = create_loader_app()
+        client = HttpClient(args.base_url)
+        admin_jwt = jwt.encode({'username': 'admin', 'exp': datetime.utcnow() + timedelta(hours=1)},
+                               os.getenv('JWT_SECRET_KEY'), algorithm='HS256')
+    else:
+        from main import app
+        from application.views import generate_token
+        # `from application.views import *` rebinds main.app to the current_app proxy, which
+        # the client threads cannot resolve
+        app = app._get_current_object()
+        client = LocalClient(app)
+        with app.app_context():
+            admin_jwt = generate_token('admin')
+
+    from application.database import db
+    from benchmarks.datagen import find_dataset, generate, remove
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        started = time.perf_counter()
+        if args.reuse:
+            dataset = find_dataset(args.tag)
+            if not dataset:
+                parser.error(f"No dataset tagged {args.tag}")
+        else:
+            dataset = generate(args.tag, raters=args.raters, items=args.items, ratings_per_test=args.ratings,
+                               normalized=args.normalized, seed=args.seed)
+        generate_seconds = time.perf_counter() - started
+
+    try:
+        phases = {
+            'journeys': run_journeys(client, dataset, args.tag, args.participants, args.pages,
+                                     args.concurrency, args.seed),
+            'admin': run_admin(client, dataset, admin_jwt, args.admin_rounds, args.concurrency),
+        }
+    finally:
+        if not args.keep:
+            with app.app_context():
+                remove(args.tag)
+
+    results = result_document(vars(args), phases, target='http' if args.base_url else 'in-process',
+                              dialect=dialect, dataset=dataset, generate_seconds=round(generate_seconds, 2))
+    for name, summary in phases.items():
+        print_phase(name, summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = any(stats['errors'] for summary in phases.values() for stats in summary['steps'].values())
+    regressions = compare(args.baseline, results, args.tolerance) if args.baseline else []
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
+
+# Example usage:
+# python benchmarks/run.py --sqlite /tmp/saffron_bench.db --output bench.json
+# python benchmarks/run.py --raters 20000 --items 100 --ratings 1000000 --tag big --keep   # local Postgres from .env, dataset kept
+# python benchmarks/run.py --tag big --reuse --keep --baseline bench.json
+# python benchmarks/run.py --base-url http://localhost:4020 --participants 500 --concurrency 64
@@ -0,0 +1,40 @@
+import argparse
+import time
+from application.database import db
+from application.models import Test
+from application.export import iter_export, EXPORT_FORMATS, parquet_available
+from main import app
+
+
+def export_test_results(test_id: int, export_format: str, output_path: str = ""):
+    with app.app_context():
+        test = db.session.query(Test.test_type).filter_by(id=test_id).first()
+        if not test:
+            raise SystemExit(f"Test {test_id} not found")
+        if export_format == 'parquet' and not parquet_available():
+            raise SystemExit("Parquet export requires pyarrow to be installed")
+
+        output_path = output_path or f"ratings_{test_id}.{EXPORT_FORMATS[export_format][1]}"
+        start = time.perf_counter()
+        written = 0
+        with open(output_path, 'wb') as f:
+            for chunk in iter_export(test_id, test.test_type, export_format):
+                f.write(chunk)
+                written += len(chunk)
+        print(f"Exported {test.test_type} ratings of test {test_id} to {output_path} "
+              f"({written} bytes in {time.perf_counter() - start:.1f}s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the ratings of a test as flat, typed columns')
+    parser.add_argument('test_id', type=int, help='ID of the test to export')
+    parser.add_argument('--format', default='csv', choices=list(EXPORT_FORMATS),
+                      help='csv (gzip-compressed) or parquet')
+    parser.add_argument('--output', default='',
+                      help='Output file, defaults to ratings_<test_id>.<extension>')
+
+    args = parser.parse_args()
+
+    export_test_results(args.test_id, args.format, args.output)
+
+# Example usage:
+# python export_results.py 12 --format parquet --output mushra_12.parquet
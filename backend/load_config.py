@@ -1,66 +1,305 @@
 import json
-import argparse, os, random
-from enum import Enum
+import argparse, os, re, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from flask import Flask
 from application.database import db
-from application.models import Test, Study
-from main import app
+from application.models import Test, Study, TestType
+from application.items import store_test_items
+from application.assets import AssetStore, localize_items
+from application.peaks import add_peaks
+
+# Config files are read this many characters at a time, so memory holds one chunk
+# plus the items parsed so far rather than the raw text of the whole file
+READ_CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_MISSING = object()
+
+
+def create_loader_app():
+    """A bare app bound to the database: none of the routes, caches or workers of main.py."""
+    load_dotenv()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['NORMALIZED_ITEMS'] = os.getenv('NORMALIZED_ITEMS', '').lower() in ('1', 'true', 'yes')
+    app.config['AUDIO_ASSET_DIR'] = os.getenv('AUDIO_ASSET_DIR')
+    app.config['AUDIO_ASSET_URL'] = os.getenv('AUDIO_ASSET_URL', '/api/static/audio')
+    db.init_app(app)
+    return app
+
+
+def iter_json_items(config_path: str):
+    """
+    Yield the items of a JSON array file one at a time. Uses ijson when it is
+    installed, otherwise json.JSONDecoder.raw_decode over chunks of the file.
+    """
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+    if ijson is not None:
+        with open(config_path, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(config_path, 'r', encoding='utf-8') as f:
+        buffer, pos = f.read(READ_CHUNK_SIZE), 0
+        expected = '['  # '[' first, then a value or ']', then ',' or ']' after each value
+
+        def more():
+            chunk = f.read(READ_CHUNK_SIZE)
+            return buffer[pos:] + chunk, 0, bool(chunk)
+
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                buffer, pos, read = more()
+                if not read:
+                    raise ValueError(f"{config_path}: unexpected end of file")
+                continue
+
+            char = buffer[pos]
+            if expected == '[':
+                if char != '[':
+                    raise ValueError(f"{config_path}: expected a JSON array of test items")
+                pos, expected = pos + 1, 'value'
+                continue
+            if expected == 'separator' or (expected == 'value' and char == ']'):
+                if char == ']':
+                    return
+                if char != ',':
+                    raise ValueError(f"{config_path}: expected ',' or ']' between test items")
+                pos, expected = pos + 1, 'value'
+                continue
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                complete = end < len(buffer)  # A value touching the end of the buffer may go on
+            except json.JSONDecodeError:
+                item, complete = _MISSING, False
+            if not complete:
+                buffer, pos, read = more()
+                if read:
+                    continue
+                if item is _MISSING:
+                    raise ValueError(f"{config_path}: invalid or truncated JSON item")
+                end = len(buffer)
+            yield item
+            pos, expected = end, 'separator'
+
+
+def _has_audio(value):
+    return isinstance(value, str) and bool(value.strip())
+
+
+def validate_single_audio(item):
+    sample = item.get('sample') if isinstance(item.get('sample'), dict) else {}
+    if not _has_audio(item.get('audio_path')) and not _has_audio(sample.get('audio_path')):
+        return ['missing audio_path']
+    return []
+
+
+def validate_reference_and_tests(item):
+    problems = []
+    if not _has_audio(item.get('reference_audio')):
+        problems.append('missing reference_audio')
+    audios = item.get('test_audios')
+    if not isinstance(audios, list) or not audios:
+        problems.append('test_audios must be a non-empty list')
+    elif not all(isinstance(audio, dict) and _has_audio(audio.get('audio_path')) for audio in audios):
+        problems.append('every entry of test_audios needs an audio_path')
+    return problems
+
+
+# What the test components of the frontend read from each item, per test type
+ITEM_VALIDATORS = {
+    TestType.HFR: validate_single_audio,
+    TestType.MVH_GRANULAR: validate_single_audio,
+    TestType.MUSHRA: validate_reference_and_tests,
+    TestType.MUSHRA_GRANULAR: validate_reference_and_tests,
+    TestType.CMOS: validate_reference_and_tests,
+}
+
+
+def validate_item(test_type: TestType, item):
+    """Problems with one config item, empty if it is valid for the test type."""
+    if not isinstance(item, dict):
+        return ['not a JSON object']
+    problems = [] if 'id' in item else ['missing id']
+    return problems + ITEM_VALIDATORS[test_type](item)
+
+
+def parse_config(config_path: str, test_type: TestType, max_errors=20):
+    """Stream and validate one config file. Returns (items, errors)."""
+    items, errors, seen_ids = [], [], set()
+    try:
+        for position, item in enumerate(iter_json_items(config_path)):
+            problems = validate_item(test_type, item)
+            if isinstance(item, dict) and 'id' in item:
+                if item['id'] in seen_ids:
+                    problems.append(f"duplicate id {item['id']}")
+                seen_ids.add(item['id'])
+            if problems and len(errors) < max_errors:
+                errors.append(f"{config_path}: item {position}: {', '.join(problems)}")
+            items.append(item)
+    except (OSError, ValueError) as e:
+        errors.append(str(e))
+    if not items and not errors:
+        errors.append(f"{config_path}: no test items")
+    return items, errors
 
-class TestType(Enum):
-    HFR = "hfr"
-    MUSHRA_GRANULAR = "mushra-granular"
-    MUSHRA = "mushra"
-    MVH_GRANULAR = "hfr-granular"
-    CMOS = "cmos"
 
 def load_json_config(config_path: str):
     with open(config_path, 'r') as f:
         return json.load(f)
-    
-def populate_database_from_config(test_type: TestType, config_data: list, prolific=False, description=""):
+
+
+def read_manifest(manifest_path: str):
+    """
+    Entries of a manifest file, a JSON list (or {"tests": [...]}) of
+    {"config", "test_type", "description"?, "study": {"study_id", "completion_url"}?}.
+    Config paths are relative to the manifest.
+    """
+    manifest = load_json_config(manifest_path)
+    entries = manifest.get('tests', []) if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    parsed = []
+    for position, entry in enumerate(entries):
+        try:
+            test_type = TestType(entry['test_type'])
+            config = os.path.join(base_dir, entry['config'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"{manifest_path}: entry {position} needs a config and a valid test_type "
+                             f"({', '.join(t.value for t in TestType)})")
+        study = entry.get('study')
+        if study is not None and not (study.get('study_id') and study.get('completion_url')):
+            raise ValueError(f"{manifest_path}: the study of entry {position} needs study_id and completion_url")
+        parsed.append({'config': config, 'test_type': test_type,
+                       'description': entry.get('description'), 'study': study})
+    return parsed
+
+
+def _parse_entry(entry):
+    return parse_config(entry['config'], entry['test_type'])
+
+
+def load_configs(entries, workers=None, dry_run=False, localize_audio=True):
+    """
+    Parse and validate every entry (in parallel across files), then insert all tests and
+    studies in one transaction. Nothing is inserted if any file is invalid. With
+    AUDIO_ASSET_DIR set (and localize_audio), the audio of every item is copied into the
+    asset store first, its waveform peaks are computed, and the items point at both.
+    Returns [(entry, test id), ...].
+    """
+    started = time.perf_counter()
+    workers = workers or min(len(entries), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_parse_entry, entries))
+    else:
+        results = [_parse_entry(entry) for entry in entries]
+    parsed = time.perf_counter()
+
+    errors = [error for _, file_errors in results for error in file_errors]
+    study_ids = [entry['study']['study_id'] for entry in entries if entry['study']]
+    if len(study_ids) != len(set(study_ids)):
+        errors.append('The same study_id is used by more than one entry')
+    total_items = sum(len(items) for items, _ in results)
+
+    loaded = []
+    app = create_loader_app()
+    if localize_audio and app.config['AUDIO_ASSET_DIR'] and not errors:
+        store = AssetStore(app.config['AUDIO_ASSET_DIR'], app.config['AUDIO_ASSET_URL'])
+        for entry, (items, _) in zip(entries, results):
+            errors += localize_items(items, store, base_dir=os.path.dirname(os.path.abspath(entry['config'])),
+                                     allow_local=True)
+            if not errors:
+                for problem in add_peaks(items, store):
+                    print(f"{entry['config']}: no waveform peaks for {problem}", file=sys.stderr)
+    localized = time.perf_counter()
     with app.app_context():
-        if description:
-            description = description
-        else:
-            description = f"Test data from config for {test_type.value} task"
-        test = Test(
-            id=db.session.query(db.func.max(Test.id)).scalar() + 1 if db.session.query(db.func.max(Test.id)).scalar() is not None else 1,
-            test_type=test_type,
-            description=description,
-            json_entry=config_data
-        )
-        db.session.add(test)
-        db.session.commit()
-
-        if prolific:
-            study_id=f"123456"
-            study = Study(
-                id=db.session.query(db.func.max(Study.id)).scalar() + 1 if db.session.query(db.func.max(Study.id)).scalar() is not None else 1,
-                test_id=test.id,
-                study_id=study_id,
-                completion_url=f"https://app.prolific.co/submissions/complete?cc=12345678"
+        existing = db.session.query(Study.study_id).filter(Study.study_id.in_(study_ids)).all() if study_ids else []
+        errors += [f"Study {study_id} already exists" for study_id, in existing]
+        if errors:
+            for error in errors:
+                print(error, file=sys.stderr)
+            raise SystemExit(f"{len(errors)} problem(s) found, nothing was loaded")
+
+        for entry, (items, _) in zip(entries, results):
+            test = Test(
+                test_type=entry['test_type'].value,
+                description=entry['description'] or f"Test data from config for {entry['test_type'].value} task",
+                json_entry=items,
+                item_count=len(items)
             )
-            print(f"Study ID: {study_id}")
-            db.session.add(study)
+            db.session.add(test)
+            db.session.flush()
+            if app.config['NORMALIZED_ITEMS']:
+                store_test_items(test.id, items)
+            if entry['study']:
+                db.session.add(Study(
+                    test_id=test.id,
+                    study_id=str(entry['study']['study_id']),
+                    completion_url=entry['study']['completion_url']
+                ))
+            loaded.append((entry, test.id))
+        if dry_run:
+            db.session.rollback()
+        else:
             db.session.commit()
+    finished = time.perf_counter()
+
+    for entry, test_id in loaded:
+        study = f", study {entry['study']['study_id']}" if entry['study'] else ''
+        print(f"test id {test_id}{' (dry run)' if dry_run else ''} for {entry['config']}{study}")
+    print(f"{total_items} items from {len(entries)} file(s): parsed in {parsed - started:.2f}s "
+          f"({total_items / max(parsed - started, 1e-9):.0f} items/s), audio and peaks stored in {localized - parsed:.2f}s, "
+          f"loaded in {finished - started:.2f}s ({total_items / max(finished - started, 1e-9):.0f} items/s)")
+    return loaded
+
+
+def populate_database_from_config(test_type: TestType, config_path: str, study_id=None,
+                                  completion_url=None, description=""):
+    study = {'study_id': study_id, 'completion_url': completion_url} if study_id else None
+    return load_configs([{'config': config_path, 'test_type': test_type,
+                          'description': description, 'study': study}], workers=1)
 
-        print(f"test id for {description}", test.id)
-        # print(f"Database populated successfully with {test_type} test data from config!")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Load test data from config file')
-    parser.add_argument('config_path', help='Path to the JSON config file')
-    parser.add_argument('--test-type', required=True, 
+    parser = argparse.ArgumentParser(description='Load test data from config files')
+    parser.add_argument('config_path', nargs='?', help='Path to the JSON config file')
+    parser.add_argument('--test-type',
                       choices=[t.value for t in TestType],
                       help='Type of test to create')
+    parser.add_argument('--description', default="", help='Description of the test')
     parser.add_argument('--prolific', action='store_true',
-                      help='Create Prolific study')
-    
+                      help='Create a Prolific study for the test (needs --study-id and --completion-url)')
+    parser.add_argument('--study-id', help='Prolific study ID')
+    parser.add_argument('--completion-url', help='Prolific completion URL of the study')
+    parser.add_argument('--manifest', help='JSON manifest of many configs (and studies) to load at once')
+    parser.add_argument('--workers', type=int, help='Processes parsing config files, defaults to one per CPU')
+    parser.add_argument('--dry-run', action='store_true', help='Parse, validate and insert, then roll back')
+    parser.add_argument('--remote-audio', action='store_true',
+                      help='Keep audio URLs as they are even when AUDIO_ASSET_DIR is set')
+
     args = parser.parse_args()
-    
-    config_data = load_json_config(args.config_path)
-    test_type = next(t for t in TestType if t.value == args.test_type)
-    
-    populate_database_from_config(test_type, config_data, args.prolific)
+
+    if args.manifest:
+        entries = read_manifest(args.manifest)
+    else:
+        if not args.config_path or not args.test_type:
+            parser.error('config_path and --test-type are required without --manifest')
+        if args.prolific and not (args.study_id and args.completion_url):
+            parser.error('--prolific needs --study-id and --completion-url')
+        study = {'study_id': args.study_id, 'completion_url': args.completion_url} if args.prolific else None
+        entries = [{'config': args.config_path, 'test_type': TestType(args.test_type),
+                    'description': args.description, 'study': study}]
+
+    load_configs(entries, workers=args.workers, dry_run=args.dry_run, localize_audio=not args.remote_audio)
 
 # Example usage:
-# python load_config.py path/to/config.json --test-type "HFR" --prolific
\ No newline at end of file
+# python load_config.py path/to/config.json --test-type "hfr" --prolific --study-id "<PROLIFIC_STUDY_ID>" --completion-url "https://app.prolific.com/submissions/complete?cc=<CODE>"
+# python load_config.py --manifest path/to/manifest.json --workers 8
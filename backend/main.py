@@ -1,6 +1,7 @@
 import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 from datetime import datetime, timedelta
 from threading import Lock
 from dotenv import load_dotenv
@@ -20,10 +21,26 @@ def create_app():
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=300)
     app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB
+    app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL')  # optional shared cache tier
+    app.config['CACHE_LOCAL_MAX_ENTRIES'] = int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 10000))
+    app.config['RATING_INGEST'] = os.getenv('RATING_INGEST', 'sync')  # 'sync' or 'journal' (write-behind)
+    app.config['RATING_JOURNAL_DIR'] = os.getenv('RATING_JOURNAL_DIR', 'rating_journal')
+    app.config['RATING_FLUSH_INTERVAL'] = float(os.getenv('RATING_FLUSH_INTERVAL', 1.0))
+    app.config['AUDIO_ASSET_DIR'] = os.getenv('AUDIO_ASSET_DIR')  # local copies of test audio, see application/assets.py
+    app.config['AUDIO_ASSET_URL'] = os.getenv('AUDIO_ASSET_URL', '/api/static/audio')
+    app.config['LOG_FILE'] = os.getenv('LOG_FILE', 'error.log')
+    app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'WARNING').upper()
+    app.config['LOG_MAX_BYTES'] = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    app.config['LOG_BACKUP_COUNT'] = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    app.config['SLOW_REQUEST_SECONDS'] = float(os.getenv('SLOW_REQUEST_SECONDS', 1.0))
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')  # shared by worker processes to aggregate /api/metrics
+    app.config['BACKUP_JOURNAL_DIR'] = os.getenv('BACKUP_JOURNAL_DIR', 'backup_journal')  # see scripts/incremental_backup.py
+    app.config['NORMALIZED_ITEMS'] = os.getenv('NORMALIZED_ITEMS', '').lower() in ('1', 'true', 'yes')  # serve items from test_item
     app.app_context().push()
 
     # Initialize database
     db.init_app(app)
+    Migrate(app, db)
     app.app_context().push()
     return app
 
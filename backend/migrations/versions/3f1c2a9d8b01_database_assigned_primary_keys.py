@@ -0,0 +1,47 @@
+"""Let the database assign primary keys
+
+Rows used to be inserted with an explicit ``max(id) + 1`` computed by the
+application, so the serial sequences behind the ``id`` columns were never
+advanced. This attaches a sequence to every ``id`` column that lacks one and
+moves each sequence past the highest id already in use.
+
+Revision ID: 3f1c2a9d8b01
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8b01'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+TABLES = ('rater', 'test', 'study', 'session', 'rating', 'consent')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # SQLite and friends already allocate INTEGER PRIMARY KEYs themselves
+        return
+
+    for table in TABLES:
+        sequence = bind.execute(
+            sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table}
+        ).scalar()
+        if sequence is None:
+            sequence = f'{table}_id_seq'
+            op.execute(f'CREATE SEQUENCE IF NOT EXISTS {sequence} OWNED BY "{table}".id')
+            op.execute(f"ALTER TABLE \"{table}\" ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        op.execute(
+            f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM \"{table}\"), 0) + 1, false)"
+        )
+
+
+def downgrade():
+    # Sequences are left in place: they are compatible with explicit ids.
+    pass
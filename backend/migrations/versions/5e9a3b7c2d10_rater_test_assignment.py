@@ -0,0 +1,37 @@
+"""Persist a per-(rater, test) shuffle seed
+
+Revision ID: 5e9a3b7c2d10
+Revises: c4d8e2f1a7b5
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a3b7c2d10'
+down_revision = 'c4d8e2f1a7b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'assignment' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'assignment',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('rater_id', sa.Integer(), nullable=False),
+        sa.Column('test_id', sa.Integer(), nullable=False),
+        sa.Column('seed', sa.Integer(), nullable=False),
+        sa.Column('time_of_creation', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['rater_id'], ['rater.id']),
+        sa.ForeignKeyConstraint(['test_id'], ['test.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('rater_id', 'test_id', name='uq_assignment_rater_id_test_id')
+    )
+
+
+def downgrade():
+    op.drop_table('assignment')
@@ -0,0 +1,42 @@
+"""Indexes for the rating, rater and consent lookups done on every request
+
+Revision ID: 7b2e4d1c9a34
+Revises: 3f1c2a9d8b01
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e4d1c9a34'
+down_revision = '3f1c2a9d8b01'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, covering columns)
+INDEXES = (
+    ('ix_rater_name', 'rater', ('name',), ()),
+    ('ix_rating_rater_id_test_id', 'rating', ('rater_id', 'test_id'), ('page_no_progress',)),
+    ('ix_rating_test_id_id', 'rating', ('test_id', 'id'), ()),
+    ('ix_consent_rater_id_test_id', 'consent', ('rater_id', 'test_id'), ()),
+)
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    # Fresh databases already got these from db.create_all(), hence IF NOT EXISTS.
+    # On PostgreSQL the indexes are built CONCURRENTLY so a live rating table
+    # keeps accepting writes while the migration runs.
+    with op.get_context().autocommit_block():
+        for name, table, columns, include in INDEXES:
+            sql = 'CREATE INDEX {}IF NOT EXISTS {} ON "{}" ({})'.format(
+                'CONCURRENTLY ' if postgresql else '', name, table, ', '.join(columns))
+            if include and postgresql:
+                sql += ' INCLUDE ({})'.format(', '.join(include))
+            op.execute(sql)
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
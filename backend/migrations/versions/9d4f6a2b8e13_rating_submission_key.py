@@ -0,0 +1,29 @@
+"""Add an idempotency key to ratings
+
+Revision ID: 9d4f6a2b8e13
+Revises: 5e9a3b7c2d10
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f6a2b8e13'
+down_revision = '5e9a3b7c2d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'submission_key' not in [c['name'] for c in inspector.get_columns('rating')]:
+        op.add_column('rating', sa.Column('submission_key', sa.String(length=64), nullable=True))
+    if 'uq_rating_submission_key' not in [c['name'] for c in inspector.get_unique_constraints('rating')]:
+        op.create_unique_constraint('uq_rating_submission_key', 'rating', ['submission_key'])
+
+
+def downgrade():
+    op.drop_constraint('uq_rating_submission_key', 'rating', type_='unique')
+    op.drop_column('rating', 'submission_key')
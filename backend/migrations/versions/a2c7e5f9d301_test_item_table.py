@@ -0,0 +1,48 @@
+"""Normalized test items: one test_item row per item of a test
+
+Revision ID: a2c7e5f9d301
+Revises: 9d4f6a2b8e13
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2c7e5f9d301'
+down_revision = '9d4f6a2b8e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'test_item' not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            'test_item',
+            sa.Column('test_id', sa.Integer(), nullable=False),
+            sa.Column('item_id', sa.String(length=50), nullable=False),
+            sa.Column('position', sa.Integer(), nullable=False),
+            sa.Column('payload', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=False),
+            sa.ForeignKeyConstraint(['test_id'], ['test.id']),
+            sa.PrimaryKeyConstraint('test_id', 'item_id')
+        )
+        op.create_index('ix_test_item_test_id_position', 'test_item', ['test_id', 'position'], unique=True)
+
+    if bind.dialect.name == 'postgresql':
+        # Split every blob in SQL; other databases use scripts/normalize_test_items.py
+        op.execute("""
+            INSERT INTO test_item (test_id, item_id, position, payload)
+            SELECT t.id, COALESCE(e.value->>'id', (e.ordinality - 1)::text), e.ordinality - 1, e.value::jsonb
+            FROM test t
+            CROSS JOIN LATERAL json_array_elements(t.json_entry) WITH ORDINALITY AS e(value, ordinality)
+            WHERE NOT EXISTS (SELECT 1 FROM test_item ti WHERE ti.test_id = t.id)
+            ON CONFLICT DO NOTHING
+        """)
+
+
+def downgrade():
+    op.drop_index('ix_test_item_test_id_position', table_name='test_item')
+    op.drop_table('test_item')
@@ -0,0 +1,88 @@
+"""Store rating results as JSONB and extract per-audio scores into rating_score
+
+Revision ID: b8e1d4c6f702
+Revises: a2c7e5f9d301
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e1d4c6f702'
+down_revision = 'a2c7e5f9d301'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    postgres = bind.dialect.name == 'postgresql'
+
+    if postgres:
+        results_type = next(c['type'] for c in inspector.get_columns('rating') if c['name'] == 'results_json')
+        if not isinstance(results_type, postgresql.JSONB):
+            op.execute("ALTER TABLE rating ALTER COLUMN results_json TYPE jsonb USING results_json::jsonb")
+        op.execute("CREATE INDEX IF NOT EXISTS ix_rating_results_json ON rating "
+                   "USING gin (results_json jsonb_path_ops)")
+
+    if 'rating_score' not in inspector.get_table_names():
+        op.create_table(
+            'rating_score',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('rating_id', sa.Integer(), nullable=False),
+            sa.Column('test_id', sa.Integer(), nullable=False),
+            sa.Column('rater_id', sa.Integer(), nullable=False),
+            sa.Column('test_type', sa.String(length=512), nullable=True),
+            sa.Column('role', sa.String(length=16), nullable=False),
+            sa.Column('url', sa.Text(), nullable=True),
+            sa.Column('system', sa.String(length=512), nullable=True),
+            sa.Column('score', sa.Float(), nullable=True),
+            sa.Column('label', sa.String(length=512), nullable=True),
+            sa.Column('attributes', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=True),
+            sa.ForeignKeyConstraint(['rating_id'], ['rating.id']),
+            sa.ForeignKeyConstraint(['test_id'], ['test.id']),
+            sa.ForeignKeyConstraint(['rater_id'], ['rater.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_rating_score_test_id_system', 'rating_score', ['test_id', 'system'],
+                        postgresql_include=['score'])
+        op.create_index('ix_rating_score_test_id_label', 'rating_score', ['test_id', 'label'])
+        op.create_index('ix_rating_score_rating_id', 'rating_score', ['rating_id'])
+        if postgres:
+            op.create_index('ix_rating_score_attributes', 'rating_score', ['attributes'],
+                            postgresql_using='gin', postgresql_ops={'attributes': 'jsonb_path_ops'})
+
+    if postgres:
+        # Same extraction as application/scores.py; other databases use scripts/backfill_rating_scores.py
+        op.execute(r"""
+            INSERT INTO rating_score (rating_id, test_id, rater_id, test_type, role, url, system, score, label, attributes)
+            SELECT r.id, r.test_id, r.rater_id, t.test_type, a.role, a.audio->>'url', a.audio->>'system',
+                   CASE WHEN jsonb_typeof(a.audio->'score') = 'number' THEN (a.audio->>'score')::float
+                        WHEN a.audio->>'score' ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$' THEN (a.audio->>'score')::float
+                   END,
+                   a.audio->>'label',
+                   CASE WHEN jsonb_typeof(a.audio->'attributes') = 'object' THEN a.audio->'attributes' END
+            FROM rating r
+            JOIN test t ON t.id = r.test_id
+            CROSS JOIN LATERAL (
+                SELECT 'reference' AS role, r.results_json->'reference' AS audio
+                WHERE jsonb_typeof(r.results_json->'reference') = 'object'
+                UNION ALL
+                SELECT 'test', e.value
+                FROM jsonb_array_elements(CASE WHEN jsonb_typeof(r.results_json->'audios') = 'array'
+                                               THEN r.results_json->'audios' ELSE '[]'::jsonb END) AS e(value)
+                WHERE jsonb_typeof(e.value) = 'object'
+            ) a
+            WHERE NOT EXISTS (SELECT 1 FROM rating_score s WHERE s.rating_id = r.id)
+        """)
+
+
+def downgrade():
+    op.drop_table('rating_score')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_rating_results_json")
+        op.execute("ALTER TABLE rating ALTER COLUMN results_json TYPE json USING results_json::json")
@@ -0,0 +1,27 @@
+"""Store the number of items of each test
+
+Revision ID: c4d8e2f1a7b5
+Revises: 7b2e4d1c9a34
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e2f1a7b5'
+down_revision = '7b2e4d1c9a34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('test')]
+    if 'item_count' not in columns:
+        op.add_column('test', sa.Column('item_count', sa.Integer(), nullable=True))
+    op.execute("UPDATE test SET item_count = json_array_length(json_entry) WHERE item_count IS NULL")
+
+
+def downgrade():
+    op.drop_column('test', 'item_count')
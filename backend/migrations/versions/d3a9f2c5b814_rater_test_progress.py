@@ -0,0 +1,55 @@
+"""Per-(rater, test) progress counters
+
+Revision ID: d3a9f2c5b814
+Revises: b8e1d4c6f702
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a9f2c5b814'
+down_revision = 'b8e1d4c6f702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'progress' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'progress',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('rater_id', sa.Integer(), nullable=False),
+            sa.Column('test_id', sa.Integer(), nullable=False),
+            sa.Column('completed', sa.Integer(), nullable=False),
+            sa.Column('last_page', sa.String(length=50), nullable=True),
+            sa.Column('time_of_last_rating', sa.DateTime(), nullable=True),
+            sa.Column('time_of_completion', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['rater_id'], ['rater.id']),
+            sa.ForeignKeyConstraint(['test_id'], ['test.id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('rater_id', 'test_id', name='uq_progress_rater_id_test_id')
+        )
+        op.create_index('ix_progress_test_id', 'progress', ['test_id'])
+
+    # Same as application.progress.rebuild_progress, for raters that have no row yet
+    op.execute("""
+        INSERT INTO progress (rater_id, test_id, completed, last_page, time_of_last_rating, time_of_completion)
+        SELECT r.rater_id, r.test_id, COUNT(DISTINCT r.page_no_progress),
+               (SELECT r2.page_no_progress FROM rating r2
+                WHERE r2.rater_id = r.rater_id AND r2.test_id = r.test_id
+                ORDER BY r2.id DESC LIMIT 1),
+               MAX(r.time_of_submission),
+               CASE WHEN COUNT(DISTINCT r.page_no_progress) >= MAX(t.item_count) THEN MAX(r.time_of_submission) END
+        FROM rating r
+        JOIN test t ON t.id = r.test_id
+        WHERE NOT EXISTS (SELECT 1 FROM progress p WHERE p.rater_id = r.rater_id AND p.test_id = r.test_id)
+        GROUP BY r.rater_id, r.test_id
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_progress_test_id', table_name='progress')
+    op.drop_table('progress')
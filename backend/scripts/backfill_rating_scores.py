@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.database import db
+from application.models import Rating, RatingScore
+from application.scores import insert_scores
+from main import app
+
+# Extracts rating_score rows for every rating that has none yet, in id order
+# and one transaction per batch, so it can be stopped and run again. The
+# PostgreSQL migration does this in SQL; use this on other databases or to
+# catch up ratings written while the extraction was not deployed.
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill rating_score from Rating.results_json')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Ratings per transaction')
+    args = parser.parse_args()
+
+    with app.app_context():
+        extracted = db.session.query(RatingScore.id).filter(RatingScore.rating_id == Rating.id).exists()
+        after_id, ratings, scores = 0, 0, 0
+        while True:
+            batch = db.session.query(Rating.id, Rating.rater_id, Rating.test_id, Rating.results_json) \
+                .filter(Rating.id > after_id, ~extracted).order_by(Rating.id).limit(args.batch_size).all()
+            if not batch:
+                break
+            scores += insert_scores(batch)
+            db.session.commit()
+            ratings += len(batch)
+            after_id = batch[-1].id
+            print(f"up to rating {after_id}: {ratings} ratings, {scores} scores")
+        print(f"done: {ratings} ratings, {scores} scores extracted")
+
+
+if __name__ == '__main__':
+    main()
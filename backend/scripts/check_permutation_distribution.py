@@ -0,0 +1,81 @@
+import argparse
+import math
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.samples import SeededPermutation
+
+# Checks that the per-rater sample orders (SeededPermutation) are close to uniform:
+# over many seeds, every order of a small test should be about equally likely, and
+# in larger tests every sample should land at every position about equally often.
+# The default sizes cover both the shuffled (small) and the Feistel (large) tests.
+# Run it after changing the permutation; it exits with 1 if a check fails.
+
+
+def chi_square(counts, cells, draws):
+    """Chi-square statistic of counts against the uniform distribution over cells."""
+    expected = draws / cells
+    observed = sum((count - expected) ** 2 / expected for count in counts.values())
+    return observed + (cells - len(counts)) * expected  # Cells never drawn
+
+
+def limit(cells, sigmas):
+    """Acceptance bound of a chi-square statistic with cells - 1 degrees of freedom."""
+    freedom = cells - 1
+    return freedom + sigmas * math.sqrt(2 * freedom)
+
+
+def check_orders(size, draws, sigmas):
+    """Frequency of every complete order, for sizes whose orders can all be counted."""
+    orders = Counter(tuple(SeededPermutation(size, seed)[k] for k in range(size)) for seed in range(draws))
+    cells = math.factorial(size)
+    statistic = chi_square(orders, cells, draws)
+    expected_distinct = cells * (1 - (1 - 1 / cells) ** draws)
+    ok = statistic <= limit(cells, sigmas)
+    print(f"size {size:3}  orders: most {max(orders.values())}, least {min(orders.values()) if len(orders) == cells else 0}, "
+          f"expected {draws / cells:.1f}; {len(orders)} distinct (expected {expected_distinct:.0f}); "
+          f"chi2 {statistic:.0f} (limit {limit(cells, sigmas):.0f})  {'ok' if ok else 'BIASED'}")
+    return ok
+
+
+def check_positions(size, draws, sigmas):
+    """Frequency of every (position, sample) pair."""
+    cells = Counter()
+    for seed in range(draws):
+        permutation = SeededPermutation(size, seed)
+        cells.update((position, permutation[position]) for position in range(size))
+    statistic = chi_square(cells, size * size, draws * size)
+    ok = statistic <= limit(size * size, sigmas)
+    print(f"size {size:3}  positions: most {max(cells.values())}, least {min(cells.values())}, "
+          f"expected {draws / size:.1f}; chi2 {statistic:.0f} (limit {limit(size * size, sigmas):.0f})  "
+          f"{'ok' if ok else 'BIASED'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that seeded sample orders are close to uniform')
+    parser.add_argument('--draws', type=int, default=50000, help='Seeds per size')
+    parser.add_argument('--order-sizes', type=int, nargs='*', default=[2, 3, 4, 5, 6, 7, 8],
+                        help='Sizes whose complete orders are counted')
+    parser.add_argument('--position-sizes', type=int, nargs='*', default=[10, 50, 257, 400],
+                        help='Sizes checked position by position')
+    parser.add_argument('--position-draws', type=int, default=5000, help='Seeds per size checked by position')
+    parser.add_argument('--sigmas', type=float, default=5.0, help='Tolerance of the chi-square checks')
+    args = parser.parse_args()
+
+    print(f"SeededPermutation: shuffle up to {SeededPermutation.SHUFFLE_MAX_SIZE} samples, "
+          f"{SeededPermutation.ROUNDS} Feistel rounds above")
+    results = [check_orders(size, args.draws, args.sigmas) for size in args.order_sizes]
+    results += [check_positions(size, args.position_draws, args.sigmas) for size in args.position_sizes]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
+
+# Example usage:
+# python scripts/check_permutation_distribution.py
+# python scripts/check_permutation_distribution.py --draws 200000 --order-sizes 5 6 --position-sizes 30
@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.database import db
+from application.models import Rater, Rating, Session, Consent
+from main import app
+
+# EXPLAIN-based regression check for the per-request lookups. Sequential and
+# bitmap scans are disabled while planning, so the check answers "can this
+# query be served from an index?" independently of how many rows the tables
+# currently hold: a development database with ten ratings gives the same
+# verdict as production with millions.
+
+
+def hot_queries(rater_id, test_id, rater_name, session_id):
+    """(label, query, relation, required node type) for every hot path."""
+    return [
+        ('pages done by rater', Rating.query.filter_by(rater_id=rater_id, test_id=test_id)
+            .with_entities(Rating.page_no_progress), 'rating', 'Index Only Scan'),
+        ('ratings for results export', Rating.query.filter_by(test_id=test_id), 'rating', 'Index Scan'),
+        ('rater by name', Rater.query.filter_by(name=rater_name), 'rater', 'Index Scan'),
+        ('session by session_id', Session.query.filter_by(session_id=session_id), 'session', 'Index Scan'),
+        ('consent by rater and test', Consent.query.filter_by(rater_id=rater_id, test_id=test_id),
+            'consent', 'Index Scan'),
+    ]
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(query):
+    sql = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    plan = db.session.execute(db.text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def main():
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            print("Query plan checks need PostgreSQL")
+            sys.exit(2)
+
+        sample = db.session.query(Rating.rater_id, Rating.test_id).first() or (1, 1)
+        rater_name = db.session.query(Rater.name).filter_by(id=sample[0]).scalar() or 'rater'
+        session_id = db.session.query(Session.session_id).limit(1).scalar() or 'session'
+
+        db.session.execute(db.text("SET LOCAL enable_seqscan = off"))
+        db.session.execute(db.text("SET LOCAL enable_bitmapscan = off"))
+
+        failures = 0
+        for label, query, relation, required in hot_queries(sample[0], sample[1], rater_name, session_id):
+            nodes = [node for node in plan_nodes(explain(query)) if node.get('Relation Name') == relation]
+            found = ', '.join(f"{node['Node Type']} ({node.get('Index Name', '-')})" for node in nodes)
+            ok = bool(nodes) and all(node['Node Type'] == required for node in nodes)
+            if not ok and required == 'Index Scan':
+                # An index-only scan is strictly better than what was asked for
+                ok = bool(nodes) and all(node['Node Type'] in ('Index Scan', 'Index Only Scan') for node in nodes)
+            failures += not ok
+            print(f"[{'ok' if ok else 'FAIL'}] {label}: expected {required}, got {found or 'no scan'}")
+        db.session.rollback()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,9 @@
 import os
 import sys
 import logging
-from azure.storage.blob import BlobServiceClient, BlobSasPermissions, generate_blob_sas
-from datetime import datetime, timedelta
+from datetime import datetime
 from dotenv import load_dotenv
+from stream_backup import AzureBlobTarget, upload, verify
 
 # Load environment variables from the .env file
 load_dotenv(".env")
@@ -29,33 +29,18 @@ def upload_backup_to_azure(backup_file):
             logging.error("Missing necessary environment variables.")
             sys.exit(3)  # Custom exit code for missing environment variables
 
-        # Initialize the BlobServiceClient and ContainerClient
-        blob_service_client = BlobServiceClient(account_url=azure_account_url, credential=credential)
-        container_client = blob_service_client.get_container_client(container_name)
-
         # Determine blob name based on the backup file's relative path
-        blob_name = os.path.relpath(backup_file, "/tmp")
+        blob_name = os.path.relpath(backup_file, "/tmp") + ".gz"
         logging.info(f"Uploading {backup_file} as blob {blob_name}")
 
-        # Upload the file to Azure Blob Storage
-        blob_client = container_client.get_blob_client(blob_name)
+        # Upload the file compressed, in blocks staged concurrently; an interrupted
+        # upload of the same file resumes from the blocks already staged
+        target = AzureBlobTarget(container_name)
         with open(backup_file, 'rb') as data:
-            blob_client.upload_blob(data, overwrite=True)
+            download_url = upload(data, target, blob_name)
+        verify(target, blob_name)
 
         logging.info(f"Upload completed for {blob_name}")
-
-        # Generate SAS token for the uploaded blob to create a download URL
-        sas_token = generate_blob_sas(
-            account_name=blob_service_client.account_name,
-            container_name=container_name,
-            blob_name=blob_name,
-            account_key=credential,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(days=120)  # SAS token valid for 120 days
-        )
-
-        # Construct the download URL with SAS token
-        download_url = f"{azure_account_url}/{container_name}/{blob_name}?{sas_token}"
         logging.info(f"Download URL for {blob_name}: {download_url}")
 
     except Exception as e:
@@ -5,35 +5,6 @@ set -e
 
 cd /root/tts-saffron/backend
 
-# Function to upload a file to Azure Blob Storage
-upload_to_azure() {
-    local backup_file=$1
-    echo "$(date) - Starting upload of ${backup_file}." >> /root/tts-saffron/backend/logs/db_backup.log
-
-    if [ -f "$backup_file" ]; then
-        # Activate Conda environment
-        source /root/miniconda3/etc/profile.d/conda.sh
-        conda activate qa
-
-        # Run Python script to upload the file
-        python /root/tts-saffron/backend/database_bkp.py "$backup_file"
-        local python_status=$?
-
-        # Deactivate Conda environment
-        conda deactivate
-
-        if [ $python_status -ne 0 ]; then
-            echo "$(date) - ERROR: Upload of ${backup_file} failed. Python script error." >> /root/tts-saffron/backend/logs/db_backup.log
-            exit 1
-        else
-            echo "$(date) - Upload of ${backup_file} completed." >> /root/tts-saffron/backend/logs/db_backup.log
-        fi
-    else
-        echo "$(date) - File ${backup_file} not found. Skipping upload." >> /root/tts-saffron/backend/logs/db_backup.log
-        exit 1
-    fi
-}
-
 # Trap any errors and log them
 trap 'echo "$(date) - ERROR: Script failed." >> /root/tts-saffron/backend/logs/db_backup.log' ERR
 
@@ -42,21 +13,42 @@ echo "$(date) - cronjob started" >> /root/tts-saffron/backend/logs/db_backup.log
 # Set the date format for the backup file
 BACKUP_DATE=$(date +\%Y-\%m-\%d-\%H-\%M-\%S)
 
-# Define backup files
-BACKUP_FILE_1="/var/backups/saffron-$BACKUP_DATE"
+LOG_FILE=/root/tts-saffron/backend/logs/db_backup.log
+BACKUP_NAME="saffron-$BACKUP_DATE.sql.gz"
 
-# Perform the database backup
-echo "$(date) - Starting database backup." >> /root/tts-saffron/backend/logs/db_backup.log
-PGPASSWORD='ai4b_tts' sudo -u postgres pg_dump -U postgres -d saffron -f "$BACKUP_FILE_1"
-if [ $? -ne 0 ]; then
-    echo "$(date) - ERROR: Database backup failed." >> /root/tts-saffron/backend/logs/db_backup.log
-    exit 1
+# Activate Conda environment
+source /root/miniconda3/etc/profile.d/conda.sh
+conda activate qa
+
+# Prepare a new incremental journal chain on top of this dump: its high-water marks are
+# taken now, before the dump, but runs (scripts/incremental_backup.py run, from cron) keep
+# appending to the current chain until the dump is stored and the new chain is activated
+JOURNAL_PREPARED=0
+if python /root/tts-saffron/backend/scripts/incremental_backup.py start --pending --base "$BACKUP_NAME" >> $LOG_FILE; then
+    JOURNAL_PREPARED=1
+else
+    echo "$(date) - WARNING: Could not prepare an incremental journal chain." >> $LOG_FILE
+fi
+
+# Stream the dump through gzip into Azure Blob Storage in blocks, without a local copy.
+# The backup is only committed if pg_dump succeeds; a failed run leaves only uncommitted
+# blocks, which the blob service discards after a week, and the next run dumps again.
+echo "$(date) - Starting database backup to ${BACKUP_NAME}." >> $LOG_FILE
+if PGPASSWORD='ai4b_tts' python /root/tts-saffron/backend/scripts/stream_backup.py --log-file $LOG_FILE \
+    upload --name "$BACKUP_NAME" --command "sudo -u postgres pg_dump -U postgres -d saffron" --verify; then
+    echo "$(date) - Database backup completed." >> $LOG_FILE
+    if [ $JOURNAL_PREPARED -eq 1 ]; then
+        python /root/tts-saffron/backend/scripts/incremental_backup.py activate --base "$BACKUP_NAME" >> $LOG_FILE \
+            || echo "$(date) - WARNING: Could not activate the incremental journal chain." >> $LOG_FILE
+    fi
 else
-    echo "$(date) - Database backup completed." >> /root/tts-saffron/backend/logs/db_backup.log
+    echo "$(date) - ERROR: Database backup failed." >> $LOG_FILE
+    conda deactivate
+    exit 1
 fi
 
-# Upload each backup file
-upload_to_azure "$BACKUP_FILE_1"
+# Deactivate Conda environment
+conda deactivate
 
 # Log end of cron job
 echo "$(date) - cronjob ended successfully" >> /root/tts-saffron/backend/logs/db_backup.log
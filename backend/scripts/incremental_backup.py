@@ -0,0 +1,147 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from application.database import db
+from application.incremental import MANIFEST, activate_chain, current_chain, export, read_manifest, replay, \
+    start_chain, verify_segments
+from main import app
+from stream_backup import AzureBlobTarget, FilesystemTarget, upload
+
+# Incremental backups between full dumps (see application/incremental.py):
+#
+#   start    start a new chain; db_backup.sh runs `start --pending` right before each
+#            full dump and `activate` once the dump is stored, so runs keep appending
+#            to the previous chain if the dump fails
+#   activate make a pending chain the current one
+#   run      append the rows inserted since the last run (e.g. hourly from cron);
+#            with --upload the new segments and the manifest are copied to blob
+#            storage under journal/<chain>/
+#   status   what the current chain holds
+#   fetch    download a chain from blob storage
+#   restore  replay a chain onto a database restored from its base dump, optionally
+#            only up to a point in time (--until, UTC)
+
+
+def remote_target(args):
+    return FilesystemTarget(args.target_dir) if args.target_dir else AzureBlobTarget(args.container)
+
+
+def chain_path(args):
+    chain = os.path.join(args.dir, args.chain) if args.chain else current_chain(args.dir)
+    if chain is None or not os.path.exists(os.path.join(chain, MANIFEST)):
+        sys.exit(f"No chain in {args.dir}, run `start` first")
+    return chain
+
+
+def upload_file(target, chain, name):
+    with open(os.path.join(chain, name), 'rb') as f:
+        # Segments are gzipped already
+        upload(f, target, f"journal/{os.path.basename(chain)}/{name}", compression='none', workers=2)
+
+
+def download(target, chain, name):
+    path = os.path.join(chain, name)
+    with open(f"{path}.tmp", 'wb') as f:
+        for chunk in target.read(f"journal/{os.path.basename(chain)}/{name}"):
+            f.write(chunk)
+    os.replace(f"{path}.tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental backups of ratings and consents between full dumps')
+    parser.add_argument('--dir', default=app.config['BACKUP_JOURNAL_DIR'], help='Local journal directory')
+    parser.add_argument('--chain', help='Chain (base dump name), defaults to the current one')
+    parser.add_argument('--target-dir', help='Directory standing in for blob storage (upload/fetch)')
+    parser.add_argument('--container', help='Blob container, defaults to DATABASE_CONTAINER')
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    start_parser = commands.add_parser('start', help='Start a chain on top of the full dump about to be taken')
+    start_parser.add_argument('--base', required=True, help='Name of the full dump')
+    start_parser.add_argument('--pending', action='store_true',
+                              help='Only prepare the chain, `activate` it once the dump is stored')
+
+    activate_parser = commands.add_parser('activate', help='Make a pending chain the current one')
+    activate_parser.add_argument('--base', required=True, help='Name of the full dump')
+
+    run_parser = commands.add_parser('run', help='Journal the rows inserted since the last run')
+    run_parser.add_argument('--max-segment-mb', type=int, default=64, help='Rotate segments at this size')
+    run_parser.add_argument('--upload', action='store_true', help='Copy new segments to blob storage')
+
+    commands.add_parser('status', help='Summarize the chain')
+    commands.add_parser('fetch', help='Download the chain from blob storage')
+
+    restore_parser = commands.add_parser('restore', help='Replay the chain onto its restored base dump')
+    restore_parser.add_argument('--until', type=datetime.fromisoformat,
+                                help='Restore the state at this time (UTC, e.g. 2024-05-01T12:00)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.action == 'start':
+            chain = start_chain(args.dir, args.base, activate=not args.pending)
+            print(f"{'prepared' if args.pending else 'started'} {chain}")
+
+        elif args.action == 'activate':
+            activate_chain(args.dir, args.base)
+            print(f"runs now append to {args.base}")
+
+        elif args.action == 'run':
+            chain = chain_path(args)
+            segments = export(chain, max_segment_bytes=args.max_segment_mb * 1024 * 1024)
+            for segment in segments:
+                print(f"{segment['name']}: {segment['bytes']} bytes, "
+                      + ', '.join(f"{count} {table}" for table, count in segment['rows'].items()))
+            if not segments:
+                print('nothing new')
+            if args.upload:
+                target = remote_target(args)
+                for segment in segments:
+                    upload_file(target, chain, segment['name'])
+                upload_file(target, chain, MANIFEST)
+
+        elif args.action == 'status':
+            chain = chain_path(args)
+            manifest = read_manifest(chain)
+            print(f"chain {manifest['base']} started {manifest['started']}, {manifest['runs']} runs, "
+                  f"last {manifest.get('last_run', 'never')}")
+            print(f"{len(manifest['segments'])} segments, {sum(s['bytes'] for s in manifest['segments'])} bytes")
+            for table, mark in manifest['marks'].items():
+                print(f"  {table:11} up to id {mark}, {len(manifest['gaps'][table])} gaps pending")
+            damaged = verify_segments(chain, manifest['segments'])
+            if damaged:
+                sys.exit(f"missing or damaged: {', '.join(damaged)}")
+
+        elif args.action == 'fetch':
+            if not args.chain:
+                sys.exit('--chain is required')
+            chain = os.path.join(args.dir, args.chain)
+            os.makedirs(chain, exist_ok=True)
+            target = remote_target(args)
+            download(target, chain, MANIFEST)
+            manifest = read_manifest(chain)
+            for segment in manifest['segments']:
+                if verify_segments(chain, [segment]):
+                    download(target, chain, segment['name'])
+            print(f"fetched {len(manifest['segments'])} segments to {chain}")
+
+        elif args.action == 'restore':
+            chain = chain_path(args)
+            counts = replay(chain, until=args.until)
+            db.session.commit()
+            print('inserted ' + ', '.join(f"{count} {table}" for table, count in counts.items())
+                  + ' (rows already in the database are skipped)')
+
+
+if __name__ == '__main__':
+    main()
+
+# Example usage:
+# python scripts/incremental_backup.py start --pending --base saffron-2024-05-01.sql.gz
+# python scripts/incremental_backup.py activate --base saffron-2024-05-01.sql.gz
+# python scripts/incremental_backup.py run --upload
+# python scripts/incremental_backup.py --chain saffron-2024-05-01.sql.gz fetch
+# python scripts/incremental_backup.py --chain saffron-2024-05-01.sql.gz restore --until 2024-05-03T18:00
@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.database import db
+from application.items import store_test_items
+from application.models import Test, TestItem
+from main import app
+
+# Writes the items of every test that has no test_item rows yet (tests loaded
+# while NORMALIZED_ITEMS was off, or databases other than PostgreSQL, where
+# the migration does not backfill). Each test is committed on its own, so the
+# script can be stopped and run again.
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill test_item from Test.json_entry')
+    parser.add_argument('--test-id', type=int, action='append', help='Only this test (repeatable)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        normalized = db.session.query(TestItem.test_id).filter(TestItem.test_id == Test.id).exists()
+        query = db.session.query(Test.id).filter(~normalized)
+        if args.test_id:
+            query = query.filter(Test.id.in_(args.test_id))
+        test_ids = [test_id for test_id, in query.order_by(Test.id)]
+
+        for test_id in test_ids:
+            json_entry = db.session.query(Test.json_entry).filter_by(id=test_id).scalar() or []
+            store_test_items(test_id, json_entry)
+            db.session.commit()
+            print(f"test {test_id}: {len(json_entry)} items")
+        print(f"{len(test_ids)} test(s) normalized")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+import uuid
+from urllib import request as urlrequest
+from urllib.error import HTTPError, URLError
+
+# Simulates a Prolific study launch: many participants hit GET /api/prolific/study
+# at the same moment. Every participant is new (fresh PROLIFIC_PID and SESSION_ID),
+# which is the expensive path. Run it against a build before and after a change
+# and compare the printed latencies.
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure /api/prolific/study latency under concurrent arrivals')
+    parser.add_argument('--base-url', default='http://localhost:4020/api', help='Backend API base URL')
+    parser.add_argument('--study-id', required=True, help='Prolific study ID that is linked to a test')
+    parser.add_argument('--arrivals', type=int, default=500, help='Number of participants arriving at once')
+    parser.add_argument('--limit', type=int, default=None, help='Ask for paged delivery of this many samples')
+    parser.add_argument('--output', default='', help='Also write the summary as JSON to this file')
+    args = parser.parse_args()
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(args.arrivals)
+
+    def arrive():
+        url = (f"{args.base_url}/prolific/study?PROLIFIC_PID=load-{uuid.uuid4().hex[:16]}"
+               f"&STUDY_ID={args.study_id}&SESSION_ID={uuid.uuid4().hex}")
+        if args.limit:
+            url += f"&limit={args.limit}"
+        start_line.wait()
+        started = time.perf_counter()
+        try:
+            with urlrequest.urlopen(url, timeout=120) as resp:
+                resp.read()
+            outcome = None
+        except (HTTPError, URLError) as e:
+            outcome = str(e)
+        elapsed = time.perf_counter() - started
+        with lock:
+            if outcome:
+                errors.append(outcome)
+            else:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=arrive) for _ in range(args.arrivals)]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+
+    if not latencies:
+        print(f"All {args.arrivals} arrivals failed, e.g. {errors[0] if errors else 'unknown error'}")
+        sys.exit(1)
+
+    summary = {
+        'arrivals': args.arrivals,
+        'errors': len(errors),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(max(latencies) * 1000, 1),
+        'wall_s': round(wall, 2),
+    }
+    print(' '.join(f"{key}={value}" for key, value in summary.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
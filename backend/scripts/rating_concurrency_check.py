@@ -0,0 +1,79 @@
+import argparse
+import json
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request as urlrequest
+from urllib.error import HTTPError
+
+# Fires many parallel /api/prolific/rating POSTs for one synthetic participant
+# against a running backend, then reads the ratings back through
+# /api/results/<test_id> and checks that none were lost or duplicated.
+
+
+def call(url, method='GET', payload=None, headers=None):
+    body = json.dumps(payload).encode() if payload is not None else None
+    req = urlrequest.Request(url, data=body, method=method, headers=headers or {})
+    if body is not None:
+        req.add_header('Content-Type', 'application/json')
+    try:
+        with urlrequest.urlopen(req, timeout=60) as resp:
+            return resp.status, json.loads(resp.read() or b'null')
+    except HTTPError as e:
+        return e.code, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that concurrent rating submissions are all stored exactly once')
+    parser.add_argument('--base-url', default='http://localhost:4020/api', help='Backend API base URL')
+    parser.add_argument('--study-id', required=True, help='Prolific study ID that is linked to a test')
+    parser.add_argument('--requests', type=int, default=300, help='Number of ratings to submit')
+    parser.add_argument('--workers', type=int, default=100, help='Number of concurrent clients')
+    parser.add_argument('--admin-token', default='tts_ai4b', help='Token accepted by /api/results')
+    parser.add_argument('--settle', type=float, default=3.0,
+                        help='Seconds to wait for journaled (202) ratings to reach the database')
+    args = parser.parse_args()
+
+    prolific_pid = f"concurrency-{uuid.uuid4().hex[:12]}"
+    session_id = uuid.uuid4().hex
+    status, study = call(f"{args.base_url}/prolific/study?PROLIFIC_PID={prolific_pid}"
+                         f"&STUDY_ID={args.study_id}&SESSION_ID={session_id}")
+    if status != 200:
+        print(f"Could not start a session for study {args.study_id} (HTTP {status})")
+        sys.exit(1)
+    test_id = study['test_id']
+
+    def submit(page_no):
+        return call(f"{args.base_url}/prolific/rating", method='POST', payload={
+            'session_id': session_id,
+            'test_id': test_id,
+            'results_json': {'check': 'concurrency', 'page': page_no},
+            'time_taken_to_submit': 1000,
+            'pageNo_progress': page_no,
+        })[0]
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        statuses = list(pool.map(submit, range(1, args.requests + 1)))
+
+    failed = len([s for s in statuses if s not in (201, 202)])
+    if 202 in statuses:
+        time.sleep(args.settle)  # Write-behind ingestion acknowledges before inserting
+    status, rows = call(f"{args.base_url}/results/{test_id}",
+                        headers={'Authorization': f"Bearer {args.admin_token}"})
+    if status != 200:
+        print(f"Could not read back results for test {test_id} (HTTP {status})")
+        sys.exit(1)
+
+    stored = [row for row in rows if row['results_json'].get('session_id') == session_id]
+    ids = [row['id'] for row in stored]
+    pages = [row['results_json']['page'] for row in stored]
+
+    print(f"submitted={args.requests} failed={failed} stored={len(stored)} "
+          f"duplicate_ids={len(ids) - len(set(ids))} duplicate_pages={len(pages) - len(set(pages))}")
+    if failed or len(stored) != args.requests or len(set(ids)) != len(ids) or len(set(pages)) != len(pages):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.database import db
+from application.ingest import RatingJournal, RatingIngestor
+from application.models import Progress, Rater, Rating, RatingScore, Test
+from application.progress import record_progress
+from application.scores import insert_scores
+from main import app
+
+# Compares sustained rating throughput of the synchronous path (one INSERT and
+# one commit per rating, as create_rating/save_rating do without journaling)
+# with write-behind ingestion (fsynced journal, batched multi-row INSERTs).
+# The journal figure is measured until every rating is in the database, not
+# just acknowledged. Runs against the configured database with a throwaway
+# rater and test that are removed afterwards.
+
+
+def rating_fields(rater_id, test_id, n):
+    return {
+        'rater_id': rater_id,
+        'test_id': test_id,
+        'results_json': {'benchmark': 'ingest', 'page': n, 'audios': [{'url': f"audio_{n}.wav", 'score': 50}]},
+        'time_taken_to_submit': 1000,
+        'page_no_progress': str(n),
+    }
+
+
+def run_sync(rater_id, test_id, count, workers):
+    def submit(n):
+        with app.app_context():
+            rating = Rating(**rating_fields(rater_id, test_id, n))
+            db.session.add(rating)
+            db.session.flush()
+            insert_scores([rating])
+            record_progress([rating])
+            db.session.commit()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(submit, range(count)))
+    return time.perf_counter() - start, None
+
+
+def run_journal(rater_id, test_id, count, workers, flush_interval):
+    directory = tempfile.mkdtemp(prefix='rating_journal_')
+    ingestor = RatingIngestor(app, RatingJournal(directory), flush_interval=flush_interval)
+    ingestor.start()
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda n: ingestor.submit(rating_fields(rater_id, test_id, n)), range(count)))
+        acknowledged = time.perf_counter() - start
+        ingestor.stop()  # Waits for the final flush
+        return time.perf_counter() - start, acknowledged
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark synchronous vs write-behind rating ingestion')
+    parser.add_argument('--ratings', type=int, default=5000, help='Ratings to submit per mode')
+    parser.add_argument('--workers', type=int, default=32, help='Concurrent submitters')
+    parser.add_argument('--flush-interval', type=float, default=0.2, help='Seconds between journal flushes')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with app.app_context():
+        rater = Rater(name=f"ingest_benchmark_{os.getpid()}", age=0, gender='Unknown',
+                      email=f"ingest_benchmark_{os.getpid()}", password='-')
+        test = Test(test_type='mushra', description='Rating ingestion benchmark', json_entry=[], item_count=0)
+        db.session.add_all([rater, test])
+        db.session.commit()
+        rater_id, test_id = rater.id, test.id
+
+    results = {'ratings': args.ratings, 'workers': args.workers, 'dialect': db.engine.dialect.name}
+    try:
+        for mode in ('sync', 'journal'):
+            if mode == 'sync':
+                elapsed, acknowledged = run_sync(rater_id, test_id, args.ratings, args.workers)
+            else:
+                elapsed, acknowledged = run_journal(rater_id, test_id, args.ratings, args.workers,
+                                                    args.flush_interval)
+            results[mode] = {'seconds': round(elapsed, 3), 'ratings_per_second': round(args.ratings / elapsed, 1)}
+            if acknowledged is not None:
+                results[mode]['acknowledged_per_second'] = round(args.ratings / acknowledged, 1)
+            print(f"{mode:8} {results[mode]['ratings_per_second']:>10.1f} ratings/s"
+                  + (f"  ({results[mode]['acknowledged_per_second']:.1f}/s acknowledged)"
+                     if acknowledged is not None else ''))
+    finally:
+        with app.app_context():
+            stored = Rating.query.filter_by(test_id=test_id).count()
+            RatingScore.query.filter_by(test_id=test_id).delete()
+            Progress.query.filter_by(test_id=test_id).delete()
+            Rating.query.filter_by(test_id=test_id).delete()
+            Test.query.filter_by(id=test_id).delete()
+            Rater.query.filter_by(id=rater_id).delete()
+            db.session.commit()
+
+    results['stored'] = stored
+    print(f"stored {stored} of {2 * args.ratings} ratings")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if stored == 2 * args.ratings else 1)
+
+
+if __name__ == '__main__':
+    main()
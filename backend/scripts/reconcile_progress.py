@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.database import db
+from application.models import Progress
+from application.progress import rebuild_progress
+from main import app
+
+# Rebuilds the progress counters from the ratings themselves, in one
+# transaction per run. The counters are kept up to date with every rating, so
+# this is only needed after ratings were changed outside the API (manual
+# deletes, restores). Safe to run at any time, e.g. from cron.
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild per-(rater, test) progress from the ratings')
+    parser.add_argument('--test-id', type=int, help='Only this test')
+    parser.add_argument('--check', action='store_true',
+                      help='Only report how many rows differ, roll back instead of committing')
+    args = parser.parse_args()
+
+    with app.app_context():
+        query = db.session.query(Progress.rater_id, Progress.test_id, Progress.completed,
+                                 Progress.time_of_completion)
+        if args.test_id is not None:
+            query = query.filter(Progress.test_id == args.test_id)
+        before = set(query.all())
+        rows = rebuild_progress(args.test_id)
+        after = set(query.all())
+        changed = len(before ^ after) // 2 + abs(len(before) - len(after))
+        if args.check:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        print(f"{rows} progress rows rebuilt, about {changed} differed"
+              f"{' (check only, nothing written)' if args.check else ''}")
+    sys.exit(1 if args.check and changed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Streams a database dump through compression straight into blob storage, without
+# a copy on local disk:
+#
+#   pg_dump -> gzip (or zstd) -> fixed-size blocks -> N concurrent block uploads -> commit
+#
+# Blocks are staged first and become the backup only when the block list is committed,
+# after the dump command exited successfully, so a failed run never leaves a truncated
+# backup behind. Block ids carry the SHA-256 of their content: re-running an interrupted
+# upload of an identical input (a file, --input) under the same name skips every block
+# that is already staged. A fresh pg_dump of a live database differs from the previous
+# one from its first changed row on, so a retried dump is in effect uploaded again. The SHA-256 of the
+# whole compressed stream is stored with the backup and checked by `verify`.
+#
+# Targets are Azure Blob Storage (AZURE_ACCOUNT_URL/CREDENTIAL/DATABASE_CONTAINER as for
+# database_bkp.py, or AZURE_STORAGE_CONNECTION_STRING, e.g. for the Azurite emulator) or
+# a local directory (--dir), which behaves the same way and is what tests and dry runs use.
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+DEFAULT_WORKERS = 8
+READ_SIZE = 1024 * 1024
+
+logger = logging.getLogger('stream_backup')
+
+
+def block_id(index, data):
+    # Azure wants ids of equal length within a blob
+    return f"{index:06d}-{hashlib.sha256(data).hexdigest()[:32]}"
+
+
+class FilesystemTarget:
+    """Blocks staged as files under <directory>/<name>.blocks/, committed by concatenation."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _blocks_dir(self, name):
+        return os.path.join(self.directory, f"{name}.blocks")
+
+    def staged_blocks(self, name):
+        try:
+            return set(os.listdir(self._blocks_dir(name)))
+        except FileNotFoundError:
+            return set()
+
+    def stage_block(self, name, block, data, md5):
+        directory = self._blocks_dir(name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, block)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        with open(path + '.tmp', 'rb') as f:
+            if hashlib.md5(f.read()).digest() != md5:  # Same check the blob service makes
+                raise IOError(f"Checksum mismatch staging block {block}")
+        os.replace(path + '.tmp', path)
+
+    def commit(self, name, blocks, metadata):
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'wb') as out:
+            for block in blocks:
+                with open(os.path.join(self._blocks_dir(name), block), 'rb') as f:
+                    out.write(f.read())
+        os.replace(path + '.tmp', path)
+        with open(path + '.json', 'w') as f:
+            json.dump(metadata, f, indent=2)
+        for block in self.staged_blocks(name):
+            os.remove(os.path.join(self._blocks_dir(name), block))
+        os.rmdir(self._blocks_dir(name))
+        return path
+
+    def metadata(self, name):
+        with open(os.path.join(self.directory, name + '.json')) as f:
+            return json.load(f)
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            yield from iter(lambda: f.read(READ_SIZE), b'')
+
+
+class AzureBlobTarget:
+    """A block blob: stage_block per block, commit_block_list at the end."""
+
+    def __init__(self, container):
+        from azure.storage.blob import BlobServiceClient
+        from dotenv import load_dotenv
+        load_dotenv('.env')
+        connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
+        if connection_string:
+            self.service = BlobServiceClient.from_connection_string(connection_string)
+            self.credential = None
+        else:
+            account_url, self.credential = os.environ.get('AZURE_ACCOUNT_URL'), os.environ.get('CREDENTIAL')
+            if not account_url or not self.credential:
+                raise SystemExit('Set AZURE_ACCOUNT_URL and CREDENTIAL, or AZURE_STORAGE_CONNECTION_STRING')
+            self.service = BlobServiceClient(account_url=account_url, credential=self.credential)
+        self.container = container or os.environ.get('DATABASE_CONTAINER')
+        if not self.container:
+            raise SystemExit('Set DATABASE_CONTAINER or pass --container')
+
+    def _blob(self, name):
+        return self.service.get_blob_client(self.container, name)
+
+    def staged_blocks(self, name):
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            _, uncommitted = self._blob(name).get_block_list('uncommitted')
+        except ResourceNotFoundError:
+            return set()
+        return {block.id for block in uncommitted}
+
+    def stage_block(self, name, block, data, md5):
+        # validate_content sends the MD5 and the service rejects a block that arrives damaged
+        self._blob(name).stage_block(block, data, length=len(data), validate_content=True)
+
+    def commit(self, name, blocks, metadata):
+        from azure.storage.blob import BlobBlock
+        blob = self._blob(name)
+        blob.commit_block_list([BlobBlock(block_id=block) for block in blocks],
+                               metadata={key: str(value) for key, value in metadata.items()})
+        return self._download_url(name) or blob.url
+
+    def _download_url(self, name):
+        """A read-only SAS URL, valid for 120 days, when the credential is an account key."""
+        if not self.credential:
+            return None
+        from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+        try:
+            sas = generate_blob_sas(account_name=self.service.account_name, container_name=self.container,
+                                    blob_name=name, account_key=self.credential,
+                                    permission=BlobSasPermissions(read=True),
+                                    expiry=datetime.utcnow() + timedelta(days=120))
+        except (ValueError, TypeError, base64.binascii.Error):
+            return None
+        return f"{self._blob(name).url}?{sas}"
+
+    def metadata(self, name):
+        return dict(self._blob(name).get_blob_properties().metadata)
+
+    def read(self, name):
+        yield from self._blob(name).download_blob().chunks()
+
+
+def compressor(kind):
+    """An object with compress(bytes) and flush(), producing a single stream."""
+    if kind == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip header, no timestamp
+    if kind == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def decompressor(kind):
+    if kind == 'gzip':
+        return zlib.decompressobj(31)
+    if kind == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def compressed_chunks(stream, kind):
+    compress = compressor(kind)
+    for chunk in iter(lambda: stream.read(READ_SIZE), b''):
+        yield chunk, compress.compress(chunk) if compress else chunk
+    if compress:
+        yield b'', compress.flush()
+
+
+def upload(stream, target, name, compression='gzip', block_size=DEFAULT_BLOCK_SIZE, workers=DEFAULT_WORKERS,
+           producer=None):
+    """
+    Upload stream as the backup name. Blocks are uploaded by workers threads while the
+    stream is read; at most 2 * workers blocks are held in memory. producer, if given,
+    is the process writing the stream: nothing is committed unless it exits with 0.
+    Returns what target.commit returns (a path or URL).
+    """
+    staged = target.staged_blocks(name)
+    if staged:
+        logger.info('Resuming %s: %d blocks already staged', name, len(staged))
+
+    raw_bytes = compressed_bytes = skipped = 0
+    stream_hash = hashlib.sha256()
+    blocks, pending, buffer = [], [], bytearray()
+    slots = threading.BoundedSemaphore(2 * workers)
+
+    def stage(block, data):
+        try:
+            target.stage_block(name, block, data, hashlib.md5(data).digest())
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def flush_block(data):
+            nonlocal skipped
+            block = block_id(len(blocks), data)
+            blocks.append(block)
+            if block in staged:
+                skipped += 1
+                return
+            slots.acquire()
+            pending.append(pool.submit(stage, block, data))
+
+        for raw, compressed in compressed_chunks(stream, compression):
+            raw_bytes += len(raw)
+            compressed_bytes += len(compressed)
+            stream_hash.update(compressed)
+            buffer += compressed
+            while len(buffer) >= block_size:
+                flush_block(bytes(buffer[:block_size]))
+                del buffer[:block_size]
+            # Surface upload errors early instead of after reading the whole dump
+            for future in [future for future in pending if future.done()]:
+                future.result()
+                pending.remove(future)
+        if buffer or not blocks:
+            flush_block(bytes(buffer))
+        for future in pending:
+            future.result()
+
+    if producer is not None:
+        if producer.wait() != 0:
+            raise RuntimeError(f"Dump command exited with {producer.returncode}, backup not committed "
+                               f"(staged blocks are kept for a retry)")
+
+    metadata = {
+        'sha256': stream_hash.hexdigest(),
+        'compression': compression,
+        'raw_bytes': raw_bytes,
+        'compressed_bytes': compressed_bytes,
+        'blocks': len(blocks),
+        'created': datetime.utcnow().isoformat(timespec='seconds'),
+    }
+    location = target.commit(name, blocks, metadata)
+    logger.info('Committed %s: %d blocks (%d reused), %d bytes -> %d bytes (%s), sha256 %s',
+                name, len(blocks), skipped, raw_bytes, compressed_bytes, compression, metadata['sha256'])
+    return location
+
+
+def verify(target, name):
+    """Re-read a committed backup, check its SHA-256 and that it decompresses. Returns the metadata."""
+    metadata = target.metadata(name)
+    stream_hash = hashlib.sha256()
+    decompress = decompressor(metadata.get('compression'))
+    raw_bytes = compressed_bytes = 0
+    for chunk in target.read(name):
+        stream_hash.update(chunk)
+        compressed_bytes += len(chunk)
+        raw_bytes += len(decompress.decompress(chunk)) if decompress else len(chunk)
+    problems = []
+    if stream_hash.hexdigest() != metadata.get('sha256'):
+        problems.append(f"sha256 {stream_hash.hexdigest()} != {metadata.get('sha256')}")
+    if int(metadata.get('compressed_bytes', compressed_bytes)) != compressed_bytes:
+        problems.append(f"{compressed_bytes} bytes stored, {metadata.get('compressed_bytes')} expected")
+    if int(metadata.get('raw_bytes', raw_bytes)) != raw_bytes:
+        problems.append(f"{raw_bytes} bytes after decompression, {metadata.get('raw_bytes')} expected")
+    if decompress is not None and not getattr(decompress, 'eof', True):
+        problems.append('compressed stream is truncated')
+    if problems:
+        raise RuntimeError(f"{name} failed verification: {'; '.join(problems)}")
+    return metadata
+
+
+def make_target(args):
+    return FilesystemTarget(args.dir) if args.dir else AzureBlobTarget(args.container)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming, compressed, chunked database backups')
+    parser.add_argument('--dir', help='Local directory target instead of Azure Blob Storage')
+    parser.add_argument('--container', help='Blob container, defaults to DATABASE_CONTAINER')
+    parser.add_argument('--log-file', help='Append log messages to this file')
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    upload_parser = commands.add_parser('upload', help='Upload a dump as it is produced')
+    upload_parser.add_argument('--name', required=True, help='Blob (or file) name of the backup')
+    source = upload_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--command', help='Dump command to run, e.g. "pg_dump -d saffron"')
+    source.add_argument('--input', help='File to upload, - for stdin')
+    upload_parser.add_argument('--compression', choices=['gzip', 'zstd', 'none'], default='gzip')
+    upload_parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE // (1024 * 1024),
+                               help='Block size in MiB')
+    upload_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent block uploads')
+    upload_parser.add_argument('--verify', action='store_true', help='Read the backup back and verify it')
+
+    verify_parser = commands.add_parser('verify', help='Check the checksum of a committed backup')
+    verify_parser.add_argument('--name', required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log_file, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    target = make_target(args)
+    try:
+        if args.action == 'upload':
+            producer = None
+            if args.command:
+                producer = subprocess.Popen(shlex.split(args.command), stdout=subprocess.PIPE)
+                stream = producer.stdout
+            elif args.input == '-':
+                stream = sys.stdin.buffer
+            else:
+                stream = open(args.input, 'rb')
+            with stream:
+                location = upload(stream, target, args.name, args.compression,
+                                  args.block_size * 1024 * 1024, args.workers, producer)
+            logger.info('Backup available at %s', location)
+            if args.verify:
+                verify(target, args.name)
+                logger.info('Verified %s', args.name)
+        else:
+            metadata = verify(target, args.name)
+            logger.info('Verified %s (%s bytes, sha256 %s)', args.name, metadata['raw_bytes'], metadata['sha256'])
+    except Exception as e:
+        logger.error('Backup %s failed: %s', args.action, e)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
+# Example usage:
+# python scripts/stream_backup.py upload --name saffron-$(date +%F).sql.gz --command "pg_dump -d saffron" --verify
+# python scripts/stream_backup.py --dir /var/backups/saffron upload --name test.sql.gz --input dump.sql
+# python scripts/stream_backup.py verify --name saffron-2024-05-01.sql.gz
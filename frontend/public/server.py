@@ -1,15 +1,238 @@
-from flask import Flask, send_from_directory
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
+import re
+import statistics
+import time
+from email.utils import formatdate
+from flask import Flask, Response, abort, request, send_from_directory
 
-app = Flask(__name__, static_folder='.')
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    if path != "" and os.path.exists(path):
-        return send_from_directory(os.path.dirname(path), os.path.basename(path))
-    else:
-        return send_from_directory(app.static_folder, 'index.html')
+# Serves the built app (frontend/dist, where this file is copied by `npm run build`).
+# Every file is read once at startup into an in-memory manifest together with gzip
+# and brotli variants, so a request is a dictionary lookup: no filesystem access,
+# no compression. Run it with `python server.py` or `gunicorn -w 2 server:app`.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Files Vite names after their content never change and are cached for good. They are
+# listed in the build manifest (build.manifest in vite.config.js); without one, names
+# of the form assets/<name>-<8 character hash>.<ext> are taken as hashed, where the hash
+# holds a digit or an uppercase letter (so e.g. assets/apple-touch-icon.png is not)
+VITE_MANIFEST = '.vite/manifest.json'
+HASHED_NAME = re.compile(r'^assets/.+-(?=[A-Za-z0-9_-]*[0-9A-Z])[A-Za-z0-9_-]{8}\.[a-z0-9]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                      'application/wasm', 'application/xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+MIN_COMPRESS_SIZE = 1024
+# Larger files (e.g. media) are served from disk instead of being held in memory
+MAX_CACHED_SIZE = 16 * 1024 * 1024
+
+mimetypes.add_type('application/javascript', '.js')
+mimetypes.add_type('application/javascript', '.mjs')
+
+
+class Asset:
+    __slots__ = ('path', 'mimetype', 'variants', 'etag', 'last_modified', 'cache_control')
+
+    def __init__(self, path, data, last_modified, hashed=False):
+        self.path = path
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self.last_modified = last_modified
+        self.cache_control = IMMUTABLE if hashed else REVALIDATE
+        # encoding -> body, identity always present; a variant is only kept if it is smaller
+        self.variants = {'identity': data}
+        if len(data) >= MIN_COMPRESS_SIZE and self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            candidates = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates['br'] = brotli.compress(data, quality=11)
+            for encoding, body in candidates.items():
+                if len(body) < len(data):
+                    self.variants[encoding] = body
+
+
+def hashed_files(root):
+    """Paths of the content-hashed files according to Vite's build manifest, None without one."""
+    try:
+        with open(os.path.join(root, VITE_MANIFEST)) as f:
+            chunks = json.load(f)
+    except FileNotFoundError:
+        return None
+    hashed = set()
+    for chunk in chunks.values():
+        hashed.add(chunk['file'])
+        hashed.update(chunk.get('css', []))
+        hashed.update(chunk.get('assets', []))
+    return hashed
+
+
+def is_public(relative):
+    """Whether a file under root is part of the app, as opposed to this server and the build manifest."""
+    return relative != 'server.py' and not relative.endswith('.pyc') and '__pycache__' not in relative.split('/') \
+        and not relative.startswith('.vite/')
+
+
+def build_manifest(root):
+    """Relative URL path -> Asset for every file under root small enough to keep in memory."""
+    hashed = hashed_files(root)
+    manifest = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            if not is_public(relative) or os.path.getsize(path) > MAX_CACHED_SIZE:
+                continue
+            with open(path, 'rb') as f:
+                manifest[relative] = Asset(relative, f.read(), os.path.getmtime(path),
+                                           relative in hashed if hashed is not None else bool(HASHED_NAME.match(relative)))
+    return manifest
+
+
+def accepted_encodings(header):
+    """Encodings the client accepts (q > 0), from an Accept-Encoding header."""
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+def choose_encoding(asset, header):
+    if len(asset.variants) == 1:
+        return 'identity'
+    accepted = accepted_encodings(header)
+    for encoding in ('br', 'gzip'):
+        if encoding in asset.variants and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
+
+
+def is_file_path(path):
+    """Paths that name a file (assets/..., something.ext) get a 404 instead of the app when missing."""
+    return path.startswith('assets/') or '.' in path.rsplit('/', 1)[-1]
+
+
+def create_app(root=ROOT):
+    app = Flask(__name__, static_folder=None)
+    manifest = build_manifest(root)
+    index = manifest.get('index.html')
+    app.config['MANIFEST'] = manifest
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        asset = manifest.get(path)
+        if asset is None:
+            if is_file_path(path):
+                if is_public(path) and os.path.isfile(os.path.join(root, path)):
+                    return send_from_directory(root, path)  # Too large for the manifest
+                abort(404)
+            asset = index  # Client-side route of the SPA
+            if asset is None:
+                abort(404)
+
+        encoding = choose_encoding(asset, request.headers.get('Accept-Encoding', ''))
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        if len(asset.variants) > 1:
+            response.vary.add('Accept-Encoding')
+        # Each encoding is a different representation, so it gets its own strong ETag
+        response.set_etag(asset.etag if encoding == 'identity' else f"{asset.etag}-{encoding}")
+        response.headers['Last-Modified'] = formatdate(asset.last_modified, usegmt=True)
+        response.headers['Cache-Control'] = asset.cache_control
+        return response.make_conditional(request)
+
+    return app
+
+
+def create_legacy_app(root=ROOT):
+    """The previous server: a filesystem check and a read from disk on every request."""
+    app = Flask(__name__, static_folder=root)
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        full_path = os.path.join(root, path)
+        if path != "" and os.path.exists(full_path):
+            return send_from_directory(os.path.dirname(full_path), os.path.basename(full_path))
+        else:
+            return send_from_directory(app.static_folder, 'index.html')
+
+    return app
+
+
+def benchmark(root, rounds):
+    """Fetch every file and a few app routes from both servers, as a browser would, and compare."""
+    manifest = build_manifest(root)
+    paths = ['/' + path for path in manifest] + ['/', '/login', '/test/1', '/prolific']
+    scenarios = {
+        'first visit': {'Accept-Encoding': 'gzip, deflate, br'},
+        'revalidation': {'Accept-Encoding': 'gzip, deflate, br', 'revalidate': True},
+    }
+    for name, app in (('legacy', create_legacy_app(root)), ('manifest', create_app(root))):
+        client = app.test_client()
+        for scenario, headers in scenarios.items():
+            latencies, transferred, not_modified = [], 0, 0
+            headers = dict(headers)
+            revalidate = headers.pop('revalidate', False)
+            validators = {}
+            if revalidate:
+                for path in paths:
+                    first = client.get(path, headers=headers)
+                    validators[path] = {key: value for key, value in
+                                        (('If-None-Match', first.headers.get('ETag')),
+                                         ('If-Modified-Since', first.headers.get('Last-Modified'))) if value}
+            started = time.perf_counter()
+            for _ in range(rounds):
+                for path in paths:
+                    request_started = time.perf_counter()
+                    response = client.get(path, headers={**headers, **validators.get(path, {})})
+                    body = response.get_data()
+                    latencies.append(time.perf_counter() - request_started)
+                    transferred += len(body)
+                    not_modified += response.status_code == 304
+            wall = time.perf_counter() - started
+            latencies.sort()
+            print(f"{name:9} {scenario:13} {len(latencies) / wall:9.0f} req/s  "
+                  f"p50 {statistics.median(latencies) * 1000:6.3f} ms  "
+                  f"p99 {latencies[min(int(0.99 * len(latencies)), len(latencies) - 1)] * 1000:6.3f} ms  "
+                  f"{transferred / rounds / 1024:9.1f} KiB per round  {not_modified // rounds} x 304")
+
+
+app = create_app()
 
 if __name__ == '__main__':
-    app.run(port=5175, host='0.0.0.0')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Serve the built frontend')
+    parser.add_argument('--port', type=int, default=5175)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare request throughput and bytes sent with the previous server, then exit')
+    parser.add_argument('--rounds', type=int, default=200, help='Rounds over all files for --benchmark')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(ROOT, args.rounds)
+    else:
+        manifest = app.config['MANIFEST']
+        print(f"{len(manifest)} files in memory, "
+              f"{sum(len(asset.variants) - 1 for asset in manifest.values())} precompressed variants"
+              f"{'' if brotli else ' (gzip only, install brotli for br)'}")
+        app.run(port=args.port, host=args.host, threaded=True)
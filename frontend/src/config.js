@@ -1 +1,6 @@
 export const API_BASE_URL = import.meta.env.VITE_API_BASE_URL;
+
+// Audio stored by the backend's asset store has URLs like /api/static/audio/<sha256>.wav,
+// relative to the API server rather than to this app
+export const assetUrl = (url) =>
+  typeof url === 'string' && url.startsWith('/api/') && API_BASE_URL ? new URL(url, API_BASE_URL).href : url;
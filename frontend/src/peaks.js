@@ -0,0 +1,41 @@
+import { assetUrl } from '@/config';
+
+// Waveform peaks precomputed by the backend (application/peaks.py): a 24-byte header
+// (magic "WFPK", version, bits, sample rate, samples per point, points, duration),
+// then the maxima and the minima of every point as signed 8-bit values.
+const HEADER_SIZE = 24;
+const peaksCache = new Map();
+
+export const parsePeaks = (buffer) => {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'WFPK' || view.getUint16(4, true) !== 1 || view.getUint16(6, true) !== 8) {
+    return null;
+  }
+  const points = view.getUint32(16, true);
+  const duration = view.getFloat32(20, true);
+  const values = new Int8Array(buffer, HEADER_SIZE, 2 * points);
+  const toFloat = (array) => Float32Array.from(array, (value) => value / 127);
+  // WaveSurfer draws the first channel above the axis and the second one below it
+  return { channels: [toFloat(values.subarray(0, points)), toFloat(values.subarray(points))], duration };
+};
+
+export const fetchPeaks = (url) => {
+  if (!url) {
+    return Promise.resolve(null);
+  }
+  if (!peaksCache.has(url)) {
+    peaksCache.set(url, fetch(assetUrl(url))
+      .then((response) => (response.ok ? response.arrayBuffer() : null))
+      .then((buffer) => (buffer ? parsePeaks(buffer) : null))
+      .catch(() => null));
+  }
+  return peaksCache.get(url);
+};
+
+// Load a clip into a WaveSurfer instance. With peaks the waveform is drawn at once and
+// the audio is only streamed when played; without them WaveSurfer decodes the whole clip.
+export const loadWaveform = async (wavesurfer, url, peaksUrl) => {
+  const peaks = await fetchPeaks(peaksUrl);
+  return wavesurfer.load(assetUrl(url), peaks?.channels, peaks?.duration);
+};